@@ -10,14 +10,17 @@ from config.ldap_config import configure_ldap
 from config.log_config import configure_logging
 from config.auth_config import configure_login
 from config.mqtt_config import configure_mqtt
+from services.log_search_service import start_search_indexer
 
 from routes.auth import auth_bp
 from routes.logs import logs_bp
+from routes.api import api_bp
 
 
-def create_app():
+def create_app(mqtt_client=None):
     """
     Crea e configura l'istanza dell'applicazione Flask.
+    `mqtt_client` sostituisce la connessione al broker (es. con il broker finto dei benchmark).
     """
     
     load_dotenv()
@@ -26,6 +29,8 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'devsecretkey')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Cartella dei file di log (di default app/logs)
+    app.config['LOG_DIR'] = os.getenv('LOG_DIR') or os.path.join(app.root_path, 'logs')
     
     # Inizializza CSRF protection
     CSRFProtect(app)
@@ -38,10 +43,11 @@ def create_app():
     configure_ldap(app)
 
     #Configurazione MQTT
-    configure_mqtt(app)
+    configure_mqtt(app, client=mqtt_client)
     
     # Serve initializzazione del gestore MQTT
     from routes.modules import modules_bp
+    from services.mqtt_service import module_registry, start_heartbeat_monitor, start_ingest_server, start_retained_resync
 
     # Configurazioni del gestore di login
     ldap_manager = LDAP3LoginManager(app)
@@ -50,14 +56,27 @@ def create_app():
     # Configurazione del logging
     configure_logging(app)
 
+    # Sincronizzazione periodica dell'indice di ricerca dei log
+    start_search_indexer(app, app.config['LOG_DIR'])
+
     # Registrazione dei Blueprint
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(modules_bp, url_prefix='/')
     app.register_blueprint(logs_bp, url_prefix='/logs')
+    app.register_blueprint(api_bp, url_prefix='/api')
 
     with app.app_context():
         db.create_all()  # Crea le tabelle del database se non esistono
 
+    # Caricamento del registro dei moduli in memoria e avvio della scadenza degli heartbeat
+    module_registry.start()
+    start_heartbeat_monitor()
+    # Ripubblicazione delle configurazioni retained ad ogni connessione al broker (se MQTT_RETAIN_CONFIGS)
+    start_retained_resync()
+
+    # Nel processo di ingestione (MQTT_ROLE=ingest) accetta le pubblicazioni dei worker web
+    start_ingest_server()
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,373 @@
+"""
+Simulatore di flotta e test di carico dell'ingestione MQTT: N moduli virtuali parlano il protocollo
+reale (new_connection, last_will, on_module_update/<mac>) con services/mqtt_service, su un broker
+finto in-process (default, nessuna rete) oppure su un broker locale.
+
+Scenari, eseguiti in sequenza:
+    storm   tutti i moduli inviano new_connection insieme (primo avvio o riavvio del broker)
+    flap    una parte dei moduli si disconnette (last_will) e si riconnette più volte
+    edit    raffiche di modifiche dall'interfaccia (update del registro + publish della configurazione)
+
+Per ogni scenario riporta throughput di ingestione, percentili della latenza end-to-end
+(dall'evento alla ricezione della configurazione da parte del modulo) e commit sul database;
+alla fine verifica che la configurazione ricevuta da ogni modulo coincida con quella salvata.
+Esce con codice 1 se dei moduli restano senza configurazione, se ci sono discrepanze o se il p95
+supera --max-p95-ms, così da poter essere usato come controllo prima di un rilascio.
+
+Uso (dalla cartella app/):
+    python -m benchmarks.bench_fleet --devices 2000 --flap-ratio 0.1 --edit-bursts 5
+    python -m benchmarks.bench_fleet --broker localhost:1883 --devices 500
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import event
+
+from benchmarks.fake_mqtt import FakeMqtt
+from config.mqtt_config import configure_mqtt, NEW_CONNECTION_TOPIC, ON_MODULE_UPDATE_TOPIC, LAST_WILL_TOPIC, GROUP_UPDATE_TOPIC
+from models.conn import db
+from services import wire_format_service as wire
+
+
+class Fleet:
+    """
+    Moduli virtuali: inviano gli eventi tramite il trasporto e registrano le configurazioni ricevute.
+    """
+
+    def __init__(self, transport, devices, binary_ratio, seed):
+        rng = random.Random(seed)
+        self.transport = transport
+        # MAC localmente amministrati, per non collidere con moduli reali
+        self.macs = [f"02{index:010X}" for index in range(devices)]
+        self.types = {mac: 'numeric' if rng.random() < 0.5 else 'arrow' for mac in self.macs}
+        self.formats = {mac: ['bin1', 'json'] if rng.random() < binary_ratio else ['json'] for mac in self.macs}
+        self.configs = {}
+        self.received = 0
+        self._waiting = {}
+        self._latencies = []
+        self._lock = threading.Lock()
+        transport.add_listener(self._on_message)
+
+    def expect(self, mac):
+        """
+        Segna l'istante da cui il modulo attende una nuova configurazione (il primo, se già in attesa).
+        """
+        with self._lock:
+            self._waiting.setdefault(mac, time.perf_counter())
+
+    def connect(self, mac):
+        self.expect(mac)
+        self.transport.inject(NEW_CONNECTION_TOPIC, json.dumps({'mac': mac, 'type': self.types[mac], 'formats': self.formats[mac]}))
+
+    def disconnect(self, mac):
+        # Con un broker reale il last will verrebbe pubblicato dal broker alla caduta della connessione
+        self.transport.inject(LAST_WILL_TOPIC, json.dumps({'mac': mac}))
+
+    def waiting(self):
+        with self._lock:
+            return len(self._waiting)
+
+    def take_latencies(self):
+        with self._lock:
+            latencies, self._latencies = self._latencies, []
+        return latencies
+
+    def _on_message(self, topic, payload):
+        prefix = f"{ON_MODULE_UPDATE_TOPIC}/"
+        if not topic.startswith(prefix) or topic.startswith(f"{GROUP_UPDATE_TOPIC}/"):
+            return
+        mac = topic[len(prefix):]
+        if isinstance(payload, str):
+            payload = payload.encode()
+        # Come il firmware: un payload binario inizia con il byte di versione, un JSON con '{'
+        config = wire.decode_binary(payload) if payload[:1] == bytes([wire.BINARY_VERSION]) else json.loads(payload)
+
+        now = time.perf_counter()
+        with self._lock:
+            self.configs[mac] = config
+            self.received += 1
+            sent_at = self._waiting.pop(mac, None)
+            if sent_at is not None:
+                self._latencies.append(now - sent_at)
+
+
+class PahoTransport:
+    """
+    Trasporto dei moduli virtuali su un broker reale, con un'unica connessione per tutta la flotta.
+    """
+
+    def __init__(self, host, port):
+        import paho.mqtt.client as paho
+
+        self._listeners = []
+        self._connected = threading.Event()
+        self.client = paho.Client(client_id=f"bench-fleet-{os.getpid()}")
+        self.client.on_connect = self._on_connect
+        self.client.on_message = lambda client, userdata, message: [listener(message.topic, message.payload) for listener in self._listeners]
+        self.client.connect(host, port)
+        self.client.loop_start()
+        if not self._connected.wait(10):
+            raise RuntimeError(f"Unable to connect to the MQTT broker at {host}:{port}")
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(f"{ON_MODULE_UPDATE_TOPIC}/#", qos=1)
+        self._connected.set()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def inject(self, topic, payload, qos=1):
+        self.client.publish(topic, payload, qos=qos)
+
+    def idle(self):
+        return True
+
+
+def _create_app(db_path, client):
+    """
+    Applicazione minima con il solo stack MQTT del server (niente LDAP né blueprint).
+    """
+    app = Flask('bench_fleet')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    configure_mqtt(app, client=client)
+
+    from services import mqtt_service
+    with app.app_context():
+        db.create_all()
+    mqtt_service.module_registry.start()
+    mqtt_service.start_heartbeat_monitor()
+    return app, mqtt_service
+
+
+class CommitCounter:
+
+    def __init__(self, engine):
+        self.commits = 0
+        event.listen(engine, 'commit', self._on_commit)
+
+    def _on_commit(self, connection):
+        self.commits += 1
+
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return round(sorted_samples[index] * 1000, 3)
+
+
+def _processed(mqtt_service, transport):
+    if mqtt_service.ingest_pool is not None:
+        return mqtt_service.ingest_pool.stats()['processed']
+    return getattr(transport, 'handled', None)
+
+
+def _wait_settled(fleet, transport, timeout, quiet):
+    """
+    Attende che tutti i moduli abbiano ricevuto la configurazione attesa, oppure che non arrivi
+    più nulla per `quiet` secondi (i moduli ancora in attesa vengono riportati come senza risposta).
+    """
+    deadline = time.perf_counter() + timeout
+    last_received, last_change = fleet.received, time.perf_counter()
+    while time.perf_counter() < deadline:
+        if fleet.waiting() == 0 and transport.idle():
+            return
+        if fleet.received != last_received:
+            last_received, last_change = fleet.received, time.perf_counter()
+        elif time.perf_counter() - last_change > quiet and transport.idle():
+            return
+        time.sleep(0.01)
+
+
+def _run_phase(name, action, fleet, transport, mqtt_service, commits, args):
+    commits_before = commits.commits
+    processed_before = _processed(mqtt_service, transport)
+    fleet.take_latencies()
+
+    start = time.perf_counter()
+    events = action()
+    _wait_settled(fleet, transport, args.timeout, args.quiet_ms / 1000)
+    # Le scritture di presenza sono differite: le include nei commit dello scenario
+    mqtt_service.presence_buffer.flush()
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(fleet.take_latencies())
+    processed_after = _processed(mqtt_service, transport)
+    ingested = processed_after - processed_before if processed_before is not None else None
+    phase_commits = commits.commits - commits_before
+    return {
+        'scenario': name,
+        'events': events,
+        'seconds': round(elapsed, 3),
+        'ingest_msgs_per_sec': round(ingested / elapsed) if ingested is not None else None,
+        'configs_received': len(latencies),
+        'unanswered': fleet.waiting(),
+        'latency_ms': {
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'max': _percentile(latencies, 1.0),
+        },
+        'db_commits': phase_commits,
+        'db_commits_per_sec': round(phase_commits / elapsed, 1),
+    }
+
+
+def _storm(fleet, rate):
+    """
+    Tutti i moduli si connettono; con rate > 0 al massimo `rate` connessioni al secondo.
+    """
+    interval = 1 / rate if rate > 0 else 0
+    for mac in fleet.macs:
+        fleet.connect(mac)
+        if interval:
+            time.sleep(interval)
+    return len(fleet.macs)
+
+
+def _flap(fleet, rng, ratio, flaps, gap):
+    flapping = rng.sample(fleet.macs, int(len(fleet.macs) * ratio))
+    for _ in range(flaps):
+        for mac in flapping:
+            fleet.disconnect(mac)
+        if gap:
+            time.sleep(gap)
+        for mac in flapping:
+            fleet.connect(mac)
+    return len(flapping) * flaps * 2
+
+
+def _edit_bursts(fleet, app, mqtt_service, rng, bursts, burst_size):
+    """
+    Raffiche di modifiche come quelle dell'interfaccia web: ogni modifica aggiorna il registro
+    e pubblica la configurazione (soggetta a coalescenza se ravvicinata).
+    """
+    edits = 0
+    with app.app_context():
+        modules = mqtt_service.module_registry.get_all()
+        for burst in range(bursts):
+            for module in rng.sample(modules, min(burst_size, len(modules))):
+                fleet.expect(module.mac)
+                # Un colore diverso ad ogni raffica, così che nessuna modifica venga soppressa come duplicata
+                color = f"#{(burst * 7919 + module.id) % 0xFFFFFF:06x}"
+                updated = mqtt_service.module_registry.update_module(module.id, color=color, on=True)
+                if updated:
+                    mqtt_service.publish_new_configuration(updated)
+                    edits += 1
+    return edits
+
+
+def _verify(fleet, app, mqtt_service):
+    """
+    Confronta la configurazione ricevuta da ogni modulo con quella salvata, e lo stato online.
+    """
+    mismatches = []
+    with app.app_context():
+        modules = {module.mac: module for module in mqtt_service.module_registry.get_all()}
+    for mac in fleet.macs:
+        module = modules.get(mac)
+        if module is None:
+            mismatches.append(f"{mac}: not registered")
+            continue
+        expected = mqtt_service._configuration_payload(module)
+        received = fleet.configs.get(mac)
+        if received != expected:
+            mismatches.append(f"{mac}: received {received}, expected {expected}")
+        elif not module.online:
+            mismatches.append(f"{mac}: connected but marked offline")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1000, help='numero di moduli simulati')
+    parser.add_argument('--broker', default=None, help='host:porta di un broker locale (default: broker finto in-process)')
+    parser.add_argument('--broker-latency-ms', type=float, default=0, help='latenza del broker finto verso i moduli')
+    parser.add_argument('--binary-ratio', type=float, default=0.5, help='frazione di moduli che annunciano il formato bin1')
+    parser.add_argument('--storm-rate', type=float, default=0, help='connessioni al secondo durante lo storm (0 = tutte insieme)')
+    parser.add_argument('--flap-ratio', type=float, default=0.1, help='frazione di moduli che si disconnettono e riconnettono')
+    parser.add_argument('--flaps', type=int, default=3, help='cicli di disconnessione/riconnessione per modulo')
+    parser.add_argument('--flap-gap-ms', type=float, default=50, help='pausa tra disconnessione e riconnessione')
+    parser.add_argument('--edit-bursts', type=int, default=5, help='numero di raffiche di modifiche')
+    parser.add_argument('--burst-size', type=int, default=200, help='moduli modificati per raffica')
+    parser.add_argument('--ingest-workers', type=int, default=None, help='sovrascrive MQTT_INGEST_WORKERS')
+    parser.add_argument('--timeout', type=float, default=120, help='attesa massima (s) per scenario')
+    parser.add_argument('--quiet-ms', type=float, default=2000, help='scenario concluso dopo questo tempo senza configurazioni ricevute')
+    parser.add_argument('--max-p95-ms', type=float, default=None, help='fallisce se il p95 di uno scenario supera questa soglia')
+    parser.add_argument('--seed', type=int, default=1, help='seme per la scelta dei moduli')
+    parser.add_argument('--json', action='store_true', help='stampa i risultati in formato JSON')
+    args = parser.parse_args()
+
+    if args.ingest_workers is not None:
+        os.environ['MQTT_INGEST_WORKERS'] = str(args.ingest_workers)
+    # I log del percorso di ingestione non vanno a terminale
+    logging.getLogger('microcontrollers').addHandler(logging.NullHandler())
+    logging.getLogger('microcontrollers').propagate = False
+
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        os.environ['MQTT_BROKER_URL'] = host
+        os.environ['MQTT_BROKER_PORT'] = port or '1883'
+        server_client = None
+    else:
+        server_client = FakeMqtt(latency=args.broker_latency_ms / 1000)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='bench-fleet-'), 'fleet.db')
+    app, mqtt_service = _create_app(db_path, server_client)
+    if server_client is not None:
+        server_client.connect()
+        transport = server_client
+    else:
+        transport = PahoTransport(os.environ['MQTT_BROKER_URL'], int(os.environ['MQTT_BROKER_PORT']))
+        # Lascia al server il tempo di sottoscriversi
+        time.sleep(1)
+
+    with app.app_context():
+        commits = CommitCounter(db.engine)
+
+    rng = random.Random(args.seed)
+    fleet = Fleet(transport, args.devices, args.binary_ratio, args.seed)
+    results = [
+        _run_phase('storm', lambda: _storm(fleet, args.storm_rate), fleet, transport, mqtt_service, commits, args),
+        _run_phase('flap', lambda: _flap(fleet, rng, args.flap_ratio, args.flaps, args.flap_gap_ms / 1000), fleet, transport, mqtt_service, commits, args),
+        _run_phase('edit', lambda: _edit_bursts(fleet, app, mqtt_service, rng, args.edit_bursts, args.burst_size), fleet, transport, mqtt_service, commits, args),
+    ]
+    mismatches = _verify(fleet, app, mqtt_service)
+
+    failures = [f"{result['scenario']}: {result['unanswered']} modules without configuration" for result in results if result['unanswered']]
+    if mismatches:
+        failures.append(f"{len(mismatches)} modules with a stale configuration or presence")
+    if args.max_p95_ms is not None:
+        failures.extend(f"{result['scenario']}: p95 {result['latency_ms']['p95']} ms above {args.max_p95_ms} ms"
+                        for result in results if (result['latency_ms']['p95'] or 0) > args.max_p95_ms)
+
+    if args.json:
+        print(json.dumps({'devices': args.devices, 'broker': args.broker or 'fake', 'scenarios': results,
+                          'mismatches': mismatches[:20], 'failures': failures}, indent=2))
+    else:
+        print(f"{args.devices} devices on {args.broker or 'in-process fake broker'}")
+        print(f"{'scenario':<8} {'events':>7} {'seconds':>8} {'ingest/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'commits':>8} {'commits/s':>10} {'lost':>5}")
+        for result in results:
+            latency = result['latency_ms']
+            print(f"{result['scenario']:<8} {result['events']:>7} {result['seconds']:>8} {str(result['ingest_msgs_per_sec']):>9} "
+                  f"{str(latency['p50']):>8} {str(latency['p95']):>8} {str(latency['p99']):>8} {str(latency['max']):>8} "
+                  f"{result['db_commits']:>8} {result['db_commits_per_sec']:>10} {result['unanswered']:>5}")
+        for mismatch in mismatches[:20]:
+            print(f"mismatch {mismatch}")
+        for failure in failures:
+            print(f"FAIL {failure}")
+
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Benchmark delle route Flask più usate, eseguito su create_app() con dati di dimensioni realistiche:
+migliaia di moduli nel database e file di log da centinaia di MB nel formato reale (LOG_FORMAT).
+LDAP non viene contattato (l'utente viene inserito direttamente in sessione) e MQTT è sostituito
+dal broker finto in-process, quindi il benchmark gira senza rete.
+
+Per ogni route misura i percentili della latenza (a caldo, dopo le richieste di riscaldamento),
+la latenza della prima richiesta e la memoria allocata per richiesta (picco e memoria trattenuta,
+misurate con tracemalloc in un passaggio separato). I risultati possono essere salvati in JSON
+e confrontati con una baseline: il processo esce con codice 1 se una metrica peggiora oltre la
+tolleranza, così che le regressioni vengano intercettate.
+
+Uso (dalla cartella app/):
+    python -m benchmarks.bench_http --modules 5000 --log-mb 100 --output results.json
+    python -m benchmarks.bench_http --fixture-dir /tmp/bench-http --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.fake_mqtt import FakeMqtt
+
+LOG_SOURCES = ('app', 'auth', 'api', 'microcontrollers')
+
+# Messaggi tipici di ogni file di log: (livello, messaggio, file, riga)
+LOG_TEMPLATES = {
+    'app': [
+        ('INFO', "TITLE: Log Search Index Synced | DESC: Indexed {count} new lines.", '/app/services/log_search_service.py', 188),
+        ('WARNING', "TITLE: Errore Formattazione Timestamp | DESC: Impossibile formattare il timestamp '{mac}'", '/app/routes/logs.py', 31),
+        ('ERROR', "TITLE: Log Search Index Error | DESC: Failed to synchronize the log search index. Error: database is locked", '/app/services/log_search_service.py', 218),
+    ],
+    'auth': [
+        ('INFO', "TITLE: LDAP Auth Success | DESC: User '{user}' logged in successfully.", '/app/routes/auth.py', 60),
+        ('WARNING', "TITLE: LDAP Auth Failed (Access Denied) | DESC: User '{user}' not in allowed group or invalid credentials.", '/app/routes/auth.py', 54),
+        ('INFO', "TITLE: User Logout | DESC: User '{user}' logged out.", '/app/routes/auth.py', 84),
+    ],
+    'api': [
+        ('INFO', "TITLE: Module Update Success | DESC: Module ID '{id}' ('Aula {id}') updated successfully by user '{user}'.", '/app/routes/modules.py', 137),
+        ('WARNING', "TITLE: Module Update Failed (Not Found) | DESC: Attempt to update non-existent module ID '{id}' by user '{user}'.", '/app/routes/modules.py', 82),
+        ('INFO', "TITLE: Module Deletion Success | DESC: Module ID '{id}' ('Aula {id}') deleted successfully by user '{user}'.", '/app/routes/modules.py', 164),
+    ],
+    'microcontrollers': [
+        ('DEBUG', "TITLE: Raw MQTT Message Received | DESC: Topic: 'new_connection', Raw Payload: '{{\"mac\": \"{mac}\", \"type\": \"numeric\"}}'", '/app/services/mqtt_service.py', 33),
+        ('INFO', "TITLE: Existing Module Reconnected | DESC: Module MAC '{mac}', Type 'numeric' marked as online. Last seen updated.", '/app/services/mqtt_service.py', 241),
+        ('INFO', "TITLE: MQTT Config Published | DESC: Configuration sent to module MAC '{mac}' on topic 'on_module_update/{mac}' as json (68 bytes). Payload: {{'on': True, 'color': '#ffffff', 'animation': 'none', 'number': {count}}}", '/app/services/mqtt_service.py', 84),
+        ('INFO', "TITLE: Module Disconnected (Last Will) | DESC: Module MAC '{mac}' ('Aula {id}') marked as offline due to last will testament.", '/app/services/mqtt_service.py', 258),
+        ('ERROR', "TITLE: MQTT Payload JSON Error | DESC: Failed to decode JSON from topic 'new_connection'. Error: Expecting value. Raw Payload: 'garbage'", '/app/services/mqtt_service.py', 39),
+    ],
+}
+
+# Scrittura dei file di log a blocchi di questa dimensione
+WRITE_CHUNK_BYTES = 1024 * 1024
+
+
+def _write_log_fixture(path, source, target_bytes, devices, rng):
+    """
+    Genera un file di log di circa `target_bytes` byte nel formato LOG_FORMAT, con timestamp
+    crescenti che terminano all'istante corrente.
+    """
+    templates = LOG_TEMPLATES[source]
+    step = timedelta(milliseconds=5)
+    # Circa 150 byte per riga: la prima riga cade abbastanza indietro da arrivare a oggi
+    timestamp = datetime.now() - step * (target_bytes // 150)
+    written = 0
+    chunk = []
+    chunk_bytes = 0
+    with open(path, 'w', encoding='utf-8') as log_file:
+        while written < target_bytes:
+            level, message, file_name, line_number = rng.choice(templates)
+            module_id = rng.randrange(1, devices + 1)
+            text = message.format(mac=f"02{module_id:010X}", id=module_id, user=f"docente{module_id % 50}", count=module_id % 100)
+            line = f"{timestamp:%Y-%m-%d %H:%M:%S},{timestamp.microsecond // 1000:03d} {level}: {text} [in {file_name}:{line_number}]\n"
+            chunk.append(line)
+            chunk_bytes += len(line)
+            timestamp += step
+            if chunk_bytes >= WRITE_CHUNK_BYTES:
+                log_file.write(''.join(chunk))
+                written += chunk_bytes
+                chunk, chunk_bytes = [], 0
+        log_file.write(''.join(chunk))
+
+
+def _prepare_logs(log_dir, log_mb, devices, seed):
+    """
+    Genera i file di log, riutilizzando quelli di una precedente esecuzione con gli stessi parametri.
+    """
+    marker = log_dir / 'fixture.json'
+    params = {'log_mb': log_mb, 'devices': devices, 'seed': seed}
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return False
+
+    log_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    for source in LOG_SOURCES:
+        _write_log_fixture(log_dir / f"{source}.log", source, log_mb * 1024 * 1024, devices, rng)
+    marker.write_text(json.dumps(params))
+    return True
+
+
+def _prepare_modules(app, count, seed):
+    """
+    Popola il database con `count` moduli (metà numerici e metà frecce, per lo più online).
+    """
+    from models.conn import db
+    from models.model import Module
+    from services.mqtt_service import module_registry
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = [{
+        'mac': f"02{index:010X}",
+        'type': 'numeric' if index % 2 else 'arrow',
+        'number': index % 100 if index % 2 else None,
+        'place': f"Aula {index % 300}",
+        'animation': rng.choice(['none', 'flow', 'pulse']),
+        'color': '#ffffff',
+        'on': True,
+        'online': rng.random() < 0.9,
+        'last_seen': now,
+        'last_update': now,
+    } for index in range(1, count + 1)]
+
+    with app.app_context():
+        db.session.execute(db.delete(Module))
+        db.session.execute(Module.__table__.insert(), rows)
+        db.session.commit()
+        module_ids = list(db.session.execute(db.select(Module.id)).scalars())
+    module_registry.reload()
+    return module_ids
+
+
+def _login(client):
+    """
+    Inserisce in sessione un utente come farebbe il login LDAP (save_user), senza contattare il server.
+    """
+    dn = 'CN=bench,OU=Docenti,DC=example,DC=local'
+    with client.session_transaction() as session:
+        session['_user_id'] = dn
+        session['_fresh'] = True
+        session[dn] = {'dn': dn, 'username': 'bench'}
+
+
+def _request(client, method, url, data):
+    """
+    Esegue una richiesta e ne restituisce la durata (in secondi).
+    """
+    start = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    elapsed = time.perf_counter() - start
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    response.close()
+    if method == 'POST':
+        # I messaggi flash delle modifiche non verrebbero mai mostrati e farebbero crescere il cookie di sessione
+        with client.session_transaction() as session:
+            session.pop('_flashes', None)
+    return elapsed
+
+
+def _measure(client, method, make_request, iterations, warmup, alloc_iterations):
+    cold = _request(client, method, *make_request(0))
+
+    for index in range(1, warmup + 1):
+        _request(client, method, *make_request(index))
+
+    samples = sorted(_request(client, method, *make_request(warmup + 1 + index)) for index in range(iterations))
+
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    for index in range(alloc_iterations):
+        url, data = make_request(warmup + 1 + iterations + index)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        client.open(url, method=method, data=data).close()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained.append(current - before)
+    tracemalloc.stop()
+
+    def percentile(fraction):
+        return round(samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))] * 1000, 3)
+
+    return {
+        'iterations': iterations,
+        'cold_ms': round(cold * 1000, 3),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': percentile(1.0),
+        'alloc_peak_kb': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+        'alloc_retained_kb': round(statistics.median(retained) / 1024, 1) if retained else None,
+    }
+
+
+def _endpoints(module_ids):
+    """
+    Route misurate: (nome, richiede login, metodo, funzione che dato l'indice della richiesta
+    restituisce url e dati del form).
+    """
+    def update_request(index):
+        module_id = module_ids[index % len(module_ids)]
+        # Il colore cambia ad ogni richiesta, così che la configurazione venga sempre pubblicata
+        return f"/edit/{module_id}", {'color': f"#{index % 0xFFFFFF:06x}", 'animation': 'none', 'place': f"Aula {module_id % 300}"}
+
+    endpoints = [
+        ('modules_bp.index', True, 'GET', lambda index: ('/', None)),
+        ('modules_bp.update', True, 'POST', update_request),
+    ]
+    for tab in LOG_SOURCES + ('all',):
+        endpoints.append((f"logs_bp.index[{tab}]", True, 'GET', lambda index, tab=tab: (f"/logs/?tab={tab}", None)))
+    endpoints.append(('auth_bp.login', False, 'GET', lambda index: ('/auth/login', None)))
+    return endpoints
+
+
+def _compare(results, baseline, tolerance):
+    """
+    Restituisce le metriche peggiorate oltre la tolleranza rispetto alla baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if not reference:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'alloc_peak_kb'):
+            previous, current = reference.get(metric), result.get(metric)
+            if previous and current is not None and current > previous * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {current} vs baseline {previous} (+{(current / previous - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', type=int, default=5000, help='moduli inseriti nel database')
+    parser.add_argument('--log-mb', type=int, default=100, help='dimensione (MB) di ciascuno dei quattro file di log')
+    parser.add_argument('--iterations', type=int, default=50, help='richieste misurate per route')
+    parser.add_argument('--warmup', type=int, default=5, help='richieste di riscaldamento per route')
+    parser.add_argument('--alloc-iterations', type=int, default=5, help='richieste misurate con tracemalloc per route')
+    parser.add_argument('--fixture-dir', default=None, help='cartella dei dati generati, riutilizzati tra esecuzioni (default: temporanea)')
+    parser.add_argument('--output', default=None, help='salva i risultati in questo file JSON')
+    parser.add_argument('--baseline', default=None, help='file JSON di una esecuzione precedente con cui confrontare i risultati')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='peggioramento relativo tollerato rispetto alla baseline')
+    parser.add_argument('--seed', type=int, default=1, help='seme per la generazione dei dati')
+    parser.add_argument('--json', action='store_true', help='stampa i risultati in formato JSON')
+    args = parser.parse_args()
+
+    fixture_dir = pathlib.Path(args.fixture_dir or tempfile.mkdtemp(prefix='bench-http-'))
+    log_dir = fixture_dir / 'logs'
+    generated = _prepare_logs(log_dir, args.log_mb, args.modules, args.seed)
+
+    # Configurazione letta da create_app() e dai servizi al momento dell'import
+    os.environ['DATABASE_URL'] = f"sqlite:///{fixture_dir / 'bench.db'}"
+    os.environ['LOG_DIR'] = str(log_dir)
+    os.environ['LOG_SEARCH_SYNC_INTERVAL'] = '0'  # Nessuna indicizzazione in background durante le misure
+    os.environ['HISTORY_ROLLUP_INTERVAL'] = '0'
+    # Server LDAP fittizio: LDAP3LoginManager richiede la configurazione anche senza .env, ma il server
+    # non viene mai contattato (il login è simulato e il controllo di raggiungibilità disattivato)
+    os.environ['LDAP_HOST'] = 'ldap.bench.invalid'
+    os.environ['LDAP_BASE_DN'] = 'DC=example,DC=local'
+    os.environ['LDAP_USER_DN'] = 'OU=Docenti'
+    os.environ['LDAP_GROUP_DN'] = 'OU=Gruppi'
+
+    from app import create_app
+    import routes.auth
+
+    # La pagina di login verifica la raggiungibilità del server LDAP: senza rete la misura sarebbe
+    # il timeout di connessione invece del tempo della route
+    routes.auth._check_ldap_server_connectivity = lambda: None
+
+    mqtt_client = FakeMqtt()
+    app = create_app(mqtt_client=mqtt_client)
+    app.config['WTF_CSRF_ENABLED'] = False
+    mqtt_client.connect()
+    module_ids = _prepare_modules(app, args.modules, args.seed)
+
+    user_client = app.test_client()
+    _login(user_client)
+    anonymous_client = app.test_client()
+
+    results = {}
+    for name, needs_login, method, make_request in _endpoints(module_ids):
+        client = user_client if needs_login else anonymous_client
+        results[name] = _measure(client, method, make_request, args.iterations, args.warmup, args.alloc_iterations)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'modules': args.modules,
+            'log_mb_per_file': args.log_mb,
+            'iterations': args.iterations,
+            'logs_generated': generated,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(pathlib.Path(args.baseline).read_text())
+        regressions = _compare(results, baseline, args.tolerance)
+        report['baseline'] = {'file': args.baseline, 'tolerance': args.tolerance, 'regressions': regressions}
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{args.modules} modules, {args.log_mb} MB per log file ({fixture_dir})")
+        print(f"{'route':<34} {'cold ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak KB':>9} {'kept KB':>8}")
+        for name, result in results.items():
+            print(f"{name:<34} {result['cold_ms']:>9} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+                  f"{str(result['alloc_peak_kb']):>9} {str(result['alloc_retained_kb']):>8}")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark del logging su file: confronta la modalità sincrona (TimedRotatingFileHandler
+collegato direttamente al logger) con la modalità con coda (LOG_QUEUE_ENABLED).
+
+Uso (dalla cartella app/):
+    python -m benchmarks.bench_logging --messages 200000 --threads 4
+"""
+import argparse
+import json
+import logging
+import pathlib
+import tempfile
+import threading
+import time
+
+from config import log_config
+
+
+def _emit_messages(logger, count):
+    mac = 'AABBCCDDEEFF'
+    for i in range(count):
+        # Stessa forma dei messaggi del percorso di ingestione MQTT
+        logger.debug("TITLE: Raw MQTT Message Received | DESC: Topic: '%s', Raw Payload: '%s'", 'new_connection', mac)
+        logger.info("TITLE: Existing Module Reconnected | DESC: Module MAC '%s', Type '%s' marked as online. Last seen updated.", mac, 'numeric')
+
+
+def _run_mode(name, queue_options, messages, threads):
+    log_dir = pathlib.Path(tempfile.mkdtemp(prefix=f'bench-logging-{name}-'))
+    logger = log_config._setup_specific_logger(f'bench.{name}', log_dir, f'{name}.log', queue_options=queue_options)
+
+    per_thread = messages // threads
+    workers = [threading.Thread(target=_emit_messages, args=(logger, per_thread)) for _ in range(threads)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    emit_elapsed = time.perf_counter() - start
+
+    # Attende la scrittura di tutti i messaggi ancora in coda
+    log_config.stop_queued_logging()
+    total_elapsed = time.perf_counter() - start
+
+    dropped = sum(getattr(handler, 'dropped', 0) for handler in logger.handlers)
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+    written = per_thread * threads
+    return {
+        'mode': name,
+        'messages': written,
+        'caller_msgs_per_sec': round(written / emit_elapsed),
+        'drained_msgs_per_sec': round(written / total_elapsed),
+        'dropped': dropped,
+    }
+
+
+def _run_formatting(iterations):
+    """
+    Costo di una chiamata a livello disabilitato: f-string costruita comunque vs argomenti lazy.
+    """
+    logger = logging.getLogger('bench.formatting')
+    logger.setLevel(logging.INFO)
+    mac, payload = 'AABBCCDDEEFF', {'on': True, 'color': '#ffffff', 'animation': 'none', 'number': 0}
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        logger.debug(f"TITLE: Raw MQTT Message Received | DESC: Topic: '{mac}', Raw Payload: '{payload}'")
+    eager = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        logger.debug("TITLE: Raw MQTT Message Received | DESC: Topic: '%s', Raw Payload: '%s'", mac, payload)
+    lazy = time.perf_counter() - start
+
+    return {
+        'disabled_eager_calls_per_sec': round(iterations / eager),
+        'disabled_lazy_calls_per_sec': round(iterations / lazy),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200000, help='messaggi INFO scritti per modalità')
+    parser.add_argument('--threads', type=int, default=4, help='thread che scrivono in parallelo')
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--overflow', choices=log_config.QUEUE_OVERFLOW_POLICIES, default='block')
+    parser.add_argument('--json', action='store_true', help='stampa i risultati in formato JSON')
+    args = parser.parse_args()
+
+    results = [
+        _run_mode('sync', None, args.messages, args.threads),
+        _run_mode('queued', {'size': args.queue_size, 'overflow': args.overflow}, args.messages, args.threads),
+    ]
+    formatting = _run_formatting(args.messages)
+
+    if args.json:
+        print(json.dumps({'file_handlers': results, 'formatting': formatting}, indent=2))
+        return
+
+    print(f"{'mode':<8} {'messages':>10} {'caller msg/s':>14} {'drained msg/s':>14} {'dropped':>8}")
+    for result in results:
+        print(f"{result['mode']:<8} {result['messages']:>10} {result['caller_msgs_per_sec']:>14} "
+              f"{result['drained_msgs_per_sec']:>14} {result['dropped']:>8}")
+    print(f"disabled DEBUG calls/s: eager f-string {formatting['disabled_eager_calls_per_sec']}, "
+          f"lazy args {formatting['disabled_lazy_calls_per_sec']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark del formato delle configurazioni inviate ai moduli: confronta il JSON attuale con
+il formato binario 'bin1' per dimensione del payload e tempo di codifica/decodifica.
+La correttezza del formato (round-trip, ricorso al JSON, negoziazione) è verificata dai test
+in tests/test_wire_format.py.
+
+Uso (dalla cartella app/):
+    python -m benchmarks.bench_wire_format --iterations 200000
+"""
+import argparse
+import json
+import time
+
+from services import wire_format_service as wire
+
+
+def _time(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def _run_format(name, encode, decode, config, iterations):
+    encoded = encode(config)
+    return {
+        'format': name,
+        'bytes': len(encoded),
+        'encode_ns': round(_time(lambda: encode(config), iterations)),
+        'decode_ns': round(_time(lambda: decode(encoded), iterations)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000, help='codifiche/decodifiche misurate per formato')
+    parser.add_argument('--json', action='store_true', help='stampa i risultati in formato JSON')
+    args = parser.parse_args()
+
+    # Configurazione tipica di un modulo numerico
+    config = {'on': True, 'color': '#ffffff', 'animation': 'none', 'number': 0}
+    results = [
+        _run_format('json', lambda c: json.dumps(c).encode(), lambda d: json.loads(d), config, args.iterations),
+        _run_format('bin1', wire.encode_binary, wire.decode_binary, config, args.iterations),
+    ]
+
+    if args.json:
+        print(json.dumps({'formats': results}, indent=2))
+        return
+
+    print(f"{'format':<8} {'bytes':>6} {'encode ns':>10} {'decode ns':>10}")
+    for result in results:
+        print(f"{result['format']:<8} {result['bytes']:>6} {result['encode_ns']:>10} {result['decode_ns']:>10}")
+
+
+if __name__ == '__main__':
+    main()
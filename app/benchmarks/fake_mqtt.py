@@ -0,0 +1,156 @@
+"""
+Broker MQTT finto in-process, con la stessa interfaccia di flask_mqtt.Mqtt usata dal server
+(decoratori on_connect/on_message/on_publish/on_disconnect, subscribe, publish).
+Si passa a configure_mqtt(app, client=FakeMqtt()) per eseguire benchmark e test di carico
+senza rete né broker: i messaggi dei dispositivi simulati vengono consegnati al server su un
+thread di rete dedicato (come fa paho), quelli del server ai dispositivi su un thread di consegna
+che poi notifica la conferma (PUBACK) per i messaggi con QoS 1.
+"""
+from collections import namedtuple
+import itertools
+import queue
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+Message = namedtuple('Message', 'topic payload qos retain')
+
+
+def subscription_matches(subscription, topic):
+    """
+    Verifica se un topic corrisponde a una sottoscrizione, anche condivisa ($share/<gruppo>/<filtro>).
+    """
+    if subscription.startswith('$share/'):
+        subscription = subscription.split('/', 2)[2]
+    return topic_matches_sub(subscription, topic)
+
+
+class FakeMqtt:
+    """
+    Client del server e broker allo stesso tempo: i dispositivi simulati pubblicano con inject()
+    e ricevono i messaggi del server registrandosi con add_listener().
+    """
+
+    def __init__(self, latency=0.0):
+        # Latenza (in secondi) applicata ai messaggi dal server ai dispositivi
+        self.latency = latency
+        self.subscriptions = set()
+        self.retained = {}
+        self.published = 0
+        self.delivered = 0
+        self.handled = 0
+        # Eccezioni sollevate dalle callback (come paho, il thread di rete non si interrompe)
+        self.errors = 0
+        self._handlers = {}
+        self._listeners = []
+        self._mid = itertools.count(1)
+        self._inbox = queue.Queue()
+        self._outbox = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run_inbound, name='fake-mqtt-network', daemon=True),
+            threading.Thread(target=self._run_outbound, name='fake-mqtt-delivery', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _register(self, name):
+        def decorator(handler):
+            self._handlers[name] = handler
+            return handler
+        return decorator
+
+    def on_connect(self):
+        return self._register('connect')
+
+    def on_message(self):
+        return self._register('message')
+
+    def on_publish(self):
+        return self._register('publish')
+
+    def on_disconnect(self):
+        return self._register('disconnect')
+
+    def connect(self):
+        """
+        Simula l'avvenuta connessione al broker (il server esegue le sue sottoscrizioni).
+        """
+        handler = self._handlers.get('connect')
+        if handler:
+            handler(None, None, {}, 0)
+
+    def disconnect(self):
+        handler = self._handlers.get('disconnect')
+        if handler:
+            handler()
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        return 0, next(self._mid)
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+        return 0, next(self._mid)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """
+        Pubblicazione dal server: il messaggio viene consegnato ai dispositivi in ascolto.
+        """
+        mid = next(self._mid)
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+        self.published += 1
+        self._outbox.put((time.perf_counter() + self.latency, Message(topic, payload, qos, retain), mid))
+        return 0, mid
+
+    def add_listener(self, callback):
+        """
+        Registra un dispositivo (o una flotta): callback(topic, payload) per ogni messaggio del server.
+        """
+        self._listeners.append(callback)
+
+    def inject(self, topic, payload, qos=1):
+        """
+        Pubblicazione da un dispositivo: il messaggio viene consegnato al server se sottoscritto.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._inbox.put(Message(topic, payload, qos, False))
+
+    def idle(self):
+        return self._inbox.unfinished_tasks == 0 and self._outbox.unfinished_tasks == 0
+
+    def _run_inbound(self):
+        while True:
+            message = self._inbox.get()
+            try:
+                handler = self._handlers.get('message')
+                if handler and any(subscription_matches(subscription, message.topic) for subscription in list(self.subscriptions)):
+                    handler(None, None, message)
+                    self.handled += 1
+            except Exception:
+                self.errors += 1
+            finally:
+                self._inbox.task_done()
+
+    def _run_outbound(self):
+        while True:
+            due, message, mid = self._outbox.get()
+            try:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                for listener in self._listeners:
+                    listener(message.topic, message.payload)
+                self.delivered += 1
+                handler = self._handlers.get('publish')
+                if handler and message.qos > 0:
+                    handler(None, None, mid)
+            except Exception:
+                self.errors += 1
+            finally:
+                self._outbox.task_done()
@@ -1,12 +1,198 @@
+import atexit
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler 
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import os
 import pathlib
+import queue
 
 # Standard log format to be used by all handlers
 LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
 log_formatter = logging.Formatter(LOG_FORMAT)
 
-def _setup_specific_logger(name, log_dir, filename, when='D', backup_count=1, level=logging.INFO):
+# Attributi standard di un LogRecord: tutti gli altri sono campi extra (es. mac, topic, user)
+_STANDARD_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'taskName'}
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    Formatter strutturato: scrive un oggetto JSON per riga con timestamp, severity, title,
+    description, file, line e gli eventuali campi extra passati al logger (es. extra={'mac': ...}).
+    Ogni riga è un oggetto JSON completo: i lettori (log_reader_service) la decodificano con json.loads.
+    """
+
+    def format(self, record):
+        message = record.getMessage()
+
+        # Separa la convenzione "TITLE: ... | DESC: ..." già in fase di scrittura
+        title = None
+        description = message
+        if message.startswith('TITLE:'):
+            head, separator, tail = message[len('TITLE:'):].partition('| DESC:')
+            if separator:
+                title = head.strip()
+                description = tail.strip()
+
+        entry = {
+            'timestamp': self.formatTime(record),
+            'severity': record.levelname,
+            'title': title,
+            'description': description,
+            'file': record.pathname,
+            'line': record.lineno,
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+json_log_formatter = JsonLineFormatter()
+
+# Politiche applicabili quando la coda di un file di log è piena
+QUEUE_OVERFLOW_POLICIES = ('block', 'drop_new', 'drop_oldest')
+
+# Listener attivi (uno per file di log) quando il logging con coda è abilitato
+_queue_listeners = []
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler con coda limitata e politica di overflow configurabile.
+    Come in QueueHandler il messaggio (msg % args) viene composto nel thread chiamante, mentre
+    la formattazione della riga (timestamp, formato testuale o JSON) avviene nel thread di scrittura del file.
+    """
+
+    def __init__(self, log_queue, base_filename, overflow='block'):
+        super().__init__(log_queue)
+        self.base_filename = base_filename
+        self.overflow = overflow
+        self.dropped = 0
+
+    def handle(self, record):
+        # La coda è già thread-safe: evita il lock del gestore attorno a emit()
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def prepare(self, record):
+        # Il messaggio viene composto subito: gli argomenti (es. un payload) potrebbero essere
+        # modificati dal chiamante prima che il thread di scrittura li legga
+        record.msg = record.getMessage()
+        record.args = None
+        # Le eccezioni vengono formattate subito, finché il traceback è ancora valido
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = log_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.overflow == 'drop_oldest':
+                # Scarta il messaggio più vecchio per fare spazio a quello nuovo
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+
+
+class _FileQueueListener(QueueListener):
+    """
+    QueueListener che attende lo spazio in coda anche per il messaggio di arresto.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def stop_queued_logging():
+    """
+    Svuota le code e arresta i thread di scrittura dei file di log.
+    """
+    while _queue_listeners:
+        _queue_listeners.pop().stop()
+
+
+atexit.register(stop_queued_logging)
+
+
+def _has_file_handler(logger, log_file_path):
+    """Verifica se il logger scrive già sul file indicato, direttamente o tramite coda."""
+    for h in logger.handlers:
+        if isinstance(h, TimedRotatingFileHandler) and h.baseFilename == str(log_file_path):
+            return True
+        if isinstance(h, BoundedQueueHandler) and h.base_filename == str(log_file_path):
+            return True
+    return False
+
+
+def _attach_file_handler(logger, file_handler, queue_options=None):
+    """
+    Collega il gestore del file al logger.
+    Se queue_options è specificato, il logger scrive su una coda limitata e un thread dedicato
+    (uno per file) si occupa della formattazione, della scrittura e della rotazione.
+    """
+    if queue_options is None:
+        logger.addHandler(file_handler)
+        return
+
+    log_queue = queue.Queue(maxsize=queue_options['size'])
+    queue_handler = BoundedQueueHandler(log_queue, file_handler.baseFilename, queue_options['overflow'])
+    queue_handler.setLevel(file_handler.level)
+
+    listener = _FileQueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    _queue_listeners.append(listener)
+
+    logger.addHandler(queue_handler)
+
+
+def _get_queue_options():
+    """
+    Legge la configurazione del logging con coda dalle variabili d'ambiente.
+    Restituisce None se la modalità con coda non è abilitata.
+    """
+    if os.getenv('LOG_QUEUE_ENABLED', 'False').lower() not in ('true', '1', 't'):
+        return None
+
+    overflow = os.getenv('LOG_QUEUE_OVERFLOW', 'block').lower()
+    if overflow not in QUEUE_OVERFLOW_POLICIES:
+        overflow = 'block'
+
+    return {
+        'size': int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+        'overflow': overflow,
+    }
+
+
+def _get_file_formatter():
+    """
+    Restituisce il formatter dei file di log: JSON una riga per voce se LOG_STRUCTURED è abilitato,
+    altrimenti il formato testuale LOG_FORMAT.
+    """
+    if os.getenv('LOG_STRUCTURED', 'False').lower() in ('true', '1', 't'):
+        return json_log_formatter
+    return log_formatter
+
+
+def _setup_specific_logger(name, log_dir, filename, when='D', backup_count=1, level=logging.INFO, queue_options=None, formatter=log_formatter):
     """Funzione di supporto per configurare un logger specifico con TimedRotatingFileHandler.""" 
     logger = logging.getLogger(name)
     logger.setLevel(level)
@@ -14,6 +200,10 @@ def _setup_specific_logger(name, log_dir, filename, when='D', backup_count=1, le
     logger.propagate = False
 
     log_file_path = log_dir / filename
+
+    # Aggiunge il gestore solo se uno simile non è già presente 
+    if _has_file_handler(logger, log_file_path):
+        return logger
     
     # Gestore per scrivere su un file specifico, con rotazione giornaliera 
     file_handler = TimedRotatingFileHandler(
@@ -23,12 +213,10 @@ def _setup_specific_logger(name, log_dir, filename, when='D', backup_count=1, le
         encoding='utf-8',
         delay=False
     )
-    file_handler.setFormatter(log_formatter)
+    file_handler.setFormatter(formatter)
     file_handler.setLevel(level)
 
-    # Aggiunge il gestore solo se uno simile non è già presente 
-    if not any(isinstance(h, TimedRotatingFileHandler) and h.baseFilename == str(log_file_path) for h in logger.handlers):
-        logger.addHandler(file_handler)
+    _attach_file_handler(logger, file_handler, queue_options)
     
     return logger
 
@@ -39,17 +227,23 @@ def configure_logging(app):
     Ogni categoria ha il suo file di log con rotazione giornaliera (1 backup mantenuto). 
     """
     APP_ROOT_DIR = pathlib.Path(app.root_path)
-    LOG_DIR = APP_ROOT_DIR / 'logs'
+    LOG_DIR = pathlib.Path(app.config.get('LOG_DIR') or APP_ROOT_DIR / 'logs')
     
     # Crea la directory per i log se non esiste
     if not LOG_DIR.exists():
         LOG_DIR.mkdir(parents=True, exist_ok=True)
     
+    # Logging con coda e thread di scrittura dedicati (opzionale, LOG_QUEUE_ENABLED)
+    queue_options = _get_queue_options()
+
+    # Formato dei file di log: testuale o JSON strutturato (opzionale, LOG_STRUCTURED)
+    file_formatter = _get_file_formatter()
+    
     # --- Configurazione logger specifici --- 
     # Questi logger scriveranno nei loro rispettivi file e non si propagheranno ad app.logger
-    _setup_specific_logger('auth', LOG_DIR, 'auth.log', backup_count=1) # Mantiene 1 backup settimanale
-    _setup_specific_logger('api', LOG_DIR, 'api.log', backup_count=1)
-    _setup_specific_logger('microcontrollers', LOG_DIR, 'microcontrollers.log', backup_count=1)
+    _setup_specific_logger('auth', LOG_DIR, 'auth.log', backup_count=1, queue_options=queue_options, formatter=file_formatter) # Mantiene 1 backup settimanale
+    _setup_specific_logger('api', LOG_DIR, 'api.log', backup_count=1, queue_options=queue_options, formatter=file_formatter)
+    _setup_specific_logger('microcontrollers', LOG_DIR, 'microcontrollers.log', backup_count=1, queue_options=queue_options, formatter=file_formatter)
 
     # --- Configura il logger predefinito di Flask (app.logger) per log generali e output su console ---
     
@@ -61,18 +255,17 @@ def configure_logging(app):
     if old_file_handler:
         app.logger.removeHandler(old_file_handler)
 
-    general_file_handler = TimedRotatingFileHandler(
-        general_log_file_path, 
-        when='D', 
-        backupCount=1, # Mantiene 1 backup settimanale 
-        encoding='utf-8'
-    )
-    general_file_handler.setFormatter(log_formatter)
-    general_file_handler.setLevel(logging.INFO) # Log generali dell'app a livello INFO 
-
     # Aggiunge il gestore file generale ad app.logger se non già presente 
-    if not any(isinstance(h, TimedRotatingFileHandler) and h.baseFilename == str(general_log_file_path) for h in app.logger.handlers if isinstance(h, TimedRotatingFileHandler)):
-        app.logger.addHandler(general_file_handler)
+    if not _has_file_handler(app.logger, general_log_file_path):
+        general_file_handler = TimedRotatingFileHandler(
+            general_log_file_path, 
+            when='D', 
+            backupCount=1, # Mantiene 1 backup settimanale 
+            encoding='utf-8'
+        )
+        general_file_handler.setFormatter(file_formatter)
+        general_file_handler.setLevel(logging.INFO) # Log generali dell'app a livello INFO 
+        _attach_file_handler(app.logger, general_file_handler, queue_options)
 
     # Gestore console per app.logger (utile per debug locale) 
     # Controlla se un gestore console esiste già e lo aggiorna, oppure ne aggiunge uno nuovo 
@@ -11,11 +11,45 @@ app_ref = None
 NEW_CONNECTION_TOPIC = 'new_connection'
 ON_MODULE_UPDATE_TOPIC = 'on_module_update'
 LAST_WILL_TOPIC = 'last_will'
+HEARTBEAT_TOPIC = 'heartbeat'
+# Topic di gruppo (es. 'on_module_update/group/numeric'), a cui si sottoscrivono tutti i moduli di un tipo
+GROUP_UPDATE_TOPIC = f"{ON_MODULE_UPDATE_TOPIC}/group"
 
+# Ruoli del processo rispetto al broker (MQTT_ROLE):
+# - all: il processo si collega al broker e serve anche le pagine web (un solo worker gunicorn);
+# - ingest: processo dedicato collegato al broker, riceve le richieste di pubblicazione dei worker web;
+# - web: worker web senza connessione al broker, pubblica tramite il processo di ingestione.
+ROLE_ALL = 'all'
+ROLE_INGEST = 'ingest'
+ROLE_WEB = 'web'
 
-def configure_mqtt(app):
+# Funzioni (senza argomenti) chiamate ad ogni connessione al broker, dopo le sottoscrizioni
+connect_listeners = []
+
+
+class DetachedMqtt:
+    """
+    Sostituto di Mqtt per i worker web (MQTT_ROLE=web): registra le callback senza collegarsi al broker.
+    Le pubblicazioni vengono inoltrate al processo di ingestione da services/mqtt_service.
+    """
+
+    def _register(self):
+        return lambda handler: handler
+
+    on_connect = on_message = on_publish = on_disconnect = _register
+
+    def subscribe(self, topic, qos=0):
+        return 0, None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        raise RuntimeError("This process is not connected to the MQTT broker (MQTT_ROLE=web)")
+
+
+def configure_mqtt(app, client=None):
     """
     Configura le impostazioni MQTT per l'interazione con il broker.
+    Se viene passato `client` (un oggetto con la stessa interfaccia di Mqtt, es. il broker finto
+    dei benchmark) viene usato al posto della connessione al broker configurato.
     """
     global mqtt, app_ref
     
@@ -30,16 +64,85 @@ def configure_mqtt(app):
         app.config['MQTT_TLS_CA_CERTS'] = os.getenv('MQTT_TLS_CA_CERTS', '')
         app.config['MQTT_TLS_VERSION'] = ssl.PROTOCOL_TLSv1_2
 
-    mqtt = Mqtt(app)
+    # Pool di worker per l'elaborazione dei messaggi in ingresso (0 per elaborarli sul thread di rete).
+    # Con una coda piena il thread di rete attende senza scartare messaggi; un'attesa più lunga di
+    # MQTT_INGEST_ENQUEUE_TIMEOUT secondi viene segnalata nei log
+    app.config['MQTT_INGEST_WORKERS'] = int(os.getenv('MQTT_INGEST_WORKERS', 4))
+    app.config['MQTT_INGEST_QUEUE_SIZE'] = int(os.getenv('MQTT_INGEST_QUEUE_SIZE', 1000))
+    app.config['MQTT_INGEST_ENQUEUE_TIMEOUT'] = float(os.getenv('MQTT_INGEST_ENQUEUE_TIMEOUT', 5))
+
+    # Scrittura differita degli aggiornamenti di presenza: ogni N millisecondi o al raggiungimento di M righe
+    app.config['MQTT_PRESENCE_FLUSH_MS'] = int(os.getenv('MQTT_PRESENCE_FLUSH_MS', 500))
+    app.config['MQTT_PRESENCE_FLUSH_ROWS'] = int(os.getenv('MQTT_PRESENCE_FLUSH_ROWS', 200))
+
+    # Modifiche di massa inviate con un solo messaggio sul topic di gruppo (richiede il supporto del firmware)
+    app.config['MQTT_GROUP_TOPICS_ENABLED'] = os.getenv("MQTT_GROUP_TOPICS_ENABLED", 'False').lower() in ('true', '1', 't')
+
+    # Finestra (in millisecondi) in cui le modifiche ravvicinate allo stesso modulo vengono unite (0 per disabilitarla)
+    app.config['MQTT_PUBLISH_COALESCE_MS'] = int(os.getenv('MQTT_PUBLISH_COALESCE_MS', 200))
+
+    # Numero massimo di configurazioni inviate e non ancora confermate dal broker (0 per non limitarle):
+    # oltre il limite restano in attesa, una per modulo. Dopo MQTT_PUBLISH_ACK_TIMEOUT secondi senza
+    # conferma una configurazione è considerata non consegnata (0 per attendere indefinitamente)
+    app.config['MQTT_PUBLISH_INFLIGHT_WINDOW'] = int(os.getenv('MQTT_PUBLISH_INFLIGHT_WINDOW', 100))
+    app.config['MQTT_PUBLISH_ACK_TIMEOUT'] = float(os.getenv('MQTT_PUBLISH_ACK_TIMEOUT', 30))
+
+    # Configurazioni pubblicate come messaggi retained: il broker le consegna ai moduli alla sottoscrizione,
+    # e alla riconnessione di un modulo vengono ripubblicate solo se la copia retained non è aggiornata
+    app.config['MQTT_RETAIN_CONFIGS'] = os.getenv("MQTT_RETAIN_CONFIGS", 'False').lower() in ('true', '1', 't')
+
+    # Heartbeat dei moduli: un modulo che salta MQTT_HEARTBEAT_MISSED heartbeat consecutivi viene considerato
+    # offline (0 per disabilitare la scadenza, per i firmware che non inviano heartbeat)
+    app.config['MQTT_HEARTBEAT_INTERVAL'] = float(os.getenv('MQTT_HEARTBEAT_INTERVAL', 0))
+    app.config['MQTT_HEARTBEAT_MISSED'] = int(os.getenv('MQTT_HEARTBEAT_MISSED', 3))
+
+    # Intervallo di controllo della versione del registro dei moduli (0 per disabilitarlo)
+    app.config['MODULE_REGISTRY_SYNC_MS'] = int(os.getenv('MODULE_REGISTRY_SYNC_MS', 1000))
+
+    # Ruolo del processo e socket Unix del processo di ingestione (usato dai ruoli ingest e web)
+    app.config['MQTT_ROLE'] = os.getenv('MQTT_ROLE', ROLE_ALL).lower()
+    if app.config['MQTT_ROLE'] not in (ROLE_ALL, ROLE_INGEST, ROLE_WEB):
+        raise ValueError(f"MQTT_ROLE non valido: '{app.config['MQTT_ROLE']}' (valori ammessi: all, ingest, web)")
+    app.config['MQTT_INGEST_SOCKET'] = os.getenv('MQTT_INGEST_SOCKET', '/tmp/mqtt-ingest.sock')
+
+    # Sottoscrizioni condivise ($share/<gruppo>/...) tra più nodi di ingestione (vuoto per disabilitarle):
+    # il broker distribuisce i messaggi dei moduli tra i nodi dello stesso gruppo. Gli eventi di presenza
+    # sono ordinati in modo affidabile solo se il firmware invia il campo 'session' (vedi claim_presence)
+    app.config['MQTT_SHARED_SUBSCRIPTION_GROUP'] = os.getenv('MQTT_SHARED_SUBSCRIPTION_GROUP', '')
+    # Finestra (in millisecondi) entro cui un new_connection ricevuto da un altro nodo è considerato una riconsegna
+    app.config['MQTT_DEDUP_WINDOW_MS'] = int(os.getenv('MQTT_DEDUP_WINDOW_MS', 5000))
+
+    if client is not None:
+        mqtt = client
+    elif app.config['MQTT_ROLE'] == ROLE_WEB:
+        mqtt = DetachedMqtt()
+    else:
+        mqtt = Mqtt(app)
+        if app.config['MQTT_PUBLISH_INFLIGHT_WINDOW'] > 0:
+            # paho invia al massimo questi messaggi senza conferma (di default 20): allineato alla finestra
+            # delle configurazioni, così che i messaggi in volo siano davvero sulla connessione
+            mqtt.client.max_inflight_messages_set(app.config['MQTT_PUBLISH_INFLIGHT_WINDOW'])
     app_ref = app
 
     @mqtt.on_connect()
     def handle_connect(client, userdata, flags, rc):
         """
         Callback per la connessione al broker MQTT.
+        Con le sottoscrizioni condivise new_connection e last_will vengono distribuiti tra i nodi
+        (QoS 1, così che il broker riconsegni i messaggi non confermati da un nodo caduto), mentre
+        gli heartbeat arrivano a tutti i nodi, ognuno dei quali tiene la propria scadenza dei moduli.
         """
-        mqtt.subscribe(NEW_CONNECTION_TOPIC)
-        mqtt.subscribe(LAST_WILL_TOPIC)
+        group = app.config['MQTT_SHARED_SUBSCRIPTION_GROUP']
+        if group:
+            mqtt.subscribe(f"$share/{group}/{NEW_CONNECTION_TOPIC}", qos=1)
+            mqtt.subscribe(f"$share/{group}/{LAST_WILL_TOPIC}", qos=1)
+        else:
+            mqtt.subscribe(NEW_CONNECTION_TOPIC)
+            mqtt.subscribe(LAST_WILL_TOPIC)
+        mqtt.subscribe(HEARTBEAT_TOPIC)
+
+        for listener in connect_listeners:
+            listener()
 
         print("MQTT configurato con successo.")
 
@@ -10,4 +10,55 @@ flask db migrate -m "Auto migration" || true
 flask db upgrade
 
 # Start Gunicorn
-exec gunicorn -b 0.0.0.0:5000 "app:create_app()"
+# Worker a thread: ogni connessione di streaming (SSE) occupa un thread finché resta aperta,
+# quindi gli stream per worker sono limitati a SSE_MAX_STREAMS (meno di GUNICORN_THREADS)
+# per lasciare sempre thread liberi alle altre richieste
+start_gunicorn() {
+    exec gunicorn -b 0.0.0.0:5000 -w "${GUNICORN_WORKERS:-1}" -k gthread --threads "${GUNICORN_THREADS:-16}" "app:create_app()"
+}
+
+if [ "${MQTT_ROLE:-all}" != "web" ]; then
+    start_gunicorn
+fi
+
+# Con MQTT_ROLE=web un processo di ingestione dedicato possiede la connessione al broker
+# e i worker gunicorn (GUNICORN_WORKERS) gli inoltrano le pubblicazioni.
+# Questo script resta il processo principale del container: riavvia il processo di ingestione
+# se termina e inoltra SIGTERM (docker stop) a entrambi, così che i buffer vengano scritti.
+supervise_ingest() {
+    child=""
+    trap 'if [ -n "$child" ]; then kill -TERM "$child" 2>/dev/null; wait "$child"; fi; exit 0' TERM
+    while true; do
+        python ingest.py &
+        child=$!
+        wait "$child"
+        echo "Processo di ingestione terminato (codice $?), riavvio tra 1 secondo."
+        child=""
+        # Attesa interrompibile dal segnale di arresto
+        sleep 1 &
+        wait $!
+    done
+}
+
+supervise_ingest &
+supervisor_pid=$!
+start_gunicorn &
+gunicorn_pid=$!
+
+stopping=""
+trap 'stopping=1; kill -TERM "$gunicorn_pid" "$supervisor_pid" 2>/dev/null' TERM INT
+
+# wait viene interrotto dal segnale: si attende di nuovo la chiusura effettiva di gunicorn
+wait "$gunicorn_pid"
+status=$?
+while kill -0 "$gunicorn_pid" 2>/dev/null; do
+    wait "$gunicorn_pid"
+    status=$?
+done
+
+# Gunicorn terminato da solo: il container si ferma (e viene riavviato dalla policy di restart)
+if [ -z "$stopping" ]; then
+    kill -TERM "$supervisor_pid" 2>/dev/null
+fi
+wait "$supervisor_pid"
+exit "$status"
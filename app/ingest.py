@@ -0,0 +1,34 @@
+import os
+import signal
+import sys
+
+"""
+Processo di ingestione MQTT: l'unico processo collegato al broker quando i worker gunicorn
+vengono avviati con MQTT_ROLE=web. Riceve ed elabora i messaggi dei moduli e pubblica le
+configurazioni, anche per conto dei worker web che gliele inoltrano sul socket MQTT_INGEST_SOCKET.
+
+Uso (dalla cartella app/):
+    python ingest.py
+"""
+
+# Il ruolo va impostato prima della creazione dell'app, che legge la configurazione MQTT
+os.environ['MQTT_ROLE'] = 'ingest'
+
+from app import create_app
+
+
+def main():
+    create_app()
+    print("Processo di ingestione MQTT avviato.")
+
+    # SIGTERM (es. docker stop) termina il processo eseguendo gli handler atexit (scrittura dei buffer)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
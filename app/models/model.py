@@ -18,6 +18,9 @@ class Module(db.Model):
     place = db.Column(db.String(100), nullable=True)
     on = db.Column(db.Boolean, nullable=True, default=False)  # Stato di accensione del modulo (True/False)
     online = db.Column(db.Boolean, nullable=True, default=False)  # Stato di connessione del modulo (True/False)
+    revision = db.Column(db.BigInteger, nullable=True, default=0, index=True)  # Revisione della flotta all'ultima modifica (per il change feed)
+    presence_at = db.Column(DateTime, nullable=True)  # Istante dell'ultimo evento di presenza applicato (sottoscrizioni condivise)
+    presence_session = db.Column(db.BigInteger, nullable=True)  # Sessione del dispositivo dell'ultimo evento di presenza applicato
 
     
     @staticmethod
@@ -52,15 +55,142 @@ class Module(db.Model):
         """
         Restituisce il numero di moduli di un certo tipo.
         """
-        stmt = db.select(Module).where(Module.type == module_type)
-        items = db.session.execute(stmt).scalars().all()
+        stmt = db.select(db.func.count(Module.id)).where(Module.type == module_type)
 
-        return len(items)
+        return db.session.execute(stmt).scalar()
+
+    @staticmethod
+    def get_changed_since(revision):
+        """
+        Restituisce i moduli modificati dopo la revisione indicata, in ordine di revisione.
+        """
+        stmt = db.select(Module).where(Module.revision > revision).order_by(Module.revision, Module.id)
+        items = db.session.execute(stmt)
+
+        return [item for item in items.scalars()]
+
+    def to_json(self):
+        """
+        Converte l'oggetto Module in un dizionario JSON-serializzabile.
+        """
+        return {
+            'id': self.id,
+            'mac': self.mac,
+            'type': self.type,
+            'number': self.number,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'last_update': self.last_update.isoformat() if self.last_update else None,
+            'animation': self.animation,
+            'color': self.color,
+            'place': self.place,
+            'on': self.on,
+            'online': self.online,
+            'revision': self.revision,
+        }
 
     def __repr__(self):
         return f'<Module {self.mac}>'
 
 
+class ModuleTombstone(db.Model):
+    """
+    Traccia dei moduli eliminati, così che il change feed possa segnalarne la rimozione.
+    """
+    __tablename__ = 'module_tombstone'
+    id = db.Column(db.Integer, primary_key=True)  # Id del modulo eliminato
+    mac = db.Column(db.String(17), nullable=False)
+    revision = db.Column(db.BigInteger, nullable=False, index=True)
+
+    @staticmethod
+    def get_since(revision):
+        stmt = db.select(ModuleTombstone).where(ModuleTombstone.revision > revision).order_by(ModuleTombstone.revision)
+        items = db.session.execute(stmt)
+
+        return [item for item in items.scalars()]
+
+
+class RegistryVersion(db.Model):
+    """
+    Contatori di versione dei moduli, una riga per contatore:
+    - REGISTRY (id 1): incrementato ad ogni modifica della configurazione dei moduli, così che
+      gli altri processi si accorgano di dover ricaricare il proprio registro in memoria;
+    - FLEET (id 2): incrementato da qualsiasi modifica, presenza compresa; il suo valore viene
+      assegnato come revisione ai moduli modificati ed è usato per ETag e change feed;
+    - HISTORY_ROLLUP (id 3): ultima ora (in ore dall'epoch) aggregata nello storico dei moduli.
+    """
+    __tablename__ = 'registry_version'
+    REGISTRY = 1
+    FLEET = 2
+    HISTORY_ROLLUP = 3
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    @staticmethod
+    def get_current(counter=REGISTRY):
+        stmt = db.select(RegistryVersion.version).where(RegistryVersion.id == counter)
+        version = db.session.execute(stmt).scalar()
+
+        return version or 0
+
+    @staticmethod
+    def bump(counter=REGISTRY):
+        """
+        Incrementa il contatore nella transazione corrente e restituisce il nuovo valore.
+        """
+        stmt = db.update(RegistryVersion).where(RegistryVersion.id == counter).values(version=RegistryVersion.version + 1)
+        if db.session.execute(stmt).rowcount == 0:
+            db.session.add(RegistryVersion(id=counter, version=1))
+            db.session.flush()
+
+        return RegistryVersion.get_current(counter)
+
+
+class ModuleEvent(db.Model):
+    """
+    Storico append-only degli eventi dei moduli (righe compatte: id del modulo, timestamp in secondi
+    dall'epoch e tipo di evento come piccolo intero). L'id del modulo non è una chiave esterna,
+    così che lo storico sopravviva all'eliminazione del modulo.
+    """
+    __tablename__ = 'module_event'
+    ONLINE = 1
+    OFFLINE = 2
+    CONFIG_PUSH = 3
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    module_id = db.Column(db.Integer, nullable=False)
+    ts = db.Column(db.Integer, nullable=False, index=True)
+    kind = db.Column(db.SmallInteger, nullable=False)
+
+    __table_args__ = (db.Index('ix_module_event_module_ts', 'module_id', 'ts'),)
+
+
+class ModuleUptimeHourly(db.Model):
+    """
+    Aggregato orario dello storico: secondi online, transizioni e configurazioni inviate
+    per modulo e per ora (in ore dall'epoch).
+    """
+    __tablename__ = 'module_uptime_hourly'
+    module_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    online_seconds = db.Column(db.Integer, nullable=False, default=0)
+    transitions = db.Column(db.SmallInteger, nullable=False, default=0)
+    config_pushes = db.Column(db.SmallInteger, nullable=False, default=0)
+    online_at_end = db.Column(db.Boolean, nullable=False, default=False)  # Stato a fine ora, punto di partenza dell'ora successiva
+
+    @staticmethod
+    def get_range(module_id, from_hour, to_hour):
+        """
+        Restituisce gli aggregati di un modulo per le ore in [from_hour, to_hour).
+        """
+        stmt = (db.select(ModuleUptimeHourly)
+                .where(ModuleUptimeHourly.module_id == module_id, ModuleUptimeHourly.hour >= from_hour, ModuleUptimeHourly.hour < to_hour)
+                .order_by(ModuleUptimeHourly.hour))
+        items = db.session.execute(stmt)
+
+        return [item for item in items.scalars()]
+
+
 class User(UserMixin):
     def __init__(self, dn, username):
         self.dn = dn
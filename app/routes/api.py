@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify, Response
+from flask_login import login_required
+from datetime import datetime, timedelta
+from models.model import Module, ModuleTombstone, RegistryVersion
+from services.history_service import get_availability
+
+"""
+API JSON in sola lettura per lo stato dei moduli, pensata per dashboard e script che interrogano
+periodicamente il server. Ogni risposta ha un ETag forte derivato dalla revisione della flotta
+(o del modulo): se il client lo ripresenta in If-None-Match e nulla è cambiato riceve un 304 vuoto.
+Il parametro ?since=<cursor> restituisce solo i moduli modificati (o eliminati) dopo il cursore.
+Gli aggiornamenti di presenza compaiono dopo la loro scrittura da parte del buffer di presenza.
+La disponibilità dei moduli in un intervallo di tempo viene calcolata dagli aggregati orari dello storico.
+"""
+
+api_bp = Blueprint('api_bp', __name__)
+
+
+def _conditional_response(etag, build_body):
+    """
+    Restituisce 304 se il client ha già la versione indicata dall'ETag, altrimenti costruisce
+    il corpo della risposta (solo in questo caso vengono eseguite le query necessarie).
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_body())
+    response.set_etag(etag)
+    # Il client deve sempre rivalidare, ma può riusare la copia in cache se riceve 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@api_bp.route("/modules", methods=["GET"])
+@login_required
+def list_modules():
+    """
+    Elenca tutti i moduli, oppure con ?since=<cursor> solo quelli modificati dopo il cursore.
+    Il campo 'cursor' della risposta va passato come 'since' alla richiesta successiva.
+    """
+    revision = RegistryVersion.get_current(RegistryVersion.FLEET)
+    since = request.args.get('since', type=int)
+
+    if since is None:
+        def build_full():
+            return {'cursor': revision, 'modules': [module.to_json() for module in Module.get_all()]}
+        return _conditional_response(f"fleet-{revision}", build_full)
+
+    def build_feed():
+        if since >= revision:
+            # Flotta invariata: nessuna query oltre alla lettura della revisione
+            return {'cursor': revision, 'modules': [], 'deleted': []}
+
+        modules = Module.get_changed_since(since)
+        changed_ids = {module.id for module in modules}
+        # Un id riusato dopo un'eliminazione compare tra i moduli modificati, non tra quelli eliminati
+        deleted = [{'id': tombstone.id, 'mac': tombstone.mac} for tombstone in ModuleTombstone.get_since(since)
+                   if tombstone.id not in changed_ids]
+        cursor = max([revision] + [module.revision or 0 for module in modules])
+        return {'cursor': cursor, 'modules': [module.to_json() for module in modules], 'deleted': deleted}
+
+    return _conditional_response(f"fleet-{revision}-since-{since}", build_feed)
+
+
+def _module_response(module, module_ref):
+    if not module:
+        return jsonify({'error': f"Module '{module_ref}' not found"}), 404
+    return _conditional_response(f"module-{module.id}-{module.revision or 0}", module.to_json)
+
+
+@api_bp.route("/modules/<int:id>", methods=["GET"])
+@login_required
+def get_module(id):
+    """
+    Restituisce un singolo modulo dato il suo id.
+    """
+    return _module_response(Module.get_one(id), id)
+
+
+@api_bp.route("/modules/mac/<mac>", methods=["GET"])
+@login_required
+def get_module_by_mac(mac):
+    """
+    Restituisce un singolo modulo dato il suo MAC.
+    """
+    return _module_response(Module.get_from_mac(mac), mac)
+
+
+@api_bp.route("/modules/<int:id>/availability", methods=["GET"])
+@login_required
+def get_module_availability(id):
+    """
+    Restituisce la disponibilità di un modulo nell'intervallo ?from=&to= (date ISO 8601,
+    di default le ultime 24 ore), calcolata dagli aggregati orari senza leggere gli eventi grezzi.
+    """
+    if not Module.get_one(id):
+        return jsonify({'error': f"Module '{id}' not found"}), 404
+
+    try:
+        until = datetime.fromisoformat(request.args['to']) if 'to' in request.args else datetime.now()
+        since = datetime.fromisoformat(request.args['from']) if 'from' in request.args else until - timedelta(days=1)
+    except ValueError:
+        return jsonify({'error': "Invalid 'from' or 'to' date, expected ISO 8601"}), 400
+    if since >= until:
+        return jsonify({'error': "'from' must be earlier than 'to'"}), 400
+
+    return jsonify(get_availability(id, since, until))
@@ -1,8 +1,16 @@
-from flask import Blueprint, render_template, request, current_app
+from flask import Blueprint, render_template, request, current_app, jsonify, Response
 from flask_login import login_required
 from datetime import datetime
+import json
 import pathlib
-from services.log_reader_service import parse_log_file, LOG_FILES_CONFIG
+import queue
+import sqlite3
+from services.log_reader_service import LOG_FILES_CONFIG
+from services.log_index_service import query_log_entries, query_merged_log_entries, decode_merged_cursor, normalize_mac, DEFAULT_PAGE_SIZE, MERGED_TAB
+from services.log_cache_service import log_cache
+from services.log_stream_service import get_follower
+from services.stream_limit_service import stream_limiter, stream_unavailable_response
+from services.log_search_service import sync_search_index, search_logs, SEARCH_CATCHUP_BYTES
 
 
 logs_bp = Blueprint('logs_bp', __name__)
@@ -26,25 +34,90 @@ def _format_timestamp_filter(timestamp_str, fmt="%d %b %Y, %H:%M:%S"):
         return timestamp_str # o "Data Invalida"
 
 
+# Intervallo (in secondi) tra due messaggi di keep-alive sullo stream SSE
+STREAM_KEEPALIVE_INTERVAL = 15
+
+# Severità selezionabili nel filtro della pagina dei log
+SEVERITY_FILTERS = ['debug', 'info', 'warning', 'error', 'critical']
+
+
+def _parse_filter_datetime(value, end_of_minute=False):
+    """
+    Converte il valore di un campo datetime-local ('YYYY-MM-DDTHH:MM') nel formato dei timestamp di log.
+    Restituisce None se il valore è vuoto o non valido.
+    """
+    if not value:
+        return None
+    try:
+        dt_object = datetime.strptime(value, '%Y-%m-%dT%H:%M')
+    except ValueError:
+        return None
+    suffix = ':59,999' if end_of_minute else ':00,000'
+    return dt_object.strftime('%Y-%m-%d %H:%M') + suffix
+
+
 @logs_bp.route("/", methods=["GET"])
 @login_required
 def index():
-    log_dir = pathlib.Path(current_app.root_path) / 'logs'
+    log_dir = pathlib.Path(current_app.config['LOG_DIR'])
     
     # Definisce l'ordine delle schede
-    ordered_tabs = ['app', 'auth', 'api', 'microcontrollers']
+    ordered_tabs = ['app', 'auth', 'api', 'microcontrollers', MERGED_TAB]
     
     active_tab = request.args.get('tab', ordered_tabs[0]) # Predefinito alla prima scheda in ordine
 
-    if active_tab not in LOG_FILES_CONFIG:
+    if active_tab not in LOG_FILES_CONFIG and active_tab != MERGED_TAB:
         active_tab = ordered_tabs[0]
 
+    # Parametri di filtro e paginazione
+    page = request.args.get('page', 1, type=int) or 1
+    cursor_value = request.args.get('cursor')
+    severity = request.args.get('severity', '').lower()
+    if severity not in SEVERITY_FILTERS:
+        severity = ''
+    since_value = request.args.get('since', '')
+    until_value = request.args.get('until', '')
+    mac_value = request.args.get('mac', '').strip()
+    # Sorgenti incluse nella timeline unificata (di default tutte)
+    selected_sources = [source for source in request.args.getlist('source') if source in LOG_FILES_CONFIG]
+
+    query_filters = {
+        'severity': severity or None,
+        'since': _parse_filter_datetime(since_value),
+        'until': _parse_filter_datetime(until_value, end_of_minute=True),
+        'mac': normalize_mac(mac_value) or None,
+        'page': page,
+        'page_size': DEFAULT_PAGE_SIZE,
+    }
+
+    # Testo da cercare nell'indice full-text
+    search_query = request.args.get('q', '').strip()
+
     logs_for_active_tab = []
-    log_file_name = LOG_FILES_CONFIG.get(active_tab)
+    cursor = None
+    next_cursor = None
+    has_more_results = False
 
-    if log_file_name:
-        log_file_full_path = log_dir / log_file_name
-        logs_for_active_tab = parse_log_file(log_file_full_path)
+    if search_query:
+        sources = (selected_sources or list(LOG_FILES_CONFIG)) if active_tab == MERGED_TAB else [active_tab]
+        # L'indice è mantenuto dal thread in background (start_search_indexer): la richiesta indicizza
+        # al più SEARCH_CATCHUP_BYTES byte di righe recenti, senza attendere altre sincronizzazioni in corso
+        if SEARCH_CATCHUP_BYTES > 0:
+            try:
+                sync_search_index(log_dir, timeout=0, max_bytes=SEARCH_CATCHUP_BYTES)
+            except sqlite3.OperationalError as e:
+                # Un'altra sincronizzazione è in corso: cerca sull'indice già disponibile
+                current_app.logger.debug(f"TITLE: Log Search Sync Skipped | DESC: Search index busy, using the current index. Error: {str(e)}")
+        logs_for_active_tab, has_more_results = search_logs(log_dir, search_query, sources=sources, page=page, page_size=DEFAULT_PAGE_SIZE)
+    elif active_tab == MERGED_TAB:
+        sources = selected_sources or list(LOG_FILES_CONFIG)
+        log_files = {source: log_dir / LOG_FILES_CONFIG[source] for source in sources}
+        cursor = decode_merged_cursor(cursor_value)
+        logs_for_active_tab, next_cursor = query_merged_log_entries(log_files, cursor=cursor, **query_filters)
+    else:
+        log_file_full_path = log_dir / LOG_FILES_CONFIG[active_tab]
+        cursor = int(cursor_value) if cursor_value and cursor_value.isdigit() else None
+        logs_for_active_tab, next_cursor = query_log_entries(log_file_full_path, cursor=cursor, **query_filters)
     
     # Il template si aspetta logs[active_tab], quindi creiamo un dizionario in questo formato
     # ma popoliamo solo i log della scheda attiva per evitare di caricare tutti i file.
@@ -52,7 +125,79 @@ def index():
         active_tab: logs_for_active_tab
     }
 
+    # Filtri correnti, riutilizzati dal template per costruire i link di paginazione
+    filters = {
+        'tab': active_tab,
+        'severity': severity,
+        'since': since_value,
+        'until': until_value,
+        'mac': mac_value,
+        'source': selected_sources,
+        'q': search_query,
+    }
+
     return render_template('log/index.html', 
                            logs=display_logs, 
                            active_tab=active_tab,
-                           available_tabs=ordered_tabs)
+                           available_tabs=ordered_tabs,
+                           severities=SEVERITY_FILTERS,
+                           log_sources=list(LOG_FILES_CONFIG),
+                           merged_tab=MERGED_TAB,
+                           filters=filters,
+                           page=page,
+                           cursor=cursor,
+                           next_cursor=next_cursor,
+                           has_more_results=has_more_results)
+
+
+@logs_bp.route("/cache-stats", methods=["GET"])
+@login_required
+def cache_stats():
+    """
+    Restituisce in formato JSON i contatori della cache delle voci di log e degli stream aperti del processo corrente.
+    """
+    return jsonify(dict(log_cache.stats(), streams=stream_limiter.stats()))
+
+
+@logs_bp.route("/stream", methods=["GET"])
+@login_required
+def stream():
+    """
+    Stream Server-Sent Events delle nuove voci di log della scheda richiesta.
+    Il file viene seguito da un unico thread condiviso tra tutti i client collegati alla stessa scheda.
+    Ogni connessione occupa comunque un thread del worker: il numero di stream aperti è limitato
+    (insieme a quelli della dashboard dei moduli) da stream_limiter.
+    """
+    active_tab = request.args.get('tab', 'app')
+    log_file_name = LOG_FILES_CONFIG.get(active_tab)
+    if not log_file_name:
+        return jsonify({'error': f"Unknown log tab '{active_tab}'"}), 404
+
+    if not stream_limiter.acquire():
+        return stream_unavailable_response()
+
+    follower = get_follower(pathlib.Path(current_app.config['LOG_DIR']) / log_file_name)
+
+    def generate():
+        subscriber = follower.subscribe()
+        try:
+            # Commento iniziale per aprire subito la connessione lato browser
+            yield ': connected\n\n'
+            while True:
+                try:
+                    log_data = subscriber.get(timeout=STREAM_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"data: {json.dumps(log_data)}\n\n"
+        finally:
+            # Eseguito anche quando il client chiude la connessione
+            follower.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Disabilita il buffering del proxy nginx
+    })
+    # Libera lo stream alla chiusura della risposta, anche se il generatore non è mai stato avviato
+    response.call_on_close(stream_limiter.release)
+    return response
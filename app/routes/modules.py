@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify, Response
 from flask_login import login_required, current_user
 from datetime import datetime
 from models.conn import db
-from models.model import Module
-from services.mqtt_service import publish_new_configuration
+from services.mqtt_service import publish_new_configuration, publish_configurations, publish_group_configuration, presence_buffer, module_registry, module_feed, collect_stats
+from services.mqtt_service import get_config_deliveries, get_config_delivery
+from services.stream_limit_service import stream_limiter, stream_unavailable_response
 import logging
+import queue
 
 api_logger = logging.getLogger('api')
 
@@ -14,18 +16,87 @@ Gestione delle route per la parte di gestione dei moduli.
 
 modules_bp = Blueprint('modules_bp', __name__)
 
+# Animazioni disponibili per tutti i moduli e per i soli moduli di un certo tipo
+COMMON_ANIMATIONS = ('none', 'random', 'flow')
+TYPE_ANIMATIONS = {'numeric': ('pixels',), 'arrow': ('pulse',)}
+
+# Numero di moduli per pagina nella dashboard (multiplo delle 3 colonne della griglia)
+MODULES_PAGE_SIZE = 24
+
+# Intervallo (in secondi) tra due messaggi di keep-alive sullo stream SSE della dashboard
+STREAM_KEEPALIVE_INTERVAL = 15
+
 
 @modules_bp.route("/", methods=["GET"])
 @login_required
 def index():
     """
-    Gestisce l'accesso alla pagina principale che elenca tutti i moduli.
-    Recupera tutti i moduli e i conteggi per tipo (numerico, freccia).
+    Gestisce l'accesso alla pagina principale che elenca i moduli.
+    Mostra i conteggi per tipo (totali e online) e la prima pagina di ciascun tipo;
+    le pagine successive vengono caricate su richiesta da modules_page().
+    """
+    # I moduli vengono letti dal registro in memoria, senza query al database
+    counts = module_registry.counts()
+    numeric_modules, numeric_next = module_registry.page('numeric', limit=MODULES_PAGE_SIZE)
+    arrow_modules, arrow_next = module_registry.page('arrow', limit=MODULES_PAGE_SIZE)
+    # Configurazioni non ancora confermate dal broker (in attesa o fallite) dei moduli mostrati
+    deliveries = get_config_deliveries([module.mac for module in numeric_modules + arrow_modules])
+    return render_template('modules/index.html', counts=counts, deliveries=deliveries,
+                           numeric_modules=numeric_modules, numeric_next=numeric_next,
+                           arrow_modules=arrow_modules, arrow_next=arrow_next)
+
+@modules_bp.route("/page", methods=["GET"])
+@login_required
+def modules_page():
+    """
+    Restituisce il frammento HTML con la pagina successiva dei moduli di un tipo (paginazione keyset:
+    'after' è l'id dell'ultimo modulo già mostrato).
+    """
+    module_type = request.args.get('type')
+    if module_type not in TYPE_ANIMATIONS:
+        return render_template('errors/404.html'), 404
+    after_id = request.args.get('after', 0, type=int)
+
+    modules, next_after = module_registry.page(module_type, after_id, MODULES_PAGE_SIZE)
+    deliveries = get_config_deliveries([module.mac for module in modules])
+    return render_template('modules/_cards.html', modules=modules, module_type=module_type, next_after=next_after, deliveries=deliveries)
+
+@modules_bp.route("/stream", methods=["GET"])
+@login_required
+def stream():
+    """
+    Stream Server-Sent Events delle variazioni dei moduli (online, numero, colore, posizione, ultimo
+    contatto) e dei conteggi per tipo, con cui la dashboard aggiorna solo le schede interessate.
+    I messaggi sono prodotti una sola volta per processo e condivisi tra tutti i client collegati.
+    Ogni connessione occupa comunque un thread del worker: il numero di stream aperti è limitato
+    (insieme a quelli dei log in tempo reale) da stream_limiter.
     """
-    modules = Module.get_all()
-    numeric_count = Module.get_count_by_type('numeric')
-    arrow_count = Module.get_count_by_type('arrow')
-    return render_template('modules/index.html', modules=modules, numeric_count=numeric_count, arrow_count=arrow_count)
+    if not stream_limiter.acquire():
+        return stream_unavailable_response()
+
+    def generate():
+        subscriber = module_feed.subscribe()
+        try:
+            # Commento iniziale per aprire subito la connessione lato browser
+            yield ': connected\n\n'
+            while True:
+                try:
+                    message = subscriber.get(timeout=STREAM_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            # Eseguito anche quando il client chiude la connessione
+            module_feed.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Disabilita il buffering del proxy nginx
+    })
+    # Libera lo stream alla chiusura della risposta, anche se il generatore non è mai stato avviato
+    response.call_on_close(stream_limiter.release)
+    return response
 
 @modules_bp.route("/edit/<int:id>", methods=["GET"])
 @login_required
@@ -33,14 +104,14 @@ def edit(id):
     """
     Gestisce l'accesso alla pagina di modifica di un modulo.
     """
-    module = Module.get_one(id)
+    module = module_registry.get_by_id(id)
     
     if not module:
-        api_logger.warning(f"TITLE: Module Not Found | DESC: Attempt to edit non-existent module ID '{id}' by user '{current_user.username}'.")
+        api_logger.warning("TITLE: Module Not Found | DESC: Attempt to edit non-existent module ID '%s' by user '%s'.", id, current_user.username, extra={'user': current_user.username, 'module_id': id})
         return render_template('errors/404.html'), 404
     # Registra l'accesso alla pagina di modifica
-    api_logger.debug(f"TITLE: Module Edit Page Accessed | DESC: User '{current_user.username}' accessed edit page for module ID '{id}' ('{module.place}').")
-    return render_template('modules/edit.html', module=module)
+    api_logger.debug("TITLE: Module Edit Page Accessed | DESC: User '%s' accessed edit page for module ID '%s' ('%s').", current_user.username, id, module.place, extra={'user': current_user.username, 'module_id': id, 'mac': module.mac})
+    return render_template('modules/edit.html', module=module, delivery=get_config_delivery(module.mac))
 
 
 @modules_bp.route("/edit/<int:id>", methods=["POST"])
@@ -48,33 +119,35 @@ def edit(id):
 def update(id):
     """
     Gestisce l'aggiornamento dei dati di un modulo specifico.
-    Recupera il modulo, aggiorna i suoi campi in base ai dati del form,
-    salva le modifiche e pubblica la nuova configurazione via MQTT.
+    Recupera il modulo dal registro, raccoglie i campi modificati dal form,
+    li salva con un singolo UPDATE e pubblica la nuova configurazione via MQTT.
     """
-    module = Module.get_one(id)
+    module = module_registry.get_by_id(id)
     
     if not module:
-        api_logger.warning(f"TITLE: Module Update Failed (Not Found) | DESC: Attempt to update non-existent module ID '{id}' by user '{current_user.username}'.")
+        api_logger.warning("TITLE: Module Update Failed (Not Found) | DESC: Attempt to update non-existent module ID '%s' by user '%s'.", id, current_user.username, extra={'user': current_user.username, 'module_id': id})
         return render_template('errors/404.html'), 404
     
     # Aggiornamento dei campi dal form
     try:
+        changes = {}
+
         # Gestione accensione/spegnimento
-        module.on = 'is_power_off' in request.form
+        changes['on'] = 'is_power_off' in request.form
         
         # Gestione del colore
         is_color_random = 'is_color_random' in request.form
         if is_color_random:
             # Se è impostato come casuale, usa la stringa 'random'
-            module.color = 'random'
+            changes['color'] = 'random'
         else:
             # Altrimenti, prende il colore esadecimale dal form
-            module.color = request.form.get('color', '#ffffff') # Default a bianco se non specificato
+            changes['color'] = request.form.get('color', '#ffffff') # Default a bianco se non specificato
             
         # Gestione dell'animazione
         animation_value = request.form.get('animation')
         if animation_value:
-            module.animation = animation_value
+            changes['animation'] = animation_value
 
         # Gestione del numero (solo per moduli di tipo 'numeric')
         if module.type == 'numeric' and 'number' in request.form:
@@ -83,7 +156,7 @@ def update(id):
                 number_int = int(number_value)
                 # Verifica che il numero sia tra 0 e 99
                 if 0 <= number_int <= 99:
-                    module.number = number_int
+                    changes['number'] = number_int
                 else:
                     # Se il numero non è nell'intervallo accettabile, mostra un errore
                     flash('Number must be between 0 and 99', 'danger')
@@ -94,24 +167,27 @@ def update(id):
                 return redirect(url_for('modules_bp.edit', id=module.id))
                 
         # Aggiornamento della posizione/luogo del modulo
-        module.place = request.form.get('place', '')
+        changes['place'] = request.form.get('place', '')
         
         # Aggiornamento del timestamp dell'ultima modifica
-        module.last_update = datetime.now()
+        changes['last_update'] = datetime.now()
         
-        # Salvataggio delle modifiche nel database
-        db.session.commit()
+        # Salvataggio delle modifiche nel database (e nel registro in memoria)
+        module = module_registry.update_module(id, **changes)
+        if not module:
+            api_logger.warning("TITLE: Module Update Failed (Not Found) | DESC: Module ID '%s' was deleted before the update by user '%s'.", id, current_user.username, extra={'user': current_user.username, 'module_id': id})
+            return render_template('errors/404.html'), 404
 
         # Invia la nuova configurazione al modulo tramite MQTT
         publish_new_configuration(module)
         
-        api_logger.info(f"TITLE: Module Update Success | DESC: Module ID '{module.id}' ('{module.place}') updated successfully by user '{current_user.username}'.")
+        api_logger.info("TITLE: Module Update Success | DESC: Module ID '%s' ('%s') updated successfully by user '%s'.", module.id, module.place, current_user.username, extra={'user': current_user.username, 'module_id': id, 'mac': module.mac})
         flash('Module successfully udpated', 'success')
         return redirect(url_for('modules_bp.index'))
         
     except Exception as e:
         db.session.rollback()
-        api_logger.error(f"TITLE: Module Update Error | DESC: Error updating module ID '{id}' by user '{current_user.username}'. Error: {str(e)}")
+        api_logger.error("TITLE: Module Update Error | DESC: Error updating module ID '%s' by user '%s'. Error: %s", id, current_user.username, e, extra={'user': current_user.username, 'module_id': id})
         flash(f"Unknown error updating the module", 'danger')
         return redirect(url_for('modules_bp.edit', id=module.id))
 
@@ -122,25 +198,140 @@ def delete(id):
     Gestisce l'eliminazione di un modulo specifico.
     Spegne il modulo via MQTT prima di eliminarlo dal database.
     """
-    module = Module.get_one(id)
+    module = module_registry.get_by_id(id)
     
     if not module:
-        api_logger.warning(f"TITLE: Module Deletion Failed (Not Found) | DESC: Attempt to delete non-existent module ID '{id}' by user '{current_user.username}'.")
+        api_logger.warning("TITLE: Module Deletion Failed (Not Found) | DESC: Attempt to delete non-existent module ID '%s' by user '%s'.", id, current_user.username, extra={'user': current_user.username, 'module_id': id})
         return render_template('errors/404.html'), 404
     
     # Spegni il modulo prima di eliminarlo, inviando una configurazione di "off"
-    module.on = False 
-    publish_new_configuration(module)
+    # (con MQTT_RETAIN_CONFIGS resta come copia retained: il modulo rimane spento anche dopo un riavvio)
+    publish_new_configuration(module._replace(on=False), force=True)
 
-    module_place_for_log = module.place # Memorizza il nome del luogo per il log prima dell'eliminazione
     try:
-        db.session.delete(module)
-        db.session.commit()
-        api_logger.info(f"TITLE: Module Deletion Success | DESC: Module ID '{id}' ('{module_place_for_log}') deleted successfully by user '{current_user.username}'.")
+        module_registry.delete_module(id)
+        presence_buffer.discard(module.mac)
+        api_logger.info("TITLE: Module Deletion Success | DESC: Module ID '%s' ('%s') deleted successfully by user '%s'.", id, module.place, current_user.username, extra={'user': current_user.username, 'module_id': id, 'mac': module.mac})
         flash('Module successfully deleted', 'success')
     except Exception as e:
         db.session.rollback()
-        api_logger.error(f"TITLE: Module Deletion Error | DESC: Error deleting module ID '{id}' ('{module_place_for_log}') by user '{current_user.username}'. Error: {str(e)}")
+        api_logger.error("TITLE: Module Deletion Error | DESC: Error deleting module ID '%s' ('%s') by user '%s'. Error: %s", id, module.place, current_user.username, e, extra={'user': current_user.username, 'module_id': id, 'mac': module.mac})
         flash(f"Unknown error deleting the module", 'danger')
     
-    return redirect(url_for('modules_bp.index'))
\ No newline at end of file
+    return redirect(url_for('modules_bp.index'))
+
+
+@modules_bp.route("/bulk", methods=["GET"])
+@login_required
+def bulk_edit():
+    """
+    Gestisce l'accesso alla pagina di modifica di massa dei moduli.
+    """
+    return render_template('modules/bulk.html', modules=module_registry.get_all(), places=module_registry.get_places())
+
+
+def _get_bulk_params():
+    """
+    Legge i parametri della modifica di massa dal corpo JSON oppure dal form.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        raw_ids = data.get('ids') or []
+    else:
+        data = request.form
+        raw_ids = request.form.getlist('ids')
+    module_ids = [int(module_id) for module_id in raw_ids if str(module_id).isdigit()]
+    return data, module_ids
+
+
+@modules_bp.route("/bulk", methods=["POST"])
+@login_required
+def bulk_update():
+    """
+    Applica la stessa modifica a un gruppo di moduli, selezionati per tipo, luogo e/o lista di id.
+    Le modifiche vengono salvate con un solo UPDATE in un'unica transazione e pubblicate in un unico lotto
+    (oppure con un solo messaggio sul topic di gruppo, se abilitato e se la selezione è un intero gruppo).
+    Accetta sia il form della pagina di modifica di massa sia un corpo JSON con gli stessi campi.
+    """
+    data, module_ids = _get_bulk_params()
+    module_type = data.get('type') or None
+    place = data.get('place') or None
+
+    def fail(message, status=400):
+        api_logger.warning("TITLE: Bulk Module Update Rejected | DESC: %s (user '%s').", message, current_user.username, extra={'user': current_user.username})
+        if request.is_json:
+            return jsonify({'error': message}), status
+        flash(message, 'danger')
+        return redirect(url_for('modules_bp.bulk_edit'))
+
+    if module_type is not None and module_type not in TYPE_ANIMATIONS:
+        return fail(f"Invalid module type '{module_type}'")
+
+    modules = module_registry.select(module_type, place, module_ids)
+    if not modules:
+        return fail('No modules match the selection')
+
+    # Raccolta dei soli campi da modificare
+    changes = {}
+    power = data.get('power')
+    if power in ('on', 'off'):
+        changes['on'] = power == 'on'
+
+    color_mode = data.get('color_mode')
+    if color_mode == 'random':
+        changes['color'] = 'random'
+    elif color_mode == 'custom':
+        changes['color'] = data.get('color', '#ffffff')
+
+    animation = data.get('animation')
+    if animation:
+        allowed = set(COMMON_ANIMATIONS)
+        selected_types = {module.type for module in modules}
+        if len(selected_types) == 1:
+            allowed.update(TYPE_ANIMATIONS.get(selected_types.pop(), ()))
+        if animation not in allowed:
+            return fail(f"Animation '{animation}' is not available for all the selected modules")
+        changes['animation'] = animation
+
+    if not changes:
+        return fail('No changes selected')
+
+    try:
+        updated = module_registry.update_modules([module.id for module in modules], **changes, last_update=datetime.now())
+    except Exception as e:
+        db.session.rollback()
+        api_logger.error("TITLE: Bulk Module Update Error | DESC: Error updating %s modules by user '%s'. Error: %s", len(modules), current_user.username, e, extra={'user': current_user.username})
+        if request.is_json:
+            return jsonify({'error': 'Unknown error updating the modules'}), 500
+        flash('Unknown error updating the modules', 'danger')
+        return redirect(url_for('modules_bp.bulk_edit'))
+
+    # Un intero gruppo (tutti i moduli, o tutti quelli di un tipo) può essere raggiunto con un solo messaggio
+    whole_group = place is None and not module_ids
+    if whole_group and current_app.config['MQTT_GROUP_TOPICS_ENABLED']:
+        publish_group_configuration(module_type or 'all', changes, updated)
+    else:
+        publish_configurations(updated)
+
+    api_logger.info("TITLE: Bulk Module Update Success | DESC: %s modules (type '%s', place '%s', %s explicit ids) updated by user '%s'. Changes: %s", len(updated), module_type, place, len(module_ids), current_user.username, changes, extra={'user': current_user.username})
+    if request.is_json:
+        return jsonify({'updated': [module.id for module in updated]})
+    flash(f"{len(updated)} modules successfully updated", 'success')
+    return redirect(url_for('modules_bp.index'))
+
+
+@modules_bp.route("/stats/ingest", methods=["GET"])
+@login_required
+def ingest_stats():
+    """
+    Restituisce in formato JSON le metriche del pool di elaborazione dei messaggi MQTT
+    (profondità delle code, contatori e latenze), del buffer di presenza, del registro dei moduli,
+    dell'invio delle configurazioni, della scadenza degli heartbeat e dello storico degli eventi.
+    Nei worker web le metriche sono quelle del processo di ingestione, salvo gli stream SSE del worker.
+    """
+    stats = collect_stats()
+    if stats is None:
+        return jsonify({'error': 'MQTT ingest process unreachable'}), 503
+    stats['module_feed'] = module_feed.stats()
+    stats['streams'] = stream_limiter.stats()
+    return jsonify(stats)
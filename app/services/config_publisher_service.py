@@ -0,0 +1,362 @@
+from collections import deque
+from datetime import datetime
+import logging
+import threading
+import time
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Invio delle configurazioni ai moduli con soppressione dei messaggi inutili.
+Per ogni MAC viene ricordata l'ultima configurazione confermata dal broker (PUBACK del QoS 1)
+e quella eventualmente ancora in volo: una configurazione identica non viene ripubblicata.
+Le modifiche ravvicinate allo stesso modulo vengono unite: la prima parte subito, le successive
+entro la finestra di coalescenza vengono sostituite dall'ultima e inviate alla sua scadenza.
+I messaggi in volo (inviati e non ancora confermati) sono limitati da una finestra: oltre il limite
+le configurazioni restano in attesa, una per modulo, e partono man mano che arrivano le conferme.
+Per ogni modulo viene tenuto lo stato dell'ultima consegna, con la latenza tra invio e conferma.
+La funzione di invio viene chiamata senza tenere il lock: il client MQTT prende un proprio lock
+anche nel thread di rete, che chiama acknowledge() mentre lo tiene.
+"""
+
+# Esiti di ConfigPublisher.publish()
+PUBLISHED = 'published'
+DEFERRED = 'deferred'
+COALESCED = 'coalesced'
+SUPPRESSED = 'suppressed'
+FAILED = 'failed'
+
+# Stati della consegna dell'ultima configurazione di un modulo (ConfigPublisher.delivery())
+DELIVERY_QUEUED = 'queued'          # In attesa della finestra di coalescenza o di un posto tra i messaggi in volo
+DELIVERY_PENDING = 'pending'        # Inviata, in attesa della conferma del broker
+DELIVERY_DELIVERED = 'delivered'    # Confermata dal broker
+DELIVERY_FAILED = 'failed'          # Rifiutata dal client, non confermata entro il timeout o persa alla disconnessione
+
+# Numero di latenze recenti usate per i percentili delle statistiche
+LATENCY_SAMPLES = 1000
+
+
+class ConfigPublisher:
+    """
+    Gestisce l'invio delle configurazioni tramite la funzione send(mac, payload),
+    che deve restituire la coppia (codice di ritorno, mid) del client MQTT.
+    `max_inflight` limita i messaggi in volo (0 per non limitarli), `ack_timeout` è il tempo
+    in secondi dopo cui un messaggio non confermato viene considerato non consegnato (0 per mai);
+    il suo posto resta occupato finché il client lo tiene in coda, cioè fino alla conferma
+    o alla disconnessione dal broker.
+    """
+
+    def __init__(self, send, coalesce_window=0.2, max_inflight=0, ack_timeout=0):
+        self.send = send
+        self.coalesce_window = coalesce_window
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self._acked = {}            # mac -> ultima configurazione confermata
+        self._latest_inflight = {}  # mac -> (mid, configurazione) dell'ultimo invio non ancora confermato
+                                    # (al posto del mid un segnaposto finché l'invio è in corso)
+        self._inflight = {}         # mid -> (mac, configurazione, istante di invio), in ordine di invio
+        self._stalled = {}          # mid -> (mac, configurazione, istante di invio) dei messaggi scaduti non confermati
+        self._sending = 0           # Invii in corso fuori dal lock, che occupano già un posto della finestra
+        self._early_acks = set()    # Conferme arrivate mentre erano in corso degli invii
+        self._pending = {}          # mac -> configurazione in attesa della fine della finestra o di un posto libero
+        self._last_sent_at = {}
+        self._deliveries = {}       # mac -> stato dell'ultima consegna
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._condition = threading.Condition()
+        self._thread = None
+        self.published = 0
+        self.deferred = 0
+        self.coalesced = 0
+        self.suppressed = 0
+        self.throttled = 0
+        self.acked = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def start(self):
+        if (self.coalesce_window > 0 or self.max_inflight > 0 or self.ack_timeout > 0) and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='config-publisher', daemon=True)
+            self._thread.start()
+
+    def publish(self, mac, payload, force=False):
+        """
+        Pubblica la configurazione di un modulo, salvo che sia identica a quella già confermata
+        o in volo (a meno di force=True).
+
+        Returns:
+            str: Uno tra PUBLISHED, DEFERRED, COALESCED, SUPPRESSED e FAILED.
+        """
+        with self._condition:
+            if not force and self._is_current(mac, payload):
+                # Il modulo ha già (o sta per ricevere) questa configurazione: un'eventuale
+                # modifica in attesa è stata annullata
+                if self._pending.pop(mac, None) is not None:
+                    self._set_delivery_locked(mac, DELIVERY_PENDING if mac in self._latest_inflight else DELIVERY_DELIVERED)
+                self.suppressed += 1
+                return SUPPRESSED
+
+            if mac in self._pending:
+                self._pending[mac] = payload
+                self.coalesced += 1
+                return COALESCED
+
+            last_sent_at = self._last_sent_at.get(mac)
+            if self._thread is not None and last_sent_at is not None and time.monotonic() - last_sent_at < self.coalesce_window:
+                self.deferred += 1
+                return self._defer_locked(mac, payload)
+
+            if self._thread is not None and self._window_full_locked():
+                # Contropressione: la configurazione aspetta un posto libero invece di accumularsi nel client
+                self.throttled += 1
+                return self._defer_locked(mac, payload)
+
+            reservation = self._reserve_locked(mac, payload)
+
+        return self._send(mac, payload, reservation)
+
+    def acknowledge(self, mid):
+        """
+        Registra la conferma (PUBACK) di un messaggio pubblicato.
+        """
+        with self._condition:
+            entry = self._inflight.pop(mid, None)
+            if entry is None and mid in self._stalled:
+                self._confirm_stalled_locked(mid, *self._stalled.pop(mid))
+                self._condition.notify()
+                return
+            if entry is None:
+                # La conferma può precedere la registrazione del mid da parte di un invio in corso;
+                # senza invii in corso i mid sconosciuti appartengono ad altri messaggi (es. di gruppo)
+                if self._sending:
+                    self._early_acks.add(mid)
+                return
+            self._confirm_locked(mid, *entry)
+            if self._pending:
+                # Si è liberato un posto per le configurazioni in attesa
+                self._condition.notify()
+
+    def forget(self, mac):
+        """
+        Dimentica la configurazione nota di un modulo (es. dopo un last will, perché il modulo
+        potrebbe essersi riavviato): il prossimo invio non verrà soppresso.
+        Anche la configurazione eventualmente in attesa viene scartata: inviata dopo il last will
+        risulterebbe in volo e farebbe sopprimere quella della riconnessione.
+        """
+        with self._condition:
+            self._acked.pop(mac, None)
+            self._latest_inflight.pop(mac, None)
+            if self._pending.pop(mac, None) is not None:
+                self._deliveries.pop(mac, None)
+
+    def reset_inflight(self):
+        """
+        Scarta i messaggi in volo (es. alla disconnessione dal broker, che non li confermerà più).
+        """
+        with self._condition:
+            for mac in self._latest_inflight:
+                if mac not in self._pending:
+                    self._set_delivery_locked(mac, DELIVERY_FAILED, error='disconnected')
+            self._inflight.clear()
+            self._stalled.clear()
+            self._latest_inflight.clear()
+            self._condition.notify()
+
+    def delivery(self, mac):
+        """
+        Restituisce lo stato della consegna dell'ultima configurazione di un modulo
+        (dizionario con state, since, latency_ms ed error), o None se non è mai stata inviata.
+        """
+        with self._condition:
+            delivery = self._deliveries.get(mac)
+            return dict(delivery) if delivery else None
+
+    def deliveries(self, states=(DELIVERY_QUEUED, DELIVERY_PENDING, DELIVERY_FAILED)):
+        """
+        Restituisce gli stati di consegna dei moduli che si trovano in uno degli stati indicati
+        (di default quelli non ancora confermati), indicizzati per MAC.
+        """
+        with self._condition:
+            return {mac: dict(delivery) for mac, delivery in self._deliveries.items() if delivery['state'] in states}
+
+    def stats(self):
+        with self._condition:
+            latencies = sorted(self._latencies)
+            states = {}
+            for delivery in self._deliveries.values():
+                states[delivery['state']] = states.get(delivery['state'], 0) + 1
+            return {
+                'published': self.published,
+                'deferred': self.deferred,
+                'coalesced': self.coalesced,
+                'suppressed': self.suppressed,
+                'throttled': self.throttled,
+                'acked': self.acked,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'in_flight': len(self._inflight),
+                'stalled': len(self._stalled),
+                'in_flight_window': self.max_inflight or None,
+                'pending': len(self._pending),
+                'deliveries': states,
+                'ack_latency_ms': {
+                    'samples': len(latencies),
+                    'p50': latencies[len(latencies) // 2] if latencies else None,
+                    'p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+                    'max': latencies[-1] if latencies else None,
+                },
+            }
+
+    def _is_current(self, mac, payload):
+        latest = self._latest_inflight.get(mac)
+        if latest is not None:
+            return latest[1] == payload
+        return self._acked.get(mac) == payload
+
+    def _window_full_locked(self):
+        return self.max_inflight > 0 and len(self._inflight) + len(self._stalled) + self._sending >= self.max_inflight
+
+    def _defer_locked(self, mac, payload):
+        self._pending[mac] = payload
+        self._set_delivery_locked(mac, DELIVERY_QUEUED)
+        self._condition.notify()
+        return DEFERRED
+
+    def _set_delivery_locked(self, mac, state, latency_ms=None, error=None):
+        self._deliveries[mac] = {'state': state, 'since': datetime.now(), 'latency_ms': latency_ms, 'error': error}
+
+    def _reserve_locked(self, mac, payload):
+        """
+        Prenota l'invio di una configurazione: occupa un posto della finestra e la rende subito
+        la configurazione in volo del modulo, così che una pubblicazione identica venga soppressa.
+
+        Returns:
+            object: Il segnaposto del mid, da passare a _send().
+        """
+        reservation = object()
+        self._sending += 1
+        self._last_sent_at[mac] = time.monotonic()
+        self._latest_inflight[mac] = (reservation, payload)
+        self._set_delivery_locked(mac, DELIVERY_PENDING)
+        return reservation
+
+    def _send(self, mac, payload, reservation):
+        """
+        Invia una configurazione prenotata (senza tenere il lock) e ne registra il mid.
+        """
+        sent_at = time.monotonic()
+        try:
+            result, mid = self.send(mac, payload)
+        except Exception as e:
+            result, mid = str(e), None
+
+        with self._condition:
+            self._sending -= 1
+            latest = self._latest_inflight.get(mac)
+            is_latest = latest is not None and latest[0] is reservation
+
+            if result != 0:
+                self.failed += 1
+                if is_latest:
+                    del self._latest_inflight[mac]
+                    self._set_delivery_locked(mac, DELIVERY_FAILED, error=f"publish rc={result}")
+                outcome = FAILED
+            else:
+                self.published += 1
+                if is_latest:
+                    self._latest_inflight[mac] = (mid, payload)
+                if mid in self._early_acks:
+                    self._early_acks.discard(mid)
+                    self._confirm_locked(mid, mac, payload, sent_at)
+                else:
+                    self._inflight[mid] = (mac, payload, sent_at)
+                outcome = PUBLISHED
+
+            if not self._sending:
+                # Tutti gli invii hanno registrato il proprio mid: le altre conferme erano di altri messaggi
+                self._early_acks.clear()
+            # Un posto potrebbe essersi liberato, o potrebbe esserci un nuovo timeout da attendere
+            self._condition.notify()
+            return outcome
+
+    def _confirm_locked(self, mid, mac, payload, sent_at):
+        self.acked += 1
+        latency_ms = round((time.monotonic() - sent_at) * 1000, 1)
+        self._latencies.append(latency_ms)
+        latest = self._latest_inflight.get(mac)
+        # Una conferma di un invio superato da uno più recente non cambia la configurazione nota
+        if latest is not None and latest[0] == mid:
+            del self._latest_inflight[mac]
+            self._acked[mac] = payload
+            if mac not in self._pending:
+                self._set_delivery_locked(mac, DELIVERY_DELIVERED, latency_ms=latency_ms)
+
+    def _confirm_stalled_locked(self, mid, mac, payload, sent_at):
+        """
+        Conferma tardiva di un messaggio già considerato non consegnato: se nel frattempo il modulo
+        non ha una configurazione più recente in volo o in attesa, questa risulta consegnata.
+        """
+        self.acked += 1
+        latency_ms = round((time.monotonic() - sent_at) * 1000, 1)
+        self._latencies.append(latency_ms)
+        if mac not in self._latest_inflight and mac not in self._pending:
+            self._acked[mac] = payload
+            self._set_delivery_locked(mac, DELIVERY_DELIVERED, latency_ms=latency_ms)
+
+    def _expire_locked(self, now):
+        """
+        Considera non consegnati i messaggi in volo da più di ack_timeout secondi: la configurazione
+        non è più considerata in volo, quindi il prossimo invio non verrà soppresso. Il posto nella
+        finestra non viene liberato, perché il client tiene il messaggio in coda finché il broker non
+        lo conferma: durante un blocco del broker gli invii si fermano invece di accumularsi.
+        """
+        expired = []
+        # I messaggi in volo sono in ordine di invio: basta fermarsi al primo non scaduto
+        for mid, (mac, payload, sent_at) in self._inflight.items():
+            if now - sent_at < self.ack_timeout:
+                break
+            expired.append(mid)
+
+        for mid in expired:
+            entry = self._inflight.pop(mid)
+            self._stalled[mid] = entry
+            mac = entry[0]
+            self.timed_out += 1
+            latest = self._latest_inflight.get(mac)
+            if latest is not None and latest[0] == mid:
+                del self._latest_inflight[mac]
+                if mac not in self._pending:
+                    self._set_delivery_locked(mac, DELIVERY_FAILED, error='ack timeout')
+            microcontrollers_logger.warning("TITLE: MQTT Config Delivery Timeout | DESC: Configuration for module MAC '%s' not acknowledged by the broker within %ss.", mac, self.ack_timeout, extra={'mac': mac})
+
+    def _next_wakeup_locked(self, now):
+        """
+        Secondi fino alla prossima configurazione in attesa da inviare o al prossimo timeout
+        (None se non c'è nulla da attendere se non una nuova pubblicazione o conferma).
+        """
+        waits = []
+        if self._pending and not self._window_full_locked():
+            waits.append(min(self._last_sent_at.get(mac, 0) + self.coalesce_window for mac in self._pending) - now)
+        if self._inflight and self.ack_timeout > 0:
+            waits.append(next(iter(self._inflight.values()))[2] + self.ack_timeout - now)
+        return max(min(waits), 0.001) if waits else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                if self.ack_timeout > 0:
+                    self._expire_locked(now)
+
+                sends = []
+                due = [mac for mac in self._pending if self._last_sent_at.get(mac, 0) + self.coalesce_window <= now]
+                for mac in due:
+                    if self._window_full_locked():
+                        break
+                    payload = self._pending.pop(mac)
+                    sends.append((mac, payload, self._reserve_locked(mac, payload)))
+
+                if not sends:
+                    self._condition.wait(self._next_wakeup_locked(now))
+
+            for mac, payload, reservation in sends:
+                self._send(mac, payload, reservation)
@@ -0,0 +1,265 @@
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from models.conn import db
+from models.model import ModuleEvent, ModuleUptimeHourly, RegistryVersion
+import logging
+import math
+import os
+import threading
+import time
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Storico compatto degli eventi dei moduli (online, offline, invio di configurazione).
+Gli eventi vengono accumulati in memoria e inseriti a lotti; un job periodico li aggrega per ora
+(secondi online, transizioni, configurazioni inviate) e applica la retention: gli eventi grezzi
+vengono conservati per pochi giorni, gli aggregati orari molto più a lungo. Le interrogazioni sulla
+disponibilità di un modulo leggono solo gli aggregati.
+"""
+
+# Intervallo (in secondi) tra due inserimenti a lotti degli eventi
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 5))
+
+# Numero di eventi in attesa oltre il quale l'inserimento viene anticipato
+HISTORY_FLUSH_ROWS = int(os.getenv('HISTORY_FLUSH_ROWS', 1000))
+
+# Intervallo (in secondi) del job di aggregazione e retention
+HISTORY_ROLLUP_INTERVAL = int(os.getenv('HISTORY_ROLLUP_INTERVAL', 300))
+
+# Retention (in giorni) degli eventi grezzi e degli aggregati orari
+HISTORY_RAW_RETENTION_DAYS = int(os.getenv('HISTORY_RAW_RETENTION_DAYS', 7))
+HISTORY_ROLLUP_RETENTION_DAYS = int(os.getenv('HISTORY_ROLLUP_RETENTION_DAYS', 365))
+
+# Attesa (in secondi) dopo la fine di un'ora prima di aggregarla, per includere gli eventi ancora in buffer
+ROLLUP_GRACE_SECONDS = 120
+
+# Numero massimo di ore aggregate per esecuzione del job (recupero graduale dopo una lunga pausa)
+ROLLUP_MAX_HOURS = 24
+
+HOUR = 3600
+DAY = 86400
+
+
+class HistoryRecorder:
+    """
+    Registra gli eventi dei moduli e ne mantiene gli aggregati orari.
+    """
+
+    def __init__(self, app, flush_interval=HISTORY_FLUSH_INTERVAL, max_rows=HISTORY_FLUSH_ROWS, rollup_interval=HISTORY_ROLLUP_INTERVAL):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.rollup_interval = rollup_interval
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self.recorded = 0
+        self.rows_written = 0
+        self.hours_rolled = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='module-history', daemon=True)
+            self._thread.start()
+
+    def record(self, module_id, kind, ts=None):
+        """
+        Accoda un evento (ModuleEvent.ONLINE, OFFLINE o CONFIG_PUSH) per il modulo indicato.
+        """
+        if module_id is None:
+            return
+        with self._condition:
+            self._pending.append({'module_id': module_id, 'ts': int(ts if ts is not None else time.time()), 'kind': kind})
+            self.recorded += 1
+            if len(self._pending) >= self.max_rows:
+                self._condition.notify()
+
+    def flush(self):
+        """
+        Inserisce gli eventi in attesa con un unico INSERT multiplo.
+        """
+        with self._condition:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        try:
+            with self.app.app_context():
+                db.session.execute(ModuleEvent.__table__.insert(), pending)
+                db.session.commit()
+        except Exception as e:
+            with self._condition:
+                self._pending[:0] = pending
+            microcontrollers_logger.error("TITLE: History Flush Error | DESC: Failed to write %s module events. Error: %s", len(pending), e)
+            return 0
+
+        self.rows_written += len(pending)
+        return len(pending)
+
+    def rollup(self, now=None):
+        """
+        Aggrega le ore concluse non ancora aggregate. L'avanzamento del watermark avviene con un
+        compare-and-set nella stessa transazione degli aggregati, così che ogni ora venga aggregata
+        da un solo processo.
+
+        Returns:
+            int: Numero di ore aggregate.
+        """
+        last_complete_hour = int(((now or time.time()) - ROLLUP_GRACE_SECONDS) // HOUR) - 1
+        rolled = 0
+        with self.app.app_context():
+            while rolled < ROLLUP_MAX_HOURS:
+                stored = RegistryVersion.get_current(RegistryVersion.HISTORY_ROLLUP)
+                watermark = stored
+                if stored == 0:
+                    first_ts = db.session.execute(db.select(db.func.min(ModuleEvent.ts))).scalar()
+                    if first_ts is None:
+                        break
+                    watermark = first_ts // HOUR - 1
+
+                hour = watermark + 1
+                if hour > last_complete_hour:
+                    break
+                if not _claim_hour(stored, hour):
+                    db.session.rollback()
+                    break
+
+                rows = _aggregate_hour(hour)
+                db.session.execute(db.delete(ModuleUptimeHourly).where(ModuleUptimeHourly.hour == hour))
+                if rows:
+                    db.session.execute(ModuleUptimeHourly.__table__.insert(), rows)
+                db.session.commit()
+                rolled += 1
+
+        self.hours_rolled += rolled
+        return rolled
+
+    def purge(self, now=None):
+        """
+        Applica la retention: elimina gli eventi grezzi più vecchi di HISTORY_RAW_RETENTION_DAYS
+        (mai quelli non ancora aggregati) e gli aggregati più vecchi di HISTORY_ROLLUP_RETENTION_DAYS.
+        Le cancellazioni sono per intervallo di tempo sugli indici di ts/hour.
+        """
+        now = now or time.time()
+        with self.app.app_context():
+            watermark = RegistryVersion.get_current(RegistryVersion.HISTORY_ROLLUP)
+            raw_cutoff = min(int(now - HISTORY_RAW_RETENTION_DAYS * DAY), (watermark + 1) * HOUR)
+            rollup_cutoff = int((now - HISTORY_ROLLUP_RETENTION_DAYS * DAY) // HOUR)
+            events = db.session.execute(db.delete(ModuleEvent).where(ModuleEvent.ts < raw_cutoff)).rowcount
+            rollups = db.session.execute(db.delete(ModuleUptimeHourly).where(ModuleUptimeHourly.hour < rollup_cutoff)).rowcount
+            db.session.commit()
+        return events, rollups
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'recorded': self.recorded,
+            'rows_written': self.rows_written,
+            'hours_rolled': self.hours_rolled,
+        }
+
+    def _run(self):
+        next_rollup = time.monotonic() + self.rollup_interval
+        while True:
+            with self._condition:
+                if len(self._pending) < self.max_rows:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+            if self.rollup_interval > 0 and time.monotonic() >= next_rollup:
+                next_rollup = time.monotonic() + self.rollup_interval
+                try:
+                    self.rollup()
+                    self.purge()
+                except Exception as e:
+                    microcontrollers_logger.error("TITLE: History Rollup Error | DESC: Failed to aggregate or purge the module history. Error: %s", e)
+
+
+def _claim_hour(stored, hour):
+    """
+    Avanza il watermark da `stored` a `hour` solo se nessun altro processo lo ha già fatto.
+    """
+    stmt = (db.update(RegistryVersion)
+            .where(RegistryVersion.id == RegistryVersion.HISTORY_ROLLUP, RegistryVersion.version == stored)
+            .values(version=hour))
+    if db.session.execute(stmt).rowcount:
+        return True
+    if stored != 0:
+        return False
+    try:
+        db.session.add(RegistryVersion(id=RegistryVersion.HISTORY_ROLLUP, version=hour))
+        db.session.flush()
+    except IntegrityError:
+        return False
+    return True
+
+
+def _aggregate_hour(hour):
+    """
+    Calcola gli aggregati di un'ora a partire dallo stato di fine dell'ora precedente
+    e dagli eventi dell'ora. Gli eventi ripetuti con lo stesso stato non contano come transizioni.
+    """
+    start, end = hour * HOUR, (hour + 1) * HOUR
+    previous = db.session.execute(
+        db.select(ModuleUptimeHourly.module_id)
+        .where(ModuleUptimeHourly.hour == hour - 1, ModuleUptimeHourly.online_at_end.is_(True))
+    ).scalars()
+    online_since = {module_id: start for module_id in previous}
+    totals = {module_id: [0, 0, 0] for module_id in online_since}  # secondi online, transizioni, configurazioni
+
+    events = db.session.execute(
+        db.select(ModuleEvent.module_id, ModuleEvent.ts, ModuleEvent.kind)
+        .where(ModuleEvent.ts >= start, ModuleEvent.ts < end)
+        .order_by(ModuleEvent.ts, ModuleEvent.id)
+    )
+    for module_id, ts, kind in events:
+        total = totals.setdefault(module_id, [0, 0, 0])
+        if kind == ModuleEvent.CONFIG_PUSH:
+            total[2] += 1
+        elif kind == ModuleEvent.ONLINE and module_id not in online_since:
+            online_since[module_id] = ts
+            total[1] += 1
+        elif kind == ModuleEvent.OFFLINE and module_id in online_since:
+            total[0] += ts - online_since.pop(module_id)
+            total[1] += 1
+
+    for module_id, since in online_since.items():
+        totals[module_id][0] += end - since
+
+    return [{'module_id': module_id, 'hour': hour, 'online_seconds': online_seconds, 'transitions': transitions,
+             'config_pushes': config_pushes, 'online_at_end': module_id in online_since}
+            for module_id, (online_seconds, transitions, config_pushes) in totals.items()]
+
+
+def get_availability(module_id, since, until):
+    """
+    Calcola la disponibilità di un modulo nell'intervallo [since, until) leggendo solo gli aggregati orari.
+    L'intervallo viene allineato alle ore e limitato all'ultima ora aggregata.
+
+    Returns:
+        dict: Secondi coperti e online, disponibilità (0-1, None se nessuna ora è aggregata),
+              transizioni, configurazioni inviate e dettaglio per ora.
+    """
+    from_hour = int(since.timestamp() // HOUR)
+    to_hour = math.ceil(until.timestamp() / HOUR)
+    rolled_up_to = RegistryVersion.get_current(RegistryVersion.HISTORY_ROLLUP) + 1
+    to_hour = min(to_hour, rolled_up_to)
+
+    rows = ModuleUptimeHourly.get_range(module_id, from_hour, to_hour) if to_hour > from_hour else []
+    covered = max(to_hour - from_hour, 0) * HOUR
+    online = sum(row.online_seconds for row in rows)
+    return {
+        'module_id': module_id,
+        'from': datetime.fromtimestamp(from_hour * HOUR).isoformat(),
+        'to': datetime.fromtimestamp(max(to_hour, from_hour) * HOUR).isoformat(),
+        'covered_seconds': covered,
+        'online_seconds': online,
+        'availability': round(online / covered, 4) if covered else None,
+        'transitions': sum(row.transitions for row in rows),
+        'config_pushes': sum(row.config_pushes for row in rows),
+        'hours': [{'hour': datetime.fromtimestamp(row.hour * HOUR).isoformat(), 'online_seconds': row.online_seconds}
+                  for row in rows],
+    }
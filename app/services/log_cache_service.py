@@ -0,0 +1,220 @@
+from collections import OrderedDict, deque
+import os
+import threading
+from services.log_reader_service import iter_log_entries_reverse, complete_lines_end, _parse_log_line, TAIL_BLOCK_SIZE
+
+"""
+Cache di processo delle voci di log già analizzate.
+Per ogni file viene mantenuta in memoria una finestra delle voci più recenti, validata
+tramite inode, dimensione e data di modifica del file. Se il file è solo cresciuto vengono
+analizzati soltanto i byte aggiunti; se è stato ruotato la finestra viene ricostruita.
+L'analisi del file avviene fuori dal lock della cache, su una copia della finestra che viene
+pubblicata solo al termine: le richieste sugli altri file non restano in attesa.
+"""
+
+# Numero massimo di voci mantenute in memoria per ogni file
+MAX_ENTRIES_PER_FILE = int(os.getenv('LOG_CACHE_MAX_ENTRIES', 2000))
+
+# Memoria massima stimata (in byte) occupata dall'intera cache, per singolo processo
+MAX_CACHE_BYTES = int(os.getenv('LOG_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# Overhead stimato di una voce (dizionario e stringhe) oltre alla lunghezza della riga
+_ENTRY_OVERHEAD_BYTES = 400
+
+
+class _CachedLog:
+    """
+    Finestra delle voci più recenti di un singolo file di log.
+    La finestra è limitata a max_entries voci anche durante l'analisi: le voci più vecchie
+    vengono scartate man mano che ne arrivano di nuove.
+    """
+    __slots__ = ('inode', 'size', 'mtime', 'end_offset', 'entries', 'covers_start', 'estimated_bytes')
+
+    def __init__(self, inode, max_entries):
+        self.inode = inode
+        self.size = 0
+        self.mtime = 0
+        self.end_offset = 0          # Offset successivo all'ultima riga completa analizzata
+        self.entries = deque(maxlen=max_entries)  # (offset, voce, byte stimati), dalla più vecchia alla più recente
+        self.covers_start = True     # True se la finestra contiene tutte le voci dall'inizio del file
+        self.estimated_bytes = 0
+
+    def copy(self):
+        cached = _CachedLog(self.inode, self.entries.maxlen)
+        cached.size = self.size
+        cached.mtime = self.mtime
+        cached.end_offset = self.end_offset
+        cached.entries.extend(self.entries)
+        cached.covers_start = self.covers_start
+        cached.estimated_bytes = self.estimated_bytes
+        return cached
+
+    def window_span(self):
+        """Byte del file coperti dalla finestra."""
+        return self.end_offset - self.entries[0][0] if self.entries else 0
+
+    def append(self, offset, log_data, line_length):
+        if len(self.entries) == self.entries.maxlen:
+            # La deque scarta la voce più vecchia: la finestra non parte più dall'inizio del file
+            self.estimated_bytes -= self.entries[0][2]
+            self.covers_start = False
+        entry_bytes = line_length + _ENTRY_OVERHEAD_BYTES
+        self.entries.append((offset, log_data, entry_bytes))
+        self.estimated_bytes += entry_bytes
+
+
+class ParsedLogCache:
+    """
+    Cache LRU delle voci di log analizzate, condivisa da tutte le richieste del processo.
+    """
+
+    def __init__(self, max_entries_per_file=MAX_ENTRIES_PER_FILE, max_bytes=MAX_CACHE_BYTES):
+        self.max_entries_per_file = max_entries_per_file
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.incremental_updates = 0
+        self.resets = 0
+        self.evictions = 0
+
+    def get_entries(self, log_file_path):
+        """
+        Restituisce la finestra aggiornata delle voci più recenti di un file di log.
+
+        Returns:
+            tuple: (voci, covers_start) dove voci è una lista di (offset, voce) dalla più vecchia
+                   alla più recente e covers_start indica se la finestra parte dall'inizio del file.
+                   Restituisce ([], True) se il file non esiste.
+        """
+        key = str(log_file_path)
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            with self._lock:
+                self._drop(key)
+            return [], True
+
+        with self._lock:
+            cached = self._files.get(key)
+            if cached and cached.inode == stat.st_ino and cached.size == stat.st_size and cached.mtime == stat.st_mtime_ns:
+                self.hits += 1
+                self._files.move_to_end(key)
+                return self._snapshot(cached)
+            self.misses += 1
+
+        # Le finestre salvate non vengono mai modificate: l'analisi avviene fuori dal lock su una copia
+        appended_bytes = stat.st_size - cached.end_offset if cached and cached.inode == stat.st_ino else -1
+        if 0 <= appended_bytes <= max(cached.window_span(), TAIL_BLOCK_SIZE):
+            # Il file è solo cresciuto di poco: analizza solo i byte aggiunti
+            updated = self._parse_appended(key, cached.copy(), stat)
+            incremental = True
+        else:
+            # Nuovo file, rotazione (inode diverso), troncamento, oppure byte aggiunti
+            # più della finestra stessa: ricostruisce la finestra leggendo solo la coda del file
+            updated = self._load_tail(key, stat)
+            incremental = False
+
+        with self._lock:
+            if incremental:
+                self.incremental_updates += 1
+            elif cached:
+                self.resets += 1
+
+            current = self._files.get(key)
+            # Un'altra richiesta potrebbe aver già salvato una finestra più aggiornata dello stesso file
+            if current is None or current.inode != updated.inode or current.end_offset <= updated.end_offset:
+                self._drop(key)
+                self._store(key, updated)
+            if key in self._files:
+                self._files.move_to_end(key)
+            return self._snapshot(updated)
+
+    def stats(self):
+        """
+        Restituisce i contatori della cache.
+        """
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'estimated_bytes': self._total_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'incremental_updates': self.incremental_updates,
+                'resets': self.resets,
+                'evictions': self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+
+    @staticmethod
+    def _snapshot(cached):
+        return [(offset, log_data) for offset, log_data, _ in cached.entries], cached.covers_start
+
+    def _total_bytes(self):
+        return sum(cached.estimated_bytes for cached in self._files.values())
+
+    def _drop(self, key):
+        self._files.pop(key, None)
+
+    def _store(self, key, cached):
+        self._files[key] = cached
+        # Evizione LRU dei file meno recenti finché la memoria stimata supera il limite
+        while len(self._files) > 1 and self._total_bytes() > self.max_bytes:
+            self._files.popitem(last=False)
+            self.evictions += 1
+
+    def _load_tail(self, key, stat):
+        """
+        Costruisce la finestra leggendo a ritroso la coda del file.
+        """
+        cached = _CachedLog(stat.st_ino, self.max_entries_per_file)
+        cached.size = stat.st_size
+        cached.mtime = stat.st_mtime_ns
+
+        with open(key, 'rb') as f:
+            cached.end_offset = complete_lines_end(f, stat.st_size)
+
+        # La lunghezza di ogni riga è stimata dalla distanza dall'offset della riga successiva
+        tail = []
+        next_offset = cached.end_offset
+        for offset, log_data in iter_log_entries_reverse(key, end_offset=cached.end_offset):
+            tail.append((offset, log_data, next_offset - offset))
+            next_offset = offset
+            if len(tail) >= self.max_entries_per_file:
+                cached.covers_start = False
+                break
+
+        for offset, log_data, line_length in reversed(tail):
+            cached.append(offset, log_data, line_length)
+
+        return cached
+
+    def _parse_appended(self, key, cached, stat):
+        """
+        Analizza le sole righe complete aggiunte dopo l'ultimo offset noto e restituisce la finestra aggiornata.
+        """
+        offset = cached.end_offset
+        with open(key, 'rb') as f:
+            f.seek(offset)
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    # Riga ancora in scrittura: verrà analizzata al prossimo accesso
+                    break
+                line_content = raw_line.decode('utf-8', errors='replace').strip()
+                log_data = _parse_log_line(line_content) if line_content else None
+                if log_data is not None:
+                    cached.append(offset, log_data, len(raw_line))
+                offset += len(raw_line)
+
+        cached.end_offset = offset
+        cached.size = stat.st_size
+        cached.mtime = stat.st_mtime_ns
+        return cached
+
+
+# Istanza condivisa dal processo
+log_cache = ParsedLogCache()
@@ -0,0 +1,419 @@
+from flask import current_app
+from operator import itemgetter
+import heapq
+import json
+import os
+import threading
+from services.log_reader_service import iter_log_entries_reverse, read_line_header, complete_lines_end
+from services.log_cache_service import log_cache
+
+"""
+Indice sparso persistente (file sidecar) per i file di log.
+Per ogni blocco di circa CHECKPOINT_INTERVAL byte vengono memorizzati l'offset di inizio e fine,
+il timestamp minimo e massimo e il numero di righe per severità. In questo modo una ricerca
+per intervallo di tempo o per severità si riduce a un seek e alla lettura di pochi blocchi.
+"""
+
+# Versione del formato del file sidecar: se cambia l'indice viene ricostruito
+# (2: i conteggi per severità escludono le righe di continuazione dei messaggi su più righe)
+INDEX_FORMAT_VERSION = 2
+
+# Dimensione approssimativa (in byte) di ogni blocco indicizzato
+CHECKPOINT_INTERVAL = 64 * 1024
+
+# Estensione del file sidecar, salvato accanto al file di log
+INDEX_FILE_SUFFIX = '.idx'
+
+# Dimensione della pagina di default per la navigazione dei log
+DEFAULT_PAGE_SIZE = 50
+
+# Nome della vista che unisce tutti i file di log in un'unica timeline
+MERGED_TAB = 'all'
+
+# Indici già caricati in memoria, per evitare di rileggere il sidecar ad ogni richiesta
+_loaded_indexes = {}
+_index_lock = threading.Lock()
+
+
+def _index_path(log_file_path):
+    return f"{log_file_path}{INDEX_FILE_SUFFIX}"
+
+
+def _empty_index(inode):
+    return {
+        'version': INDEX_FORMAT_VERSION,
+        'inode': inode,
+        'indexed_size': 0,
+        # Ogni checkpoint: [offset_inizio, offset_fine, timestamp_min, timestamp_max, {severità: conteggio}]
+        'checkpoints': [],
+    }
+
+
+def _load_index(log_file_path):
+    """
+    Carica l'indice dal file sidecar, usando la copia in memoria se il sidecar non è cambiato.
+    """
+    index_path = _index_path(log_file_path)
+    try:
+        index_mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _loaded_indexes.get(index_path)
+    if cached and cached[0] == index_mtime:
+        return cached[1]
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('version') != INDEX_FORMAT_VERSION:
+        return None
+
+    _loaded_indexes[index_path] = (index_mtime, index)
+    return index
+
+
+def _save_index(log_file_path, index):
+    """
+    Salva l'indice sul file sidecar in modo atomico (scrittura su file temporaneo e rename).
+    """
+    index_path = _index_path(log_file_path)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+    _loaded_indexes[index_path] = (os.stat(index_path).st_mtime_ns, index)
+
+
+def _index_from_offset(log_file_path, index, start_offset):
+    """
+    Analizza in avanti il file a partire da start_offset, aggiungendo i checkpoint mancanti.
+    Vengono indicizzate solo le righe complete (terminate da un a capo).
+    """
+    checkpoint = None
+    offset = start_offset
+
+    with open(log_file_path, 'rb') as f:
+        f.seek(start_offset)
+        for raw_line in f:
+            if not raw_line.endswith(b'\n'):
+                # Riga ancora in scrittura: verrà indicizzata al prossimo aggiornamento
+                break
+
+            if checkpoint is None:
+                checkpoint = [offset, offset, None, None, {}]
+
+            header = read_line_header(raw_line)
+            if header:
+                timestamp, severity = header
+                if checkpoint[2] is None or timestamp < checkpoint[2]:
+                    checkpoint[2] = timestamp
+                if checkpoint[3] is None or timestamp > checkpoint[3]:
+                    checkpoint[3] = timestamp
+                checkpoint[4][severity] = checkpoint[4].get(severity, 0) + 1
+
+            offset += len(raw_line)
+            checkpoint[1] = offset
+
+            if checkpoint[1] - checkpoint[0] >= CHECKPOINT_INTERVAL:
+                index['checkpoints'].append(checkpoint)
+                checkpoint = None
+
+    if checkpoint is not None:
+        index['checkpoints'].append(checkpoint)
+
+    index['indexed_size'] = offset
+
+
+def update_log_index(log_file_path):
+    """
+    Aggiorna in modo incrementale l'indice sidecar di un file di log e lo restituisce.
+    Se il file è stato ruotato (inode diverso) o troncato, l'indice viene ricostruito da zero.
+    Altrimenti viene rianalizzato solo l'ultimo blocco (eventualmente incompleto) e i byte aggiunti.
+
+    Returns:
+        dict: L'indice aggiornato, oppure None se il file di log non esiste.
+    """
+    try:
+        stat = os.stat(log_file_path)
+    except FileNotFoundError:
+        return None
+
+    with _index_lock:
+        index = _load_index(log_file_path)
+
+        if index is None or index['inode'] != stat.st_ino or stat.st_size < index['indexed_size']:
+            index = _empty_index(stat.st_ino)
+        elif stat.st_size == index['indexed_size']:
+            return index
+
+        # L'ultimo checkpoint potrebbe essere incompleto: viene rimosso e ricalcolato
+        start_offset = 0
+        if index['checkpoints']:
+            start_offset = index['checkpoints'].pop()[0]
+
+        _index_from_offset(log_file_path, index, start_offset)
+
+        try:
+            _save_index(log_file_path, index)
+        except OSError as e:
+            current_app.logger.warning(f"TITLE: Errore Salvataggio Indice Log | DESC: Impossibile salvare l'indice per {log_file_path}. Errore: {str(e)}")
+
+        return index
+
+
+def normalize_mac(mac):
+    """Normalizza un indirizzo MAC per il confronto (maiuscolo, senza separatori)."""
+    return mac.replace(':', '').replace('-', '').upper()
+
+
+def _mac_matches(log_data, mac):
+    # Le voci strutturate (LOG_STRUCTURED) hanno il campo mac; per le altre si cerca nella descrizione
+    if log_data.get('mac'):
+        return normalize_mac(str(log_data['mac'])) == mac
+    return mac in normalize_mac(log_data['description'])
+
+
+def _entry_matches(log_data, severity, since, until, mac=None):
+    if severity and log_data['severity'] != severity:
+        return False
+    if since and log_data['timestamp'] < since:
+        return False
+    if until and log_data['timestamp'] > until:
+        return False
+    if mac and not _mac_matches(log_data, mac):
+        return False
+    return True
+
+
+def _query_cached_entries(log_file_path, severity, since, until, mac, cursor, skip, page_size):
+    """
+    Prova a soddisfare la richiesta usando la finestra di voci in cache.
+
+    Returns:
+        tuple: (voci, next_cursor), oppure None se la finestra in cache non è sufficiente.
+    """
+    cached_entries, covers_start = log_cache.get_entries(log_file_path)
+
+    entries = []
+    for offset, log_data in reversed(cached_entries):
+        if cursor is not None and offset >= cursor:
+            continue
+        if not _entry_matches(log_data, severity, since, until, mac):
+            continue
+        if skip:
+            skip -= 1
+            continue
+        if len(entries) == page_size:
+            return entries, last_offset
+        entries.append(log_data)
+        last_offset = offset
+
+    if covers_start:
+        return entries, None
+    return None
+
+
+def _iter_candidate_blocks(index, end_offset, severity, since, until, mac):
+    """
+    Restituisce i blocchi dell'indice che possono contenere voci valide, dal più recente al più vecchio,
+    saltando quelli con intervallo di tempo o severità non compatibili.
+
+    Yields:
+        tuple: (offset_inizio, offset_fine, voci_valide, fully_covered) dove voci_valide è il numero
+               di voci con la severità richiesta e fully_covered indica se tutte rispettano il filtro.
+    """
+    for start, end, min_ts, max_ts, counts in reversed(index['checkpoints']):
+        if start >= end_offset:
+            continue
+        if min_ts is None:
+            continue
+        # I log sono scritti in ordine cronologico: i blocchi precedenti sono tutti più vecchi
+        if since and max_ts < since:
+            break
+        if until and min_ts > until:
+            continue
+
+        matching = counts.get(severity, 0) if severity else sum(counts.values())
+        if matching == 0:
+            continue
+
+        block_end = min(end, end_offset)
+        # Il filtro per MAC non è riflesso nei conteggi del blocco, che quindi va sempre letto
+        fully_covered = block_end == end and not mac and (not since or min_ts >= since) and (not until or max_ts <= until)
+        yield start, block_end, matching, fully_covered
+
+
+def _iter_block_entries(log_file_path, start, end, severity, since, until, mac):
+    for offset, log_data in iter_log_entries_reverse(log_file_path, end_offset=end, start_offset=start):
+        if _entry_matches(log_data, severity, since, until, mac):
+            yield offset, log_data
+
+
+def _iter_indexed_entries(log_file_path, severity, since, until, mac, end_offset):
+    """
+    Restituisce le voci valide di un file di log precedenti a end_offset, dalla più recente alla più vecchia.
+    Le voci presenti nella cache vengono servite dalla memoria; per quelle più vecchie
+    vengono letti solo i blocchi dell'indice compatibili con il filtro.
+
+    Yields:
+        tuple: (offset, voce)
+    """
+    cached_entries, covers_start = log_cache.get_entries(log_file_path)
+    for offset, log_data in reversed(cached_entries):
+        if offset < end_offset and _entry_matches(log_data, severity, since, until, mac):
+            yield offset, log_data
+
+    if covers_start:
+        return
+    if cached_entries:
+        end_offset = min(end_offset, cached_entries[0][0])
+
+    index = update_log_index(log_file_path)
+    if index is None:
+        return
+
+    end_offset = min(end_offset, index['indexed_size'])
+    for start, block_end, _, _ in _iter_candidate_blocks(index, end_offset, severity, since, until, mac):
+        yield from _iter_block_entries(log_file_path, start, block_end, severity, since, until, mac)
+
+
+def query_log_entries(log_file_path, severity=None, since=None, until=None, mac=None, cursor=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Restituisce una pagina di voci di log filtrate, dalla più recente alla più vecchia.
+    Le pagine contenute nella cache delle voci più recenti non richiedono alcuna lettura del file.
+    Negli altri casi i blocchi dell'indice che non possono contenere voci valide (intervallo di tempo
+    o severità non compatibili) vengono saltati senza leggerli; i blocchi interamente
+    compresi nel filtro vengono saltati anche durante la paginazione per numero di pagina.
+
+    Args:
+        log_file_path (str): Il percorso del file di log.
+        severity (str): Severità richiesta in minuscolo (es. 'error'), o None per tutte.
+        since (str): Timestamp minimo nel formato 'YYYY-MM-DD HH:MM:SS,mmm', o None.
+        until (str): Timestamp massimo nel formato 'YYYY-MM-DD HH:MM:SS,mmm', o None.
+        mac (str): Indirizzo MAC normalizzato (vedi normalize_mac) a cui limitare le voci, o None.
+        cursor (int): Offset in byte restituito dalla pagina precedente; se presente ha la precedenza su page.
+        page (int): Numero di pagina (a partire da 1), usato solo in assenza di cursor.
+        page_size (int): Numero di voci per pagina.
+
+    Returns:
+        tuple: (voci, next_cursor) dove next_cursor è None se non ci sono altre voci.
+    """
+    skip = 0 if cursor is not None else (max(page, 1) - 1) * page_size
+
+    # Le pagine più recenti vengono servite direttamente dalle voci già analizzate in memoria
+    cached_result = _query_cached_entries(log_file_path, severity, since, until, mac, cursor, skip, page_size)
+    if cached_result is not None:
+        return cached_result
+
+    index = update_log_index(log_file_path)
+    if index is None:
+        return [], None
+
+    end_offset = index['indexed_size']
+    if cursor is not None:
+        end_offset = min(cursor, end_offset)
+
+    entries = []
+    last_offset = None
+
+    for start, block_end, matching, fully_covered in _iter_candidate_blocks(index, end_offset, severity, since, until, mac):
+        if fully_covered and skip >= matching:
+            skip -= matching
+            continue
+
+        for offset, log_data in _iter_block_entries(log_file_path, start, block_end, severity, since, until, mac):
+            if skip:
+                skip -= 1
+                continue
+            if len(entries) == page_size:
+                return entries, last_offset
+            entries.append(log_data)
+            last_offset = offset
+
+    return entries, None
+
+
+def encode_merged_cursor(offsets):
+    """
+    Codifica gli offset per sorgente della timeline unificata in una stringa (es. 'app:120,api:0').
+    """
+    return ','.join(f"{source}:{offset}" for source, offset in offsets.items())
+
+
+def decode_merged_cursor(value):
+    """
+    Decodifica un cursore della timeline unificata. Restituisce None se il valore non è valido.
+    """
+    if not value:
+        return None
+    offsets = {}
+    try:
+        for part in value.split(','):
+            source, offset = part.split(':')
+            offsets[source] = int(offset)
+    except ValueError:
+        return None
+    return offsets
+
+
+def _iter_source_entries(source, log_file_path, severity, since, until, mac, end_offset):
+    for offset, log_data in _iter_indexed_entries(log_file_path, severity, since, until, mac, end_offset):
+        yield log_data['timestamp'], source, offset, log_data
+
+
+def query_merged_log_entries(log_files, severity=None, since=None, until=None, mac=None, cursor=None, page=1, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Restituisce una pagina della timeline unificata di più file di log, dalla voce più recente alla più vecchia.
+    Ogni file viene letto a ritroso in modo lazy, usando la cache delle voci recenti e saltando i blocchi
+    dell'indice non compatibili con il filtro come in query_log_entries; le sorgenti vengono poi unite
+    per timestamp (k-way merge), quindi per ogni pagina vengono letti solo i blocchi necessari di ciascun file.
+
+    Args:
+        log_files (dict): Mappa sorgente -> percorso del file di log da includere nella timeline.
+        severity, since, until, mac: Filtri come in query_log_entries.
+        cursor (dict): Offset di fine lettura per ogni sorgente, restituiti dalla pagina precedente.
+        page (int): Numero di pagina (a partire da 1), usato solo in assenza di cursor.
+        page_size (int): Numero di voci per pagina.
+
+    Returns:
+        tuple: (voci, next_cursor) dove ogni voce contiene anche il campo 'source'
+               e next_cursor è None se non ci sono altre voci.
+    """
+    end_offsets = {}
+    if cursor is not None:
+        end_offsets = {source: offset for source, offset in cursor.items() if source in log_files}
+    else:
+        # Fissa la fine di ogni file all'inizio della navigazione, così le pagine successive restano coerenti
+        for source, log_file_path in log_files.items():
+            try:
+                with open(log_file_path, 'rb') as f:
+                    end_offsets[source] = complete_lines_end(f, os.fstat(f.fileno()).st_size)
+            except FileNotFoundError:
+                continue
+
+    skip = 0 if cursor is not None else (max(page, 1) - 1) * page_size
+
+    streams = [
+        _iter_source_entries(source, log_files[source], severity, since, until, mac, end_offset)
+        for source, end_offset in end_offsets.items() if end_offset > 0
+    ]
+    merged = heapq.merge(*streams, key=itemgetter(0), reverse=True)
+
+    entries = []
+    next_offsets = dict(end_offsets)
+
+    for timestamp, source, offset, log_data in merged:
+        if skip:
+            skip -= 1
+        elif len(entries) == page_size:
+            return entries, encode_merged_cursor(next_offsets)
+        else:
+            # Le voci in cache sono condivise tra le richieste: la sorgente viene aggiunta su una copia
+            entries.append(dict(log_data, source=source))
+        next_offsets[source] = offset
+
+    return entries, None
@@ -1,4 +1,5 @@
 from flask import current_app
+import json
 import re
 import os
 
@@ -24,58 +25,202 @@ MESSAGE_DETAIL_REGEX = re.compile(
 )
 
 
-def parse_log_file(log_file_path):
+# Stessa regex di LOG_LINE_REGEX applicata ai bytes, usata dagli indici senza decodificare la riga
+LOG_LINE_BYTES_REGEX = re.compile(LOG_LINE_REGEX.pattern.encode('ascii'))
+
+# Dimensione dei blocchi letti a ritroso dalla fine del file
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Numero massimo di voci restituite di default per una scheda
+DEFAULT_LOG_LIMIT = 50
+
+
+def _iter_lines_reverse(file_obj, end_offset, start_offset=0, block_size=TAIL_BLOCK_SIZE):
+    """
+    Legge le righe di un file binario a ritroso, partendo da end_offset fino a start_offset.
+    start_offset deve coincidere con l'inizio di una riga.
+    Il file viene letto a blocchi di dimensione fissa, quindi il costo dipende solo
+    dalla quantità di righe effettivamente consumate e non dalla dimensione del file.
+
+    Yields:
+        tuple: (offset, riga) dove offset è la posizione in byte dell'inizio della riga
+               e riga è il contenuto in bytes senza il carattere di fine riga.
+    """
+    position = end_offset
+    remainder = b''
+    while position > start_offset:
+        read_size = min(block_size, position - start_offset)
+        position -= read_size
+        file_obj.seek(position)
+        block = file_obj.read(read_size) + remainder
+        lines = block.split(b'\n')
+        # La prima riga del blocco potrebbe essere incompleta: viene completata col blocco precedente
+        remainder = lines[0]
+
+        line_offset = position + len(remainder) + 1
+        offsets = []
+        for line in lines[1:]:
+            offsets.append(line_offset)
+            line_offset += len(line) + 1
+
+        for index in range(len(offsets) - 1, -1, -1):
+            yield offsets[index], lines[index + 1]
+
+    if remainder:
+        yield start_offset, remainder
+
+
+def complete_lines_end(file_obj, size):
+    """
+    Restituisce l'offset successivo all'ultimo carattere di a capo del file,
+    escludendo un'eventuale riga finale ancora in scrittura.
+    """
+    position = size
+    while position > 0:
+        read_size = min(4096, position)
+        position -= read_size
+        file_obj.seek(position)
+        block = file_obj.read(read_size)
+        newline_index = block.rfind(b'\n')
+        if newline_index != -1:
+            return position + newline_index + 1
+    return 0
+
+
+def _parse_json_log_line(line_content):
+    """
+    Analizza una riga scritta dal formatter strutturato JSON, senza espressioni regolari.
+    I campi extra (es. mac, topic, user) vengono mantenuti nella voce restituita.
+    """
+    try:
+        log_data = json.loads(line_content)
+    except ValueError:
+        return None
+    if not isinstance(log_data, dict) or 'timestamp' not in log_data or 'severity' not in log_data:
+        return None
+
+    log_data['severity'] = str(log_data['severity']).lower()
+    log_data['title'] = log_data.get('title') or "Unknown Log"
+    log_data['description'] = log_data.get('description') or ''
+    log_data['file'] = log_data.get('file', '')
+    log_data['line'] = str(log_data.get('line', ''))
+    return log_data
+
+
+def _parse_log_line(line_content):
+    """
+    Analizza una singola riga di log già decodificata.
+    Le righe in formato JSON (LOG_STRUCTURED) vengono riconosciute dal primo carattere
+    e analizzate senza regex; le altre seguono il formato testuale LOG_FORMAT.
+
+    Returns:
+        dict: La voce di log strutturata, oppure None se la riga non rispetta il formato atteso.
+    """
+    if line_content.startswith('{'):
+        return _parse_json_log_line(line_content)
+
+    match = LOG_LINE_REGEX.match(line_content)
+    if not match:
+        return None
+
+    log_data = match.groupdict()
+
+    # Estrae il contenuto del messaggio originale per un'ulteriore analisi
+    message_content = log_data.pop('message_content')
+
+    message_detail_match = MESSAGE_DETAIL_REGEX.match(message_content)
+    if message_detail_match:
+        details = message_detail_match.groupdict()
+        log_data['title'] = details['title'].strip()
+        log_data['description'] = details['description'].strip()
+    else:
+        # Se il formato TITLE/DESC non è presente, usa un titolo generico
+        # e il contenuto completo del messaggio come descrizione
+        log_data['title'] = "Unknown Log"
+        log_data['description'] = message_content
+
+    log_data['severity'] = log_data['severity'].lower()
+    return log_data
+
+
+def read_line_header(raw_line):
+    """
+    Estrae timestamp e severità da una riga di log grezza (bytes), usata per costruire gli indici.
+    Vengono riconosciute solo le righe che iter_log_entries_reverse restituisce come voci: le righe
+    di continuazione di un messaggio su più righe (es. traceback), anche se iniziano con un timestamp,
+    restituiscono None, così i conteggi degli indici coincidono con le voci effettivamente lette.
+
+    Returns:
+        tuple: (timestamp, severità in minuscolo), oppure None se la riga non è una voce valida.
+    """
+    raw_line = raw_line.strip()
+    if raw_line.startswith(b'{'):
+        log_data = _parse_json_log_line(raw_line.decode('utf-8', errors='replace'))
+        if log_data is None:
+            return None
+        return str(log_data['timestamp']), log_data['severity']
+
+    match = LOG_LINE_BYTES_REGEX.match(raw_line)
+    if not match:
+        return None
+    return match.group('timestamp').decode('ascii'), match.group('severity').decode('ascii').lower()
+
+
+def iter_log_entries_reverse(log_file_path, end_offset=None, start_offset=0):
+    """
+    Restituisce le voci di log strutturate dalla più recente alla più vecchia,
+    leggendo il file a ritroso a partire da end_offset (di default la fine del file)
+    fino a start_offset. Le righe con formato non valido vengono saltate.
+
+    Yields:
+        tuple: (offset, voce) dove offset è la posizione in byte della riga nel file.
     """
-    Analizza un file di log e restituisce una lista di voci di log strutturate.
+    with open(log_file_path, 'rb') as f:
+        if end_offset is None:
+            end_offset = os.fstat(f.fileno()).st_size
+
+        for offset, raw_line in _iter_lines_reverse(f, end_offset, start_offset):
+            line_content = raw_line.decode('utf-8', errors='replace').strip()
+            if not line_content:
+                continue
+
+            log_data = _parse_log_line(line_content)
+            if log_data is None:
+                # Registra un debug per le righe che non corrispondono al formato atteso
+                # Queste righe vengono attualmente ignorate per mantenere la coerenza dei dati analizzati
+                current_app.logger.debug(f"TITLE: Salto Analisi Riga di Log | DESC: Saltata l'analisi della riga di log all'offset {offset} in {os.path.basename(log_file_path)} a causa di un formato non valido: {line_content[:150]}")
+                continue
+
+            yield offset, log_data
+
+
+def parse_log_file(log_file_path, limit=DEFAULT_LOG_LIMIT):
+    """
+    Analizza la coda di un file di log e restituisce le voci di log strutturate più recenti.
+    Il file viene letto a ritroso dalla fine e l'analisi si interrompe non appena
+    sono state raccolte `limit` voci valide.
 
     Args:
         log_file_path (str): Il percorso del file di log da analizzare.
+        limit (int): Il numero massimo di voci da restituire.
 
     Returns:
-        list: Una lista di dizionari, dove ogni dizionario rappresenta una voce di log.
+        list: Una lista di dizionari, dal più recente al più vecchio, dove ogni dizionario rappresenta una voce di log.
               Restituisce una lista vuota se il file non esiste o si verifica un errore.
     """
-    parsed_logs = []
     if not os.path.exists(log_file_path):
         current_app.logger.warning(f"TITLE: File di Log Non Trovato | DESC: Il file di log specificato per la visualizzazione non esiste: {log_file_path}")
         return []
-    
+
+    parsed_logs = []
     try:
-        with open(log_file_path, 'r', encoding='utf-8') as f:
-            for line_number, line_content in enumerate(f, 1):
-                line_content = line_content.strip()
-                if not line_content:
-                    continue
-                
-                match = LOG_LINE_REGEX.match(line_content)
-                if match:
-                    log_data = match.groupdict()
-                    
-                    # Estrae il contenuto del messaggio originale per un'ulteriore analisi
-                    message_content = log_data.pop('message_content') 
-                    
-                    message_detail_match = MESSAGE_DETAIL_REGEX.match(message_content)
-                    if message_detail_match:
-                        details = message_detail_match.groupdict()
-                        log_data['title'] = details['title'].strip()
-                        log_data['description'] = details['description'].strip()
-                    else:
-                        # Se il formato TITLE/DESC non è presente, usa un titolo generico
-                        # e il contenuto completo del messaggio come descrizione
-                        log_data['title'] = "Unknown Log" 
-                        log_data['description'] = message_content
-                    
-                    log_data['severity'] = log_data['severity'].lower()
-                    parsed_logs.append(log_data)
-                else:
-                    # Registra un debug per le righe che non corrispondono al formato atteso
-                    # Queste righe vengono attualmente ignorate per mantenere la coerenza dei dati analizzati
-                    current_app.logger.debug(f"TITLE: Salto Analisi Riga di Log | DESC: Saltata l'analisi della riga di log {line_number} in {os.path.basename(log_file_path)} a causa di un formato non valido: {line_content[:150]}")
-                    pass
+        for _, log_data in iter_log_entries_reverse(log_file_path):
+            parsed_logs.append(log_data)
+            if len(parsed_logs) >= limit:
+                break
     except Exception as e:
         # Registra un errore se si verifica un problema durante la lettura o l'analisi del file
         current_app.logger.error(f"TITLE: Errore Lettura File di Log | DESC: Errore durante la lettura o l'analisi del file di log {log_file_path}. Errore: {str(e)}")
         return [] # Restituisci una lista vuota in caso di errore
-    
-    parsed_logs.reverse() # Inverte la lista per mostrare i log più recenti per primi
-    return parsed_logs[:50] # Restituisce al massimo le prime 50 voci di log più recenti
\ No newline at end of file
+
+    return parsed_logs
@@ -0,0 +1,237 @@
+import os
+import sqlite3
+import threading
+from services.log_reader_service import LOG_FILES_CONFIG, _parse_log_line
+
+"""
+Indice di ricerca full-text (SQLite FTS5) su titolo e descrizione delle voci di log.
+L'indice viene alimentato in modo incrementale: per ogni file (identificato dal suo inode,
+così da seguirlo anche dopo la rotazione) viene memorizzato l'offset fino a cui è stato letto
+e ad ogni sincronizzazione vengono analizzate solo le righe aggiunte.
+"""
+
+# Nome del database di ricerca, salvato nella cartella dei log
+SEARCH_DB_FILENAME = 'search.db'
+
+# Numero di righe inserite per singolo lotto durante l'indicizzazione
+INDEX_BATCH_SIZE = 5000
+
+# Intervallo (in secondi) della sincronizzazione periodica in background (0 per disabilitarla)
+SEARCH_SYNC_INTERVAL = int(os.getenv('LOG_SEARCH_SYNC_INTERVAL', 30))
+
+# Byte massimi indicizzati durante una ricerca per includere le righe più recenti (0 per disabilitare):
+# il resto dell'indicizzazione è svolto dal thread in background, così la ricerca resta nell'ordine dei millisecondi
+SEARCH_CATCHUP_BYTES = int(os.getenv('LOG_SEARCH_CATCHUP_BYTES', 64 * 1024))
+
+# Estensioni dei file ausiliari presenti nella cartella dei log, da non indicizzare
+_IGNORED_SUFFIXES = ('.idx', '.tmp')
+
+_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS log_entries USING fts5("
+    "title, description, source UNINDEXED, severity UNINDEXED, timestamp UNINDEXED, "
+    "file UNINDEXED, line UNINDEXED, inode UNINDEXED)",
+    "CREATE TABLE IF NOT EXISTS indexed_files ("
+    "inode INTEGER PRIMARY KEY, path TEXT NOT NULL, source TEXT NOT NULL, offset INTEGER NOT NULL)",
+)
+
+
+def _connect(log_dir, timeout=30):
+    connection = sqlite3.connect(os.path.join(log_dir, SEARCH_DB_FILENAME), timeout=timeout, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    for statement in _SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def _list_log_files(log_dir):
+    """
+    Restituisce i file di log correnti e ruotati (es. 'api.log.2025-01-01') con la relativa sorgente.
+    """
+    files = []
+    try:
+        names = os.listdir(log_dir)
+    except FileNotFoundError:
+        return files
+
+    for source, base_name in LOG_FILES_CONFIG.items():
+        for name in names:
+            if name != base_name and not name.startswith(f"{base_name}."):
+                continue
+            if name.endswith(_IGNORED_SUFFIXES):
+                continue
+            files.append((source, os.path.join(log_dir, name)))
+    return files
+
+
+def _index_file(connection, source, path, inode, offset, max_bytes=None):
+    """
+    Indicizza le righe complete del file a partire da offset e restituisce il nuovo offset.
+    Le righe vengono inserite a lotti per limitare la memoria usata sui file di grandi dimensioni.
+    Con max_bytes la lettura si ferma alla prima riga oltre il limite e riprende da lì alla sincronizzazione successiva.
+    """
+    rows = []
+    end_offset = offset + max_bytes if max_bytes is not None else None
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b'\n'):
+                # Riga ancora in scrittura: verrà indicizzata alla prossima sincronizzazione
+                break
+            if end_offset is not None and offset >= end_offset:
+                break
+            offset += len(raw_line)
+
+            line_content = raw_line.decode('utf-8', errors='replace').strip()
+            log_data = _parse_log_line(line_content) if line_content else None
+            if log_data is not None:
+                rows.append((log_data['title'], log_data['description'], source, log_data['severity'],
+                             log_data['timestamp'], log_data['file'], log_data['line'], inode))
+
+            if len(rows) >= INDEX_BATCH_SIZE:
+                _insert_rows(connection, rows)
+                rows = []
+
+    _insert_rows(connection, rows)
+    connection.execute("UPDATE indexed_files SET offset = ? WHERE inode = ?", (offset, inode))
+    return offset
+
+
+def _insert_rows(connection, rows):
+    if rows:
+        connection.executemany(
+            "INSERT INTO log_entries (title, description, source, severity, timestamp, file, line, inode) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def sync_search_index(log_dir, timeout=30, max_bytes=None):
+    """
+    Aggiorna l'indice di ricerca con le righe aggiunte ai file di log (anche ruotati).
+    Le voci dei file non più presenti su disco vengono rimosse.
+    La sincronizzazione è serializzata tra processi tramite una transazione IMMEDIATE:
+    se un altro processo la sta già eseguendo, dopo `timeout` secondi viene sollevato sqlite3.OperationalError.
+    Con max_bytes vengono indicizzati al più max_bytes byte in totale (le righe restanti alla sincronizzazione successiva).
+
+    Returns:
+        int: Numero di file letti durante la sincronizzazione.
+    """
+    connection = _connect(log_dir, timeout)
+    files_read = 0
+    remaining_bytes = max_bytes
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        known = {inode: (path, offset) for inode, path, offset in connection.execute("SELECT inode, path, offset FROM indexed_files")}
+        seen = set()
+
+        for source, path in _list_log_files(log_dir):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            inode = stat.st_ino
+            seen.add(inode)
+
+            known_path, offset = known.get(inode, (None, 0))
+            if known_path is None:
+                connection.execute("INSERT INTO indexed_files (inode, path, source, offset) VALUES (?, ?, ?, 0)", (inode, path, source))
+            elif known_path != path:
+                # File ruotato: stesso contenuto, nuovo nome
+                connection.execute("UPDATE indexed_files SET path = ? WHERE inode = ?", (path, inode))
+
+            if stat.st_size < offset:
+                # File troncato: le voci indicizzate non sono più valide
+                connection.execute("DELETE FROM log_entries WHERE inode = ?", (inode,))
+                offset = 0
+
+            if stat.st_size > offset and remaining_bytes != 0:
+                new_offset = _index_file(connection, source, path, inode, offset, remaining_bytes)
+                if remaining_bytes is not None:
+                    remaining_bytes = max(remaining_bytes - (new_offset - offset), 0)
+                files_read += 1
+
+        for inode in set(known) - seen:
+            # File eliminato (es. backup oltre backupCount): rimuove le sue voci
+            connection.execute("DELETE FROM log_entries WHERE inode = ?", (inode,))
+            connection.execute("DELETE FROM indexed_files WHERE inode = ?", (inode,))
+
+        connection.execute('COMMIT')
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+    return files_read
+
+
+def _build_match_query(query):
+    """
+    Converte il testo inserito dall'utente in un'espressione FTS5: ogni termine diventa una frase
+    tra virgolette (così un MAC come 'AA:BB:CC' viene cercato come sequenza di token) e tutti
+    i termini devono essere presenti.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+def search_logs(log_dir, query, sources=None, page=1, page_size=50):
+    """
+    Cerca nelle voci di log indicizzate, ordinando i risultati per rilevanza (BM25, con peso
+    maggiore sul titolo) e poi dal più recente.
+
+    Args:
+        log_dir (str): La cartella dei log.
+        query (str): Il testo da cercare.
+        sources (list): Le sorgenti in cui cercare (chiavi di LOG_FILES_CONFIG), o None per tutte.
+        page (int): Numero di pagina (a partire da 1).
+        page_size (int): Numero di risultati per pagina.
+
+    Returns:
+        tuple: (risultati, has_more) dove ogni risultato ha gli stessi campi di una voce di log più 'source'.
+    """
+    match_query = _build_match_query(query)
+    if not match_query:
+        return [], False
+
+    sql = ("SELECT title, description, source, severity, timestamp, file, line FROM log_entries "
+           "WHERE log_entries MATCH ?")
+    params = [match_query]
+    if sources:
+        sql += f" AND source IN ({', '.join('?' for _ in sources)})"
+        params.extend(sources)
+    sql += " ORDER BY bm25(log_entries, 2.0, 1.0), timestamp DESC LIMIT ? OFFSET ?"
+    params.extend([page_size + 1, (max(page, 1) - 1) * page_size])
+
+    connection = _connect(log_dir)
+    try:
+        rows = connection.execute(sql, params).fetchall()
+    finally:
+        connection.close()
+
+    columns = ('title', 'description', 'source', 'severity', 'timestamp', 'file', 'line')
+    results = [dict(zip(columns, row)) for row in rows[:page_size]]
+    return results, len(rows) > page_size
+
+
+def start_search_indexer(app, log_dir):
+    """
+    Avvia un thread in background che sincronizza periodicamente l'indice di ricerca.
+    La prima sincronizzazione avviene subito all'avvio, così le ricerche non devono indicizzare i file esistenti.
+    """
+    if SEARCH_SYNC_INTERVAL <= 0:
+        return None
+
+    stop_event = threading.Event()
+
+    def run():
+        while True:
+            try:
+                sync_search_index(log_dir)
+            except Exception as e:
+                app.logger.error(f"TITLE: Log Search Index Error | DESC: Failed to synchronize the log search index. Error: {str(e)}")
+            if stop_event.wait(SEARCH_SYNC_INTERVAL):
+                return
+
+    thread = threading.Thread(target=run, name='log-search-indexer', daemon=True)
+    thread.start()
+    return stop_event
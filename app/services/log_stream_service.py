@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+import time
+from services.log_reader_service import _parse_log_line
+
+"""
+Inseguimento in tempo reale dei file di log (come `tail -F`) per lo streaming verso il browser.
+Per ogni file esiste un solo thread di lettura, condiviso da tutti i client collegati:
+le nuove voci analizzate vengono distribuite alle code dei singoli sottoscrittori.
+"""
+
+# Intervallo (in secondi) tra due controlli del file
+POLL_INTERVAL = 0.5
+
+# Numero massimo di voci in attesa per ogni client; oltre questo limite le voci vengono scartate
+SUBSCRIBER_QUEUE_SIZE = 500
+
+
+class LogFollower:
+    """
+    Segue un singolo file di log e inoltra le nuove voci ai sottoscrittori.
+    Sopravvive alla rotazione del file (TimedRotatingFileHandler): quando l'inode cambia,
+    termina la lettura del vecchio file e riparte dall'inizio di quello nuovo.
+    """
+
+    def __init__(self, log_file_path):
+        self.log_file_path = str(log_file_path)
+        self.subscribers = set()
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._file = None
+        self._inode = None
+        self._buffer = b''
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self.subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"log-follower-{os.path.basename(self.log_file_path)}", daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _broadcast(self, log_data):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(log_data)
+            except queue.Full:
+                # Client troppo lento: la voce viene scartata per non bloccare gli altri
+                self.dropped += 1
+
+    def _open(self, from_end):
+        try:
+            self._file = open(self.log_file_path, 'rb')
+        except FileNotFoundError:
+            self._file = None
+            self._inode = None
+            return
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._buffer = b''
+        if from_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._inode = None
+        self._buffer = b''
+
+    def _read_new_lines(self):
+        """
+        Legge i byte aggiunti al file aperto e inoltra le righe complete.
+        """
+        data = self._file.read()
+        if not data:
+            return
+        lines = (self._buffer + data).split(b'\n')
+        # L'ultimo elemento è una riga ancora incompleta (o vuoto)
+        self._buffer = lines.pop()
+        for raw_line in lines:
+            line_content = raw_line.decode('utf-8', errors='replace').strip()
+            if not line_content:
+                continue
+            log_data = _parse_log_line(line_content)
+            if log_data is not None:
+                self._broadcast(log_data)
+
+    def _run(self):
+        self._open(from_end=True)
+        while True:
+            with self._lock:
+                if not self.subscribers:
+                    self._thread = None
+                    self._close()
+                    return
+
+            try:
+                if self._file is None:
+                    # Il file non esisteva (o era in fase di rotazione): lo legge dall'inizio
+                    self._open(from_end=False)
+
+                if self._file is not None:
+                    self._read_new_lines()
+                    try:
+                        stat = os.stat(self.log_file_path)
+                    except FileNotFoundError:
+                        stat = None
+
+                    if stat is None or stat.st_ino != self._inode:
+                        # Rotazione: termina la lettura del vecchio file e passa a quello nuovo
+                        self._read_new_lines()
+                        self._close()
+                        self._open(from_end=False)
+                        if self._file is not None:
+                            self._read_new_lines()
+                    elif stat.st_size < self._file.tell():
+                        # Troncamento: riparte dall'inizio del file
+                        self._file.seek(0)
+                        self._buffer = b''
+            except OSError:
+                self._close()
+
+            time.sleep(POLL_INTERVAL)
+
+
+_followers = {}
+_followers_lock = threading.Lock()
+
+
+def get_follower(log_file_path):
+    """
+    Restituisce il LogFollower condiviso per il file indicato, creandolo se necessario.
+    """
+    key = str(log_file_path)
+    with _followers_lock:
+        follower = _followers.get(key)
+        if follower is None:
+            follower = LogFollower(key)
+            _followers[key] = follower
+        return follower
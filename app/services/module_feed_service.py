@@ -0,0 +1,121 @@
+import json
+import queue
+import threading
+import time
+
+"""
+Distribuzione in tempo reale dei cambi di stato dei moduli alla dashboard (Server-Sent Events).
+Il registro dei moduli notifica ogni modifica; il feed confronta solo i campi mostrati nelle schede
+e unisce le variazioni dello stesso modulo. Un unico thread per processo, attivo solo mentre ci sono
+client collegati, serializza a intervalli regolari un solo messaggio con tutte le variazioni e lo
+consegna alle code dei client: il costo non dipende dal numero di dashboard aperte.
+"""
+
+# Intervallo (in secondi) tra due invii delle variazioni accumulate
+FEED_INTERVAL = 0.5
+
+# Numero massimo di messaggi in attesa per ogni client; oltre questo limite vengono scartati
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def _view(state):
+    """
+    Campi di un modulo mostrati nella sua scheda (last_seen solo se offline, come nel template).
+    """
+    last_seen = None
+    if not state.online:
+        last_seen = state.last_seen.strftime('%Y-%m-%d %H:%M') if state.last_seen else 'Never'
+    return {
+        'online': state.online,
+        'number': state.number,
+        'color': state.color,
+        'place': state.place,
+        'last_seen': last_seen,
+    }
+
+
+class ModuleFeed:
+    """
+    Raccoglie le variazioni dei moduli tramite notify() e le distribuisce ai sottoscrittori.
+    `counts` è una funzione che restituisce i conteggi per tipo, inviati insieme alle variazioni.
+    """
+
+    def __init__(self, counts=None, interval=FEED_INTERVAL):
+        self.counts = counts
+        self.interval = interval
+        self.subscribers = set()
+        self._views = {}    # id -> ultimi campi visti
+        self._pending = {}  # id -> campi cambiati dall'ultimo invio (None se il modulo è stato eliminato)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.messages = 0
+        self.dropped = 0
+
+    def notify(self, module_id, state):
+        """
+        Registra il nuovo stato di un modulo (None se eliminato). Viene chiamata dal registro
+        sotto il proprio lock, quindi non esegue altro che il confronto con lo stato precedente.
+        """
+        with self._lock:
+            if state is None:
+                if self._views.pop(module_id, None) is not None and self.subscribers:
+                    self._pending[module_id] = None
+                return
+
+            view = _view(state)
+            previous = self._views.get(module_id)
+            self._views[module_id] = view
+            if not self.subscribers or previous == view:
+                return
+            changes = {field: value for field, value in view.items() if previous is None or previous[field] != value}
+            pending = self._pending.get(module_id)
+            self._pending[module_id] = dict(pending, **changes) if pending else changes
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self.subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='module-feed', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'pending': len(self._pending),
+                'messages': self.messages,
+                'dropped': self.dropped,
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.subscribers:
+                    self._pending = {}
+                    self._thread = None
+                    return
+                pending, self._pending = self._pending, {}
+                subscribers = list(self.subscribers)
+
+            if not pending:
+                continue
+
+            # Un solo messaggio serializzato, condiviso da tutti i client
+            message = json.dumps({
+                'modules': pending,
+                'counts': self.counts() if self.counts else None,
+            })
+            self.messages += 1
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Client troppo lento: il messaggio viene scartato per non bloccare gli altri
+                    self.dropped += 1
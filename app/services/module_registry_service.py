@@ -0,0 +1,432 @@
+from collections import namedtuple
+import bisect
+from sqlalchemy.exc import IntegrityError
+from models.conn import db
+from models.model import Module, ModuleTombstone, RegistryVersion
+import logging
+import threading
+import time
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Registro in memoria dello stato dei moduli, indicizzato per MAC e per id.
+Viene caricato all'avvio con Module.get_all() e mantenuto coerente da tutte le scritture
+(che passano da questo registro). Le modifiche fatte dagli altri processi gunicorn vengono
+rilevate confrontando periodicamente il contatore di versione (RegistryVersion).
+Nei processi che non ricevono i messaggi MQTT (MQTT_ROLE=web) anche i cambi di presenza scritti
+dal processo di ingestione vengono applicati, leggendo solo i moduli con revisione più recente.
+"""
+
+# Campi del modulo copiati nello stato in memoria
+MODULE_FIELDS = ('id', 'mac', 'type', 'number', 'last_seen', 'last_update', 'animation', 'color', 'place', 'on', 'online', 'revision')
+
+# Stato immutabile di un modulo, staccato dalla sessione SQLAlchemy e quindi condivisibile tra thread
+ModuleState = namedtuple('ModuleState', MODULE_FIELDS)
+
+
+def _snapshot(module):
+    return ModuleState(*(getattr(module, field) for field in MODULE_FIELDS))
+
+
+class ModuleRegistry:
+    """
+    Registro dei moduli del processo.
+    Le letture dei moduli noti non eseguono query; i moduli sconosciuti vengono cercati sul database
+    e aggiunti al registro.
+    """
+
+    def __init__(self, app, pending_lookup=None, sync_interval=1.0, follow_fleet=False, on_change=None):
+        self.app = app
+        # Funzione che restituisce i campi di presenza non ancora scritti sul database per un MAC
+        self.pending_lookup = pending_lookup
+        # Funzione chiamata (sotto il lock del registro) con id e nuovo stato di ogni modulo modificato
+        # (None se eliminato)
+        self.on_change = on_change
+        self.sync_interval = sync_interval
+        # Applica anche le modifiche che incrementano solo la revisione della flotta (presenza)
+        self.follow_fleet = follow_fleet
+        self._fleet_revision = 0
+        self._by_mac = {}
+        self._by_id = {}
+        self._sorted_ids = []       # Id ordinati
+        self._ids_by_type = {}      # tipo -> id ordinati dei moduli di quel tipo, per la paginazione keyset
+        self._counts = {}           # tipo -> {'total': n, 'online': n}, aggiornati ad ogni modifica
+        self._version = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def start(self):
+        """
+        Carica il registro e avvia il controllo periodico della versione (se sync_interval > 0).
+        """
+        self.reload()
+        if self.sync_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='module-registry-sync', daemon=True)
+            self._thread.start()
+
+    def reload(self):
+        """
+        Ricarica dal database lo stato di tutti i moduli.
+        """
+        with self.app.app_context():
+            version = RegistryVersion.get_current()
+            fleet_revision = RegistryVersion.get_current(RegistryVersion.FLEET)
+            states = [_snapshot(module) for module in Module.get_all()]
+
+        with self._lock:
+            previous_ids = self._by_id.keys()
+            self._by_mac = {}
+            self._by_id = {}
+            self._sorted_ids = []
+            self._ids_by_type = {}
+            self._counts = {}
+            for state in states:
+                # I valori di presenza ancora in attesa di scrittura sono più recenti di quelli letti
+                self._put_locked(self._overlay(state))
+            if self.on_change:
+                # Moduli eliminati da un altro processo
+                for module_id in previous_ids - self._by_id.keys():
+                    self.on_change(module_id, None)
+            self._version = version
+            self._fleet_revision = fleet_revision
+            self.reloads += 1
+
+    def get_by_mac(self, mac):
+        """
+        Restituisce lo stato del modulo con il MAC indicato, o None se non esiste.
+        Deve essere chiamata all'interno di un app context (usato solo per i moduli non ancora noti).
+        """
+        with self._lock:
+            state = self._by_mac.get(mac)
+            if state is not None:
+                self.hits += 1
+                return state
+            self.misses += 1
+
+        module = Module.get_from_mac(mac)
+        return self._store(_snapshot(module)) if module else None
+
+    def get_by_id(self, module_id):
+        """
+        Restituisce lo stato del modulo con l'id indicato, o None se non esiste.
+        """
+        with self._lock:
+            state = self._by_id.get(module_id)
+            if state is not None:
+                self.hits += 1
+                return state
+            self.misses += 1
+
+        module = Module.get_one(module_id)
+        return self._store(_snapshot(module)) if module else None
+
+    def lookup_id(self, mac):
+        """
+        Restituisce l'id del modulo con il MAC indicato leggendo solo la memoria (nessuna query,
+        utilizzabile anche fuori da un app context), o None se il modulo non è caricato.
+        """
+        with self._lock:
+            state = self._by_mac.get(mac)
+        return state.id if state is not None else None
+
+    def get_all(self):
+        with self._lock:
+            return [self._by_id[module_id] for module_id in self._sorted_ids]
+
+    def count_by_type(self, module_type):
+        with self._lock:
+            return self._counts.get(module_type, {}).get('total', 0)
+
+    def counts(self, module_types=('numeric', 'arrow')):
+        """
+        Restituisce il numero di moduli totali e online per tipo, mantenuto aggiornato
+        ad ogni modifica (senza scorrere l'elenco dei moduli).
+        """
+        with self._lock:
+            return {module_type: dict(self._counts.get(module_type, {'total': 0, 'online': 0})) for module_type in module_types}
+
+    def page(self, module_type, after_id=0, limit=24):
+        """
+        Paginazione keyset dei moduli di un tipo, in ordine di id.
+
+        Returns:
+            tuple: (moduli, next_after) dove next_after è l'id da passare per la pagina successiva,
+                   o None se non ci sono altre pagine.
+        """
+        with self._lock:
+            ids = self._ids_by_type.get(module_type, [])
+            start = bisect.bisect_right(ids, after_id)
+            # Un id in più per sapere se esiste una pagina successiva
+            page_ids = ids[start:start + limit + 1]
+            states = [self._by_id[module_id] for module_id in page_ids[:limit]]
+        next_after = states[-1].id if len(page_ids) > limit else None
+        return states, next_after
+
+    def select(self, module_type=None, place=None, module_ids=None):
+        """
+        Restituisce i moduli che soddisfano tutti i filtri indicati (tipo, luogo, lista di id).
+        """
+        module_ids = set(module_ids) if module_ids else None
+        return [state for state in self.get_all()
+                if (module_type is None or state.type == module_type)
+                and (place is None or state.place == place)
+                and (module_ids is None or state.id in module_ids)]
+
+    def get_places(self):
+        with self._lock:
+            return sorted({state.place for state in self._by_id.values() if state.place})
+
+    def create_module(self, **fields):
+        """
+        Inserisce un nuovo modulo e lo aggiunge al registro.
+
+        Returns:
+            ModuleState: Lo stato del modulo creato, o None se un altro processo ha già creato
+                         un modulo con lo stesso MAC.
+        """
+        module = Module(**fields)
+        db.session.add(module)
+        try:
+            module.revision = RegistryVersion.bump(RegistryVersion.FLEET)
+            db.session.flush()
+            # L'id potrebbe essere stato riusato dopo un'eliminazione
+            db.session.execute(db.delete(ModuleTombstone).where(ModuleTombstone.id == module.id))
+            state = _snapshot(module)
+            version = RegistryVersion.bump()
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+
+        self._advance_version(version)
+        return self._store(state)
+
+    def update_module(self, module_id, **fields):
+        """
+        Aggiorna i campi di un modulo con un singolo UPDATE, senza caricarlo dal database.
+
+        Returns:
+            ModuleState: Il nuovo stato del modulo, o None se il modulo non esiste.
+        """
+        fields['revision'] = RegistryVersion.bump(RegistryVersion.FLEET)
+        result = db.session.execute(db.update(Module).where(Module.id == module_id).values(**fields))
+        if result.rowcount == 0:
+            db.session.rollback()
+            self._remove(module_id)
+            return None
+        version = RegistryVersion.bump()
+        db.session.commit()
+
+        self._advance_version(version)
+        with self._lock:
+            state = self._by_id.get(module_id)
+        if state is None:
+            return self.get_by_id(module_id)
+        return self._store(state._replace(**fields))
+
+    def update_modules(self, module_ids, **fields):
+        """
+        Applica gli stessi campi a più moduli con un singolo UPDATE, in una sola transazione.
+
+        Returns:
+            list: I nuovi stati dei moduli aggiornati (quelli eliminati nel frattempo vengono ignorati).
+        """
+        if not module_ids:
+            return []
+
+        fields['revision'] = RegistryVersion.bump(RegistryVersion.FLEET)
+        db.session.execute(db.update(Module).where(Module.id.in_(module_ids)).values(**fields))
+        version = RegistryVersion.bump()
+        db.session.commit()
+
+        self._advance_version(version)
+        states = []
+        for module_id in module_ids:
+            state = self.get_by_id(module_id)
+            if state is not None:
+                states.append(self._store(state._replace(**fields)))
+        return states
+
+    def delete_module(self, module_id):
+        """
+        Elimina un modulo con un singolo DELETE e lo rimuove dal registro.
+
+        Returns:
+            bool: True se il modulo è stato eliminato.
+        """
+        state = self.get_by_id(module_id)
+        if state is None:
+            return False
+
+        result = db.session.execute(db.delete(Module).where(Module.id == module_id))
+        if result.rowcount:
+            # Il change feed segnala la rimozione tramite la tomba del modulo
+            db.session.merge(ModuleTombstone(id=module_id, mac=state.mac, revision=RegistryVersion.bump(RegistryVersion.FLEET)))
+        version = RegistryVersion.bump()
+        db.session.commit()
+
+        self._advance_version(version)
+        self._remove(module_id)
+        return result.rowcount > 0
+
+    def claim_presence(self, mac, event_time, session=None, dedup_window=None, **fields):
+        """
+        Applica un evento di presenza con un UPDATE condizionale immediato, così che più nodi
+        di ingestione possano ricevere i messaggi dello stesso modulo (sottoscrizioni condivise).
+
+        Se il messaggio riporta la sessione del dispositivo (contatore persistente incrementato ad
+        ogni connessione, uguale nel new_connection e nel last will della stessa connessione) gli
+        eventi vengono ordinati con quella: una connessione viene applicata solo se di una sessione
+        più recente dell'ultima applicata, un last will solo se della sessione corrente (e con il
+        modulo ancora online) o di una più recente. Le riconsegne e i messaggi in ritardo vengono
+        quindi scartati qualunque sia l'ordine di arrivo ai nodi.
+
+        Senza sessione gli eventi vengono ordinati con event_time, l'istante di ricezione sul nodo:
+        l'evento viene scartato se ne è già stato applicato uno più recente; con dedup_window (per
+        new_connection) anche se il modulo è già online per un evento di meno di dedup_window prima,
+        cioè lo stesso messaggio riconsegnato a un altro nodo. Questo ordinamento non è affidabile:
+        un messaggio riconsegnato riceve sempre un istante più recente, quindi un last will
+        riconsegnato dopo la riconnessione del modulo lo segna offline (fino al prossimo heartbeat
+        o alla prossima connessione), e gli orologi dei nodi possono non essere allineati.
+
+        Returns:
+            ModuleState: Il nuovo stato del modulo, o None se l'evento è stato scartato.
+        """
+        if session is not None:
+            newer_session = db.or_(Module.presence_session.is_(None), Module.presence_session < session)
+            if fields.get('online'):
+                condition = newer_session
+            else:
+                condition = db.or_(newer_session, db.and_(Module.presence_session == session, Module.online.is_(True)))
+        elif dedup_window is None:
+            condition = db.or_(Module.presence_at.is_(None), Module.presence_at <= event_time)
+        else:
+            condition = db.or_(Module.presence_at.is_(None), db.and_(
+                Module.presence_at < event_time,
+                db.or_(Module.online.is_(False), Module.presence_at < event_time - dedup_window)))
+
+        fields['revision'] = RegistryVersion.bump(RegistryVersion.FLEET)
+        values = dict(fields, presence_at=event_time)
+        if session is not None:
+            values['presence_session'] = session
+        result = db.session.execute(db.update(Module).where(Module.mac == mac, condition).values(**values))
+        if result.rowcount == 0:
+            db.session.rollback()
+            return None
+        db.session.commit()
+        return self.update_presence(mac, **fields)
+
+    def update_presence(self, mac, **fields):
+        """
+        Aggiorna in memoria i campi di presenza di un modulo noto (la scrittura sul database
+        è delegata al buffer di presenza).
+
+        Returns:
+            ModuleState: Il nuovo stato del modulo, o None se il modulo non è nel registro.
+        """
+        with self._lock:
+            state = self._by_mac.get(mac)
+            if state is None:
+                return None
+            state = state._replace(**fields)
+            self._put_locked(state)
+            return state
+
+    def stats(self):
+        with self._lock:
+            return {
+                'modules': len(self._by_id),
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'fleet_revision': self._fleet_revision if self.follow_fleet else None,
+            }
+
+    def _overlay(self, state):
+        fields = self.pending_lookup(state.mac) if self.pending_lookup else None
+        return state._replace(**fields) if fields else state
+
+    def _store(self, state):
+        with self._lock:
+            state = self._overlay(state)
+            self._put_locked(state)
+            return state
+
+    def _remove(self, module_id):
+        with self._lock:
+            state = self._by_id.pop(module_id, None)
+            if state is not None:
+                self._by_mac.pop(state.mac, None)
+                del self._sorted_ids[bisect.bisect_left(self._sorted_ids, module_id)]
+                self._remove_type_id_locked(state)
+                self._count_locked(state, -1)
+                if self.on_change:
+                    self.on_change(module_id, None)
+
+    def _put_locked(self, state):
+        previous = self._by_id.get(state.id)
+        if previous is None:
+            bisect.insort(self._sorted_ids, state.id)
+            bisect.insort(self._ids_by_type.setdefault(state.type, []), state.id)
+        else:
+            self._count_locked(previous, -1)
+            if previous.mac != state.mac:
+                self._by_mac.pop(previous.mac, None)
+            if previous.type != state.type:
+                self._remove_type_id_locked(previous)
+                bisect.insort(self._ids_by_type.setdefault(state.type, []), state.id)
+        self._by_mac[state.mac] = state
+        self._by_id[state.id] = state
+        self._count_locked(state, 1)
+        if self.on_change:
+            self.on_change(state.id, state)
+
+    def _remove_type_id_locked(self, state):
+        ids = self._ids_by_type[state.type]
+        del ids[bisect.bisect_left(ids, state.id)]
+
+    def _count_locked(self, state, delta):
+        counts = self._counts.setdefault(state.type, {'total': 0, 'online': 0})
+        counts['total'] += delta
+        if state.online:
+            counts['online'] += delta
+
+    def _advance_version(self, version):
+        """
+        Dopo una scrittura locale: se nessun altro processo ha modificato i moduli nel frattempo,
+        il registro è già aggiornato e non serve ricaricarlo.
+        """
+        with self._lock:
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def _apply_fleet_changes(self, fleet_revision):
+        """
+        Applica i moduli modificati dopo l'ultima revisione della flotta già vista.
+        """
+        with self.app.app_context():
+            states = [_snapshot(module) for module in Module.get_changed_since(self._fleet_revision)]
+
+        with self._lock:
+            for state in states:
+                self._put_locked(self._overlay(state))
+            self._fleet_revision = max([self._fleet_revision, fleet_revision] + [state.revision or 0 for state in states])
+
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                with self.app.app_context():
+                    version = RegistryVersion.get_current()
+                    fleet_revision = RegistryVersion.get_current(RegistryVersion.FLEET) if self.follow_fleet else None
+                if version != self._version:
+                    self.reload()
+                elif fleet_revision is not None and fleet_revision != self._fleet_revision:
+                    self._apply_fleet_changes(fleet_revision)
+            except Exception as e:
+                microcontrollers_logger.error("TITLE: Module Registry Sync Error | DESC: Failed to synchronize the module registry. Error: %s", e)
@@ -0,0 +1,130 @@
+from collections import deque
+import logging
+import queue
+import threading
+import time
+import zlib
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Pool di worker per l'elaborazione dei messaggi MQTT in ingresso.
+Il thread di rete di paho si limita ad accodare i messaggi; i worker li elaborano in parallelo.
+Ogni MAC viene sempre assegnato allo stesso worker, così i messaggi di uno stesso dispositivo
+vengono elaborati nell'ordine di arrivo.
+"""
+
+# Numero di campioni di latenza mantenuti per il calcolo dei percentili
+LATENCY_SAMPLES = 1024
+
+
+class IngestWorkerPool:
+    """
+    Pool di worker con una coda limitata per worker.
+    Quando la coda di un worker è piena, submit() blocca il chiamante (il thread di rete) finché
+    non si libera un posto: paho smette di leggere dal socket e il broker rallenta l'invio,
+    senza perdere messaggi già accettati. Un'attesa più lunga di enqueue_timeout secondi
+    viene segnalata nei log e conteggiata.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=1000, enqueue_timeout=5.0):
+        self.handler = handler
+        self.enqueue_timeout = enqueue_timeout
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._queue_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._processing_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.stalled = 0
+
+    def start(self):
+        for index, work_queue in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(work_queue,), name=f"mqtt-ingest-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Attende l'elaborazione dei messaggi già accodati e arresta i worker.
+        """
+        for work_queue in self._queues:
+            work_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, key, *args):
+        """
+        Accoda un messaggio sul worker associato a key (il MAC del dispositivo), attendendo
+        senza limite un posto libero se la coda è piena.
+        """
+        work_queue = self._queues[zlib.crc32(str(key).encode()) % len(self._queues)]
+        item = (time.monotonic(), args)
+        try:
+            work_queue.put(item, timeout=self.enqueue_timeout or None)
+        except queue.Full:
+            with self._lock:
+                self.stalled += 1
+            microcontrollers_logger.warning("TITLE: MQTT Ingest Queue Full | DESC: Worker queue full for more than %ss, MQTT network loop paused until a slot frees up (key '%s').", self.enqueue_timeout, key, extra={'mac': key})
+            work_queue.put(item)
+
+        with self._lock:
+            self.submitted += 1
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+
+            enqueued_at, args = item
+            started_at = time.monotonic()
+            try:
+                self.handler(*args)
+                failed = False
+            except Exception as e:
+                failed = True
+                microcontrollers_logger.error("TITLE: MQTT Ingest Worker Error | DESC: Unhandled error while processing MQTT message. Error: %s", e)
+            finished_at = time.monotonic()
+
+            with self._lock:
+                self.processed += 1
+                if failed:
+                    self.failed += 1
+                self._queue_latencies.append(started_at - enqueued_at)
+                self._processing_latencies.append(finished_at - started_at)
+
+    def stats(self):
+        """
+        Restituisce le metriche del pool: profondità delle code, contatori e latenze (in millisecondi).
+        """
+        with self._lock:
+            queue_latencies = sorted(self._queue_latencies)
+            processing_latencies = sorted(self._processing_latencies)
+            return {
+                'workers': len(self._queues),
+                'queue_depth': [work_queue.qsize() for work_queue in self._queues],
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'stalled': self.stalled,
+                'queue_latency_ms': _latency_summary(queue_latencies),
+                'processing_latency_ms': _latency_summary(processing_latencies),
+            }
+
+
+def _latency_summary(sorted_samples):
+    if not sorted_samples:
+        return {'p50': None, 'p95': None, 'max': None}
+
+    def percentile(fraction):
+        return round(sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))] * 1000, 3)
+
+    return {
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'max': round(sorted_samples[-1] * 1000, 3),
+    }
@@ -0,0 +1,125 @@
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import logging
+import os
+import threading
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Canale IPC locale tra i worker web e il processo di ingestione MQTT (MQTT_ROLE=ingest), l'unico
+collegato al broker. Su un socket Unix (autenticato con SECRET_KEY) i worker web inviano richieste
+(operazione, argomenti) e ricevono il risultato: così le pubblicazioni passano tutte dallo stesso
+client MQTT, con un solo stato di deduplica e coalescenza, qualunque sia il numero di worker.
+"""
+
+# Attesa massima (in secondi) della risposta del processo di ingestione
+DEFAULT_TIMEOUT = 5.0
+
+
+class IngestServer:
+    """
+    Lato processo di ingestione: un thread accetta le connessioni e ogni worker web connesso
+    viene servito dal proprio thread, chiamando il gestore registrato per l'operazione richiesta.
+    """
+
+    def __init__(self, address, authkey, handlers):
+        self.address = address
+        self.authkey = authkey
+        self.handlers = handlers
+        self._listener = None
+        self._thread = None
+        self.requests = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Un socket rimasto da un'esecuzione precedente impedirebbe il bind
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        self._thread = threading.Thread(target=self._run, name='mqtt-ipc-server', daemon=True)
+        self._thread.start()
+        microcontrollers_logger.info("TITLE: MQTT Ingest IPC Started | DESC: Accepting publish requests from web workers on '%s'.", self.address)
+
+    def _run(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                # Handshake fallito (es. chiave errata): la connessione viene scartata
+                microcontrollers_logger.warning("TITLE: MQTT Ingest IPC Connection Refused | DESC: Failed to accept a connection on '%s'. Error: %s", self.address, e)
+                continue
+            threading.Thread(target=self._serve, args=(connection,), name='mqtt-ipc-connection', daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    operation, args = connection.recv()
+                except (EOFError, OSError):
+                    return
+
+                self.requests += 1
+                handler = self.handlers.get(operation)
+                try:
+                    if handler is None:
+                        raise ValueError(f"Unknown operation '{operation}'")
+                    reply = ('ok', handler(*args))
+                except Exception as e:
+                    self.errors += 1
+                    microcontrollers_logger.error("TITLE: MQTT Ingest IPC Request Error | DESC: Operation '%s' failed. Error: %s", operation, e)
+                    reply = ('error', str(e))
+
+                try:
+                    connection.send(reply)
+                except (EOFError, OSError):
+                    return
+
+
+class IngestClient:
+    """
+    Lato worker web: una connessione per processo, aperta alla prima richiesta e riaperta
+    dopo un errore. Le richieste dei thread dello stesso worker vengono serializzate.
+    """
+
+    def __init__(self, address, authkey, timeout=DEFAULT_TIMEOUT):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def call(self, operation, *args):
+        """
+        Esegue un'operazione nel processo di ingestione e ne restituisce il risultato.
+
+        Raises:
+            ConnectionError: Se il processo di ingestione non è raggiungibile o non risponde in tempo.
+            RuntimeError: Se l'operazione è fallita nel processo di ingestione.
+        """
+        with self._lock:
+            try:
+                if self._connection is None:
+                    self._connection = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                self._connection.send((operation, args))
+                if not self._connection.poll(self.timeout):
+                    raise TimeoutError(f"No reply within {self.timeout}s")
+                status, result = self._connection.recv()
+            except (OSError, EOFError, AuthenticationError) as e:
+                # Anche dopo un timeout la connessione va chiusa: la risposta tardiva non va letta come la successiva
+                self._close_locked()
+                raise ConnectionError(f"MQTT ingest process unreachable on '{self.address}': {e}") from e
+
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def _close_locked(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except OSError:
+                pass
+            self._connection = None
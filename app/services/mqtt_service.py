@@ -1,97 +1,335 @@
-from config.mqtt_config import get_mqtt, NEW_CONNECTION_TOPIC, ON_MODULE_UPDATE_TOPIC, LAST_WILL_TOPIC
+from config.mqtt_config import get_mqtt, connect_listeners, NEW_CONNECTION_TOPIC, ON_MODULE_UPDATE_TOPIC, LAST_WILL_TOPIC, HEARTBEAT_TOPIC, GROUP_UPDATE_TOPIC, ROLE_INGEST, ROLE_WEB
 from config.mqtt_config import app_ref as app
-from models.model import Module
-from models.conn import db
-from datetime import datetime
+from services.module_registry_service import ModuleRegistry
+from services.mqtt_ingest_service import IngestWorkerPool
+from services.presence_buffer_service import PresenceBuffer
+from services.timing_wheel_service import TimingWheel
+from services.wire_format_service import FORMAT_JSON, negotiate_format, encode_config
+from services.config_publisher_service import ConfigPublisher, PUBLISHED, DEFERRED, COALESCED, SUPPRESSED, FAILED
+from services.history_service import HistoryRecorder
+from services.module_feed_service import ModuleFeed
+from services.mqtt_ipc_service import IngestServer, IngestClient
+from models.model import ModuleEvent
+from datetime import datetime, timedelta
+import atexit
 import json
 import logging
+import threading
 
 microcontrollers_logger = logging.getLogger('microcontrollers')
 
 """
 Modulo per l'interazione con il broker MQTT.
 Questo modulo gestisce l'invio e la ricezione di messaggi MQTT per il controllo dei moduli.
+Nei worker web (MQTT_ROLE=web) non c'è connessione al broker: le pubblicazioni vengono inoltrate
+al processo di ingestione, l'unico che riceve i messaggi dei moduli.
 """
 
 mqtt = get_mqtt()
 
+# False nei worker web: nessun messaggio in arrivo, nessun invio diretto al broker
+owns_broker = app.config['MQTT_ROLE'] != ROLE_WEB
+
 @mqtt.on_message()
 def handle_message(client, userdata, message):
     """
     Callback per la ricezione di tutti i messaggi MQTT.
-    Viene scatenata quando un messaggio arriva su un topic sottoscritto.
+    Viene scatenata sul thread di rete di paho quando un messaggio arriva su un topic sottoscritto:
+    si limita a decodificare il payload e ad accodarlo al pool di worker, indicizzato per MAC
+    così da mantenere l'ordine dei messaggi di ogni dispositivo.
     """
-    with app.app_context():
-        topic = message.topic
-        payload_raw = message.payload.decode()
-        microcontrollers_logger.debug(f"TITLE: Raw MQTT Message Received | DESC: Topic: '{topic}', Raw Payload: '{payload_raw}'")
+    topic = message.topic
+    # Istante di ricezione, usato per ordinare gli eventi di presenza tra più nodi di ingestione
+    received_at = datetime.now()
+    payload_raw = message.payload.decode()
+    microcontrollers_logger.debug("TITLE: Raw MQTT Message Received | DESC: Topic: '%s', Raw Payload: '%s'", topic, payload_raw, extra={'topic': topic})
 
-        try:
-            payload = json.loads(payload_raw)
-        except json.JSONDecodeError as e:
-            # Registra un errore se il payload JSON non è valido
-            microcontrollers_logger.error(f"TITLE: MQTT Payload JSON Error | DESC: Failed to decode JSON from topic '{topic}'. Error: {e}. Raw Payload: '{payload_raw}'")
-            return
+    try:
+        payload = json.loads(payload_raw)
+    except json.JSONDecodeError as e:
+        # Registra un errore se il payload JSON non è valido
+        microcontrollers_logger.error("TITLE: MQTT Payload JSON Error | DESC: Failed to decode JSON from topic '%s'. Error: %s. Raw Payload: '%s'", topic, e, payload_raw, extra={'topic': topic})
+        return
+
+    if ingest_pool is None:
+        _process_message(topic, payload, received_at)
+        return
 
+    mac = payload.get('mac') if isinstance(payload, dict) else None
+    # Con la coda piena blocca il thread di rete: il broker rallenta invece di perdere messaggi
+    ingest_pool.submit(mac, topic, payload, received_at)
+
+
+def _process_message(topic, payload, received_at=None):
+    """
+    Elabora un messaggio MQTT già decodificato (eseguita dai worker del pool).
+    """
+    received_at = received_at or datetime.now()
+    with app.app_context():
         # Chiama la funzione di gestione appropriata in base al topic del messaggio
         if topic == NEW_CONNECTION_TOPIC:
-            _handle_new_connection(payload)
+            _handle_new_connection(payload, received_at)
         elif topic == LAST_WILL_TOPIC:
-            _handle_last_will(payload)
+            _handle_last_will(payload, received_at)
+        elif topic == HEARTBEAT_TOPIC:
+            _handle_heartbeat(payload)
         else:
             # Registra un'informazione se il topic non è gestito
-            microcontrollers_logger.info(f"TITLE: Unhandled MQTT Topic | DESC: Received message on unhandled topic: '{topic}'. Payload: {payload}")
+            microcontrollers_logger.info("TITLE: Unhandled MQTT Topic | DESC: Received message on unhandled topic: '%s'. Payload: %s", topic, payload, extra={'topic': topic})
+
+
+# Formato di codifica delle configurazioni negoziato con ogni modulo alla connessione (JSON se assente)
+wire_formats = {}
+
+# Con le configurazioni retained il broker conserva l'ultima configurazione di ogni modulo
+retain_configs = app.config['MQTT_RETAIN_CONFIGS']
+
+def _send_configuration(mac, payload):
+    """
+    Pubblica la configurazione sul topic del modulo, con QoS 1 per garantire la consegna,
+    codificata nel formato negoziato con il modulo.
+    """
+    topic = f"{ON_MODULE_UPDATE_TOPIC}/{mac}"
+    encoded, wire_format = encode_config(payload, wire_formats.get(mac, FORMAT_JSON))
+    result = mqtt.publish(topic, encoded, qos=1, retain=retain_configs)
+    if result[0] != 0:
+        microcontrollers_logger.error("TITLE: MQTT Config Publish Failed | DESC: Client refused the configuration for module MAC '%s' on topic '%s' (rc=%s). Payload: %s", mac, topic, result[0], payload, extra={'mac': mac, 'topic': topic})
+        return result
+    history_recorder.record(module_registry.lookup_id(mac), ModuleEvent.CONFIG_PUSH)
+    microcontrollers_logger.info("TITLE: MQTT Config Published | DESC: Configuration sent to module MAC '%s' on topic '%s' as %s (%s bytes, mid %s). Payload: %s", mac, topic, wire_format, len(encoded), result[1], payload, extra={'mac': mac, 'topic': topic})
+    return result
 
+# Invio delle configurazioni con soppressione dei duplicati, coalescenza delle modifiche ravvicinate
+# e finestra limitata di messaggi in attesa di conferma
+config_publisher = ConfigPublisher(
+    _send_configuration,
+    coalesce_window=app.config['MQTT_PUBLISH_COALESCE_MS'] / 1000,
+    max_inflight=app.config['MQTT_PUBLISH_INFLIGHT_WINDOW'],
+    ack_timeout=app.config['MQTT_PUBLISH_ACK_TIMEOUT'],
+)
+if owns_broker:
+    config_publisher.start()
 
-def _handle_new_connection(data):
+@mqtt.on_publish()
+def handle_publish(client, userdata, mid):
+    """
+    Callback per la conferma (PUBACK) dei messaggi pubblicati con QoS 1.
+    """
+    config_publisher.acknowledge(mid)
+
+@mqtt.on_disconnect()
+def handle_disconnect():
+    """
+    Callback per la disconnessione dal broker: i messaggi in volo non verranno più confermati.
+    """
+    config_publisher.reset_inflight()
+    microcontrollers_logger.warning("TITLE: MQTT Disconnected | DESC: Disconnected from the MQTT broker, in-flight configurations discarded.")
+
+
+# Sottoscrizioni condivise tra più nodi di ingestione: gli eventi di connessione e last will
+# vengono applicati con UPDATE condizionali idempotenti invece che tramite il buffer di presenza
+shared_subscriptions = bool(app.config['MQTT_SHARED_SUBSCRIPTION_GROUP'])
+dedup_window = timedelta(milliseconds=app.config['MQTT_DEDUP_WINDOW_MS'])
+
+# Buffer write-behind per gli aggiornamenti di presenza dei moduli
+presence_buffer = PresenceBuffer(
+    app,
+    flush_interval=app.config['MQTT_PRESENCE_FLUSH_MS'] / 1000,
+    max_rows=app.config['MQTT_PRESENCE_FLUSH_ROWS'],
+)
+presence_buffer.start()
+# Scrive gli aggiornamenti ancora in attesa alla chiusura del processo
+atexit.register(presence_buffer.flush)
+
+# Storico degli eventi dei moduli con aggregati orari di disponibilità
+history_recorder = HistoryRecorder(app)
+if owns_broker:
+    history_recorder.start()
+    atexit.register(history_recorder.flush)
+
+# Variazioni dei moduli inviate in tempo reale alle dashboard aperte (conteggi letti dal registro)
+module_feed = ModuleFeed(counts=lambda: module_registry.counts())
+
+# Registro in memoria dei moduli, caricato da create_app() dopo la creazione delle tabelle
+module_registry = ModuleRegistry(
+    app,
+    pending_lookup=presence_buffer.get_pending,
+    sync_interval=app.config['MODULE_REGISTRY_SYNC_MS'] / 1000,
+    # I worker web (e i nodi con sottoscrizioni condivise) non ricevono tutti gli eventi di presenza:
+    # li leggono dal database
+    follow_fleet=not owns_broker or shared_subscriptions,
+    on_change=module_feed.notify,
+)
+
+def _expire_modules(macs):
+    """
+    Segna come offline, in un unico lotto, i moduli che non hanno inviato heartbeat entro il timeout.
+    """
+    for mac in macs:
+        presence_buffer.update(mac, online=False)
+        module_registry.update_presence(mac, online=False)
+        if not retain_configs:
+            config_publisher.forget(mac)
+        history_recorder.record(module_registry.lookup_id(mac), ModuleEvent.OFFLINE)
+    microcontrollers_logger.warning("TITLE: Module Heartbeats Expired | DESC: %s modules marked offline after missing heartbeats: %s", len(macs), ', '.join(macs[:20]) + (' ...' if len(macs) > 20 else ''))
+
+# Scadenza degli heartbeat (None se MQTT_HEARTBEAT_INTERVAL è 0)
+heartbeat_wheel = None
+if owns_broker and app.config['MQTT_HEARTBEAT_INTERVAL'] > 0:
+    heartbeat_wheel = TimingWheel(
+        timeout=app.config['MQTT_HEARTBEAT_INTERVAL'] * app.config['MQTT_HEARTBEAT_MISSED'],
+        on_expire=_expire_modules,
+    )
+
+def start_heartbeat_monitor():
+    """
+    Avvia la scadenza degli heartbeat; va chiamata dopo il caricamento del registro, così che
+    i moduli rimasti online nel database (es. dopo un riavvio del server) scadano se non più attivi.
+    """
+    if heartbeat_wheel is not None:
+        heartbeat_wheel.start(module.mac for module in module_registry.get_all() if module.online)
+
+# Pool di worker per l'elaborazione dei messaggi (None se MQTT_INGEST_WORKERS è 0)
+ingest_pool = None
+if owns_broker and app.config['MQTT_INGEST_WORKERS'] > 0:
+    ingest_pool = IngestWorkerPool(
+        _process_message,
+        workers=app.config['MQTT_INGEST_WORKERS'],
+        queue_size=app.config['MQTT_INGEST_QUEUE_SIZE'],
+        enqueue_timeout=app.config['MQTT_INGEST_ENQUEUE_TIMEOUT'],
+    )
+    ingest_pool.start()
+
+# Canale verso il processo di ingestione, usato dai worker web per pubblicare (None negli altri ruoli)
+ingest_client = None
+if not owns_broker:
+    ingest_client = IngestClient(app.config['MQTT_INGEST_SOCKET'], authkey=app.config['SECRET_KEY'].encode())
+
+ingest_server = None
+
+def start_ingest_server():
+    """
+    Nel processo di ingestione (MQTT_ROLE=ingest) accetta le richieste di pubblicazione dei worker web.
+    """
+    global ingest_server
+    if app.config['MQTT_ROLE'] != ROLE_INGEST or ingest_server is not None:
+        return
+    ingest_server = IngestServer(app.config['MQTT_INGEST_SOCKET'], authkey=app.config['SECRET_KEY'].encode(), handlers={
+        'publish': publish_new_configuration,
+        'publish_batch': publish_configurations,
+        'publish_group': publish_group_configuration,
+        'deliveries': get_config_deliveries,
+        'delivery': get_config_delivery,
+        'stats': collect_stats,
+    })
+    ingest_server.start()
+
+def _forward(operation, *args, default=None):
+    """
+    Esegue l'operazione nel processo di ingestione; se non è raggiungibile restituisce `default`.
+    """
+    try:
+        return ingest_client.call(operation, *args)
+    except (ConnectionError, RuntimeError) as e:
+        microcontrollers_logger.error("TITLE: MQTT Ingest Request Failed | DESC: Operation '%s' could not be completed by the ingest process. Error: %s", operation, e)
+        return default
+
+
+def _presence_session(data):
+    """
+    Sessione del dispositivo riportata nei messaggi di presenza (campo opzionale 'session'),
+    usata per ordinare gli eventi tra più nodi di ingestione; None se assente o non valida.
+    """
+    session = data.get('session')
+    return session if isinstance(session, int) and not isinstance(session, bool) else None
+
+def _handle_new_connection(data, received_at=None):
     """
     Gestisce i messaggi relativi a una nuova connessione di un modulo.
     Registra un nuovo modulo o aggiorna lo stato di uno esistente.
     """
     mac = data.get('mac')
     module_type = data.get('type') # Tipo del modulo (es. 'numeric', 'arrow')
+    session = _presence_session(data)
 
     if not mac or not module_type:
-        microcontrollers_logger.warning(f"TITLE: Invalid New Connection Payload | DESC: Missing 'mac' or 'type' in payload: {data}")
+        microcontrollers_logger.warning("TITLE: Invalid New Connection Payload | DESC: Missing 'mac' or 'type' in payload: %s", data)
         return False
     
     if module_type not in ['numeric', 'arrow']:
-        microcontrollers_logger.warning(f"TITLE: Invalid Module Type | DESC: Received invalid module type '{module_type}' for MAC '{mac}'. Payload: {data}")
+        microcontrollers_logger.warning("TITLE: Invalid Module Type | DESC: Received invalid module type '%s' for MAC '%s'. Payload: %s", module_type, mac, data, extra={'mac': mac})
         return False
     
-    microcontrollers_logger.debug(f"TITLE: New Module Connection Attempt | DESC: Module MAC '{mac}', Type '{module_type}' attempting connection.")
-    
-    module = Module.get_from_mac(mac)
+    microcontrollers_logger.debug("TITLE: New Module Connection Attempt | DESC: Module MAC '%s', Type '%s' attempting connection.", mac, module_type, extra={'mac': mac})
     
+    # Formato delle configurazioni supportato dal modulo; se cambia, la configurazione va reinviata
+    wire_format = negotiate_format(data.get('formats'))
+    if wire_formats.get(mac, FORMAT_JSON) != wire_format:
+        config_publisher.forget(mac)
+    wire_formats[mac] = wire_format
+
+    now = received_at or datetime.now()
+    module = module_registry.get_by_mac(mac)
+    created = False
+
     # Se il modulo non esiste, lo crea
     if not module:
-        module = Module(mac=mac)
-        module.place = 'NEW MODULE' # Posizione di default per i nuovi moduli
-        module.online = True # Imposta lo stato online
-        module.type = module_type
-        module.animation = 'none' # Animazione di default
-        module.on = False # Stato di accensione di default
-        if module.type == 'numeric':
-            module.number = 0
-        module.last_seen = datetime.now()
-        module.last_update = datetime.now()
-        db.session.add(module)
-        db.session.commit()
-        microcontrollers_logger.info(f"TITLE: New Module Created | DESC: New module MAC '{mac}', Type '{module_type}' created in database.")
+        module = module_registry.create_module(
+            mac=mac,
+            place='NEW MODULE', # Posizione di default per i nuovi moduli
+            online=True, # Imposta lo stato online
+            type=module_type,
+            animation='none', # Animazione di default
+            on=False, # Stato di accensione di default
+            number=0 if module_type == 'numeric' else None,
+            last_seen=now,
+            last_update=now,
+            presence_at=now,
+            presence_session=session,
+        )
+        created = module is not None
+        if not created:
+            # Creato nel frattempo da un altro processo
+            module = module_registry.get_by_mac(mac)
+            if not module:
+                return False
+
+    if not created and shared_subscriptions:
+        # Con più nodi di ingestione lo stesso evento può essere riconsegnato a un altro nodo o arrivare
+        # dopo uno più recente: viene applicato (e la configurazione pubblicata) solo dal primo nodo
+        # (in modo affidabile solo se il messaggio riporta la sessione del dispositivo, vedi claim_presence)
+        presence = dict(presence_buffer.get_pending(mac) or {}, online=True, type=module_type, last_seen=now)
+        claimed = module_registry.claim_presence(mac, now, session=session, dedup_window=dedup_window, **presence)
+        if claimed is None:
+            microcontrollers_logger.debug("TITLE: Duplicate New Connection Ignored | DESC: Connection of module MAC '%s' already handled by another ingest node.", mac, extra={'mac': mac})
+            return True
+        presence_buffer.discard(mac)
+        module = claimed
+
+    if heartbeat_wheel is not None:
+        heartbeat_wheel.touch(mac)
+    history_recorder.record(module.id, ModuleEvent.ONLINE)
+
+    if created:
+        # Eventuali aggiornamenti di presenza in attesa sono superati dalla creazione
+        presence_buffer.discard(mac)
+        microcontrollers_logger.info("TITLE: New Module Created | DESC: New module MAC '%s', Type '%s' created in database.", mac, module_type, extra={'mac': mac})
     else:
-        # Se il modulo esiste, aggiorna il suo stato
-        module.online = True
-        module.type = module_type # Aggiorna il tipo, potrebbe essere cambiato
-        module.last_seen = datetime.now()
-        db.session.commit()
-        microcontrollers_logger.info(f"TITLE: Existing Module Reconnected | DESC: Module MAC '{mac}', Type '{module_type}' marked as online. Last seen updated.")
+        if not shared_subscriptions:
+            # Se il modulo esiste, aggiorna il suo stato tramite il buffer write-behind
+            # (il tipo viene aggiornato perché potrebbe essere cambiato)
+            presence = {'online': True, 'type': module_type, 'last_seen': now}
+            presence_buffer.update(mac, **presence)
+            module = module_registry.update_presence(mac, **presence) or module
+        microcontrollers_logger.info("TITLE: Existing Module Reconnected | DESC: Module MAC '%s', Type '%s' marked as online. Last seen updated.", mac, module_type, extra={'mac': mac})
     
-    # Pubblica la configurazione corrente al modulo appena connesso/riconnesso
+    # Pubblica la configurazione corrente al modulo appena connesso/riconnesso; con le configurazioni
+    # retained viene saltata se la copia conservata dal broker è già aggiornata
     publish_new_configuration(module)
 
     return True
 
-def _handle_last_will(data):
+def _handle_last_will(data, received_at=None):
     """
     Gestisce i messaggi di "last will", inviati quando un modulo si disconnette inaspettatamente.
     Imposta il modulo come offline.
@@ -99,35 +337,225 @@ def _handle_last_will(data):
     mac = data.get('mac')
     
     if not mac:
-        microcontrollers_logger.warning(f"TITLE: Invalid Last Will Payload | DESC: Missing 'mac' in last will payload: {data}")
+        microcontrollers_logger.warning("TITLE: Invalid Last Will Payload | DESC: Missing 'mac' in last will payload: %s", data)
         return False
     
-    module = Module.get_from_mac(mac)
+    module = module_registry.get_by_mac(mac)
+
+    if module and shared_subscriptions:
+        # Un last will di una sessione precedente (es. riconsegnato dopo la riconnessione) va ignorato;
+        # senza sessione nel messaggio il confronto avviene sull'istante di ricezione (vedi claim_presence)
+        presence = dict(presence_buffer.get_pending(mac) or {}, online=False)
+        if module_registry.claim_presence(mac, received_at or datetime.now(), session=_presence_session(data), **presence) is None:
+            microcontrollers_logger.debug("TITLE: Stale Last Will Ignored | DESC: Last will of module MAC '%s' is older than its latest presence event.", mac, extra={'mac': mac})
+            return True
+        presence_buffer.discard(mac)
+    elif module:
+        presence_buffer.update(mac, online=False)
+        module_registry.update_presence(mac, online=False)
+
+    if module and not retain_configs:
+        # Il modulo potrebbe essersi riavviato: alla riconnessione la configurazione va reinviata
+        # (con le configurazioni retained la riceve dal broker alla sottoscrizione)
+        config_publisher.forget(mac)
 
     if module:
-        module.online = False
-        db.session.commit()
-        microcontrollers_logger.info(f"TITLE: Module Disconnected (Last Will) | DESC: Module MAC '{mac}' ('{module.place}') marked as offline due to last will testament.")
+        if heartbeat_wheel is not None:
+            heartbeat_wheel.remove(mac)
+        history_recorder.record(module.id, ModuleEvent.OFFLINE)
+        microcontrollers_logger.info("TITLE: Module Disconnected (Last Will) | DESC: Module MAC '%s' ('%s') marked as offline due to last will testament.", mac, module.place, extra={'mac': mac})
     else:
-        microcontrollers_logger.warning(f"TITLE: Unknown Module Disconnected (Last Will) | DESC: Received last will for unknown MAC '{mac}'.")
+        microcontrollers_logger.warning("TITLE: Unknown Module Disconnected (Last Will) | DESC: Received last will for unknown MAC '%s'.", mac, extra={'mac': mac})
     
     return True
 
-def publish_new_configuration(module):
+def _handle_heartbeat(data):
     """
-    Pubblica la configurazione aggiornata a un modulo specifico via MQTT.
-    Utilizzato quando le impostazioni di un modulo vengono modificate dall'interfaccia web.
+    Gestisce gli heartbeat periodici dei moduli: rinnova il timer di liveness e aggiorna last_seen
+    (e lo stato online, se il modulo era stato dato per disconnesso).
     """
-    topic = f"{ON_MODULE_UPDATE_TOPIC}/{module.mac}"
-    payload = {
+    mac = data.get('mac')
+
+    if not mac:
+        microcontrollers_logger.warning("TITLE: Invalid Heartbeat Payload | DESC: Missing 'mac' in heartbeat payload: %s", data)
+        return False
+
+    module = module_registry.get_by_mac(mac)
+
+    if not module:
+        microcontrollers_logger.warning("TITLE: Unknown Module Heartbeat | DESC: Received heartbeat for unknown MAC '%s'.", mac, extra={'mac': mac})
+        return False
+
+    if heartbeat_wheel is not None:
+        heartbeat_wheel.touch(mac)
+
+    presence = {'last_seen': datetime.now()}
+    if not module.online:
+        presence['online'] = True
+    presence_buffer.update(mac, **presence)
+    module_registry.update_presence(mac, **presence)
+
+    if not module.online:
+        history_recorder.record(module.id, ModuleEvent.ONLINE)
+        microcontrollers_logger.info("TITLE: Module Back Online (Heartbeat) | DESC: Module MAC '%s' ('%s') marked as online after a heartbeat.", mac, module.place, extra={'mac': mac})
+    else:
+        microcontrollers_logger.debug("TITLE: Module Heartbeat | DESC: Heartbeat received from module MAC '%s'.", mac, extra={'mac': mac})
+    return True
+
+def _configuration_payload(module):
+    return {
         'on': module.on,
         'color': module.color,
         'animation': module.animation,
         'number': module.number,
     }
-    
-    # Pubblica il messaggio MQTT con la configurazione, con QoS 1 per garantire la consegna
-    mqtt.publish(topic, json.dumps(payload), qos=1)
-    
-    microcontrollers_logger.info(f"TITLE: MQTT Config Published | DESC: Configuration sent to module MAC '{module.mac}' ('{module.place}') on topic '{topic}'. Payload: {payload}")
-    return True
\ No newline at end of file
+
+def publish_new_configuration(module, force=False):
+    """
+    Pubblica la configurazione aggiornata a un modulo specifico via MQTT.
+    Utilizzato quando le impostazioni di un modulo vengono modificate dall'interfaccia web
+    e quando un modulo si connette. La pubblicazione viene saltata se il modulo ha già questa
+    configurazione, e ritardata (unendola alle successive) se il modulo è stato appena aggiornato.
+
+    Returns:
+        str: L'esito restituito da ConfigPublisher.publish().
+    """
+    if ingest_client is not None:
+        return _forward('publish', module, force, default=FAILED)
+
+    payload = _configuration_payload(module)
+    outcome = config_publisher.publish(module.mac, payload, force=force)
+    if outcome != PUBLISHED:
+        microcontrollers_logger.debug("TITLE: MQTT Config Publish %s | DESC: Configuration for module MAC '%s' ('%s') %s. Payload: %s", outcome.capitalize(), module.mac, module.place, outcome, payload, extra={'mac': module.mac})
+    return outcome
+
+def publish_configurations(modules):
+    """
+    Pubblica la configurazione di più moduli in un unico lotto.
+    I messaggi vengono accodati al client senza attendere le conferme del broker, che li invia
+    in pipeline sulla stessa connessione; i moduli che hanno già la configurazione vengono saltati.
+
+    Returns:
+        int: Numero di messaggi pubblicati o programmati.
+    """
+    if ingest_client is not None:
+        return _forward('publish_batch', list(modules), default=0)
+
+    outcomes = [config_publisher.publish(module.mac, _configuration_payload(module)) for module in modules]
+    published = sum(1 for outcome in outcomes if outcome in (PUBLISHED, DEFERRED, COALESCED))
+
+    microcontrollers_logger.info("TITLE: MQTT Config Batch Published | DESC: Configuration sent to %s of %s modules (%s unchanged, %s failed).", published, len(modules), outcomes.count(SUPPRESSED), outcomes.count(FAILED))
+    return published
+
+def publish_group_configuration(group, changes, modules):
+    """
+    Pubblica una modifica parziale della configurazione sul topic di gruppo, con un solo messaggio
+    ricevuto da tutti i moduli del gruppo ('all' o il tipo di modulo).
+    """
+    if ingest_client is not None:
+        return _forward('publish_group', group, changes, list(modules), default=False)
+
+    topic = f"{GROUP_UPDATE_TOPIC}/{group}"
+    mqtt.publish(topic, json.dumps(changes), qos=1)
+    # La conferma del messaggio di gruppo non dice nulla sui singoli moduli (e le loro copie retained
+    # non sono più aggiornate): alla riconnessione la configurazione completa verrà ripubblicata
+    for module in modules:
+        config_publisher.forget(module.mac)
+
+    microcontrollers_logger.info("TITLE: MQTT Group Config Published | DESC: Configuration sent to group '%s' on topic '%s'. Payload: %s", group, topic, changes, extra={'topic': topic})
+    return True
+
+# Ripubblicazione di tutte le configurazioni retained, richiesta ad ogni connessione al broker
+# (che dopo un riavvio potrebbe averle perse) ed eseguita su un thread dedicato
+_resync_requested = threading.Event()
+_resync_thread = None
+resync_stats = {'runs': 0, 'published': 0, 'failed': 0, 'last_at': None}
+
+if owns_broker and retain_configs:
+    connect_listeners.append(_resync_requested.set)
+
+def start_retained_resync():
+    """
+    Avvia la ripubblicazione delle configurazioni retained; va chiamata dopo il caricamento del registro,
+    perché la connessione al broker (e quindi la richiesta) può avvenire prima.
+    """
+    global _resync_thread
+    if not owns_broker or not retain_configs or _resync_thread is not None:
+        return
+    _resync_thread = threading.Thread(target=_run_resync, name='retained-config-resync', daemon=True)
+    _resync_thread.start()
+
+def _run_resync():
+    while True:
+        _resync_requested.wait()
+        _resync_requested.clear()
+        try:
+            resync_retained_configurations()
+        except Exception as e:
+            microcontrollers_logger.error("TITLE: Retained Config Resync Error | DESC: Failed to resync retained configurations. Error: %s", e)
+
+def resync_retained_configurations():
+    """
+    Ripubblica come retained la configurazione di tutti i moduli, anche se risulta già inviata:
+    dopo un riavvio del server o del broker le copie conservate potrebbero essere assenti o superate.
+    I moduli che si riconnettono subito dopo la ricevono dal broker e non causano altre pubblicazioni.
+
+    Returns:
+        int: Numero di configurazioni pubblicate o programmate.
+    """
+    modules = module_registry.get_all()
+    outcomes = [config_publisher.publish(module.mac, _configuration_payload(module), force=True) for module in modules]
+    published = sum(1 for outcome in outcomes if outcome in (PUBLISHED, DEFERRED, COALESCED))
+
+    resync_stats['runs'] += 1
+    resync_stats['published'] += published
+    resync_stats['failed'] += outcomes.count(FAILED)
+    resync_stats['last_at'] = datetime.now().isoformat(timespec='seconds')
+    microcontrollers_logger.info("TITLE: Retained Configs Resynced | DESC: Retained configuration republished for %s of %s modules (%s failed).", published, len(modules), outcomes.count(FAILED))
+    return published
+
+def get_config_deliveries(macs=None):
+    """
+    Stato di consegna delle configurazioni non ancora confermate (in attesa, in volo o fallite),
+    indicizzato per MAC e limitato ai MAC indicati. Nei worker web viene richiesto al processo
+    di ingestione (dizionario vuoto se non raggiungibile).
+    """
+    if ingest_client is not None:
+        return _forward('deliveries', macs, default={})
+
+    deliveries = config_publisher.deliveries()
+    if macs is not None:
+        deliveries = {mac: deliveries[mac] for mac in macs if mac in deliveries}
+    return deliveries
+
+def get_config_delivery(mac):
+    """
+    Stato di consegna dell'ultima configurazione di un modulo (None se mai inviata o non disponibile).
+    """
+    if ingest_client is not None:
+        return _forward('delivery', mac)
+    return config_publisher.delivery(mac)
+
+def collect_stats():
+    """
+    Metriche del percorso MQTT del processo collegato al broker: pool di elaborazione dei messaggi,
+    buffer di presenza, registro dei moduli, invio delle configurazioni, heartbeat e storico.
+    Nei worker web vengono richieste al processo di ingestione (None se non raggiungibile).
+    """
+    if ingest_client is not None:
+        stats = _forward('stats')
+        if stats is not None:
+            stats['web_module_registry'] = module_registry.stats()
+        return stats
+
+    stats = ingest_pool.stats() if ingest_pool is not None else {'workers': 0}
+    stats['presence_buffer'] = presence_buffer.stats()
+    stats['module_registry'] = module_registry.stats()
+    stats['config_publisher'] = config_publisher.stats()
+    stats['heartbeats'] = heartbeat_wheel.stats() if heartbeat_wheel is not None else None
+    stats['history'] = history_recorder.stats()
+    stats['retained_resync'] = dict(resync_stats) if retain_configs else None
+    stats['role'] = app.config['MQTT_ROLE']
+    if ingest_server is not None:
+        stats['ipc'] = {'requests': ingest_server.requests, 'errors': ingest_server.errors}
+    return stats
@@ -0,0 +1,116 @@
+from sqlalchemy import bindparam
+from models.conn import db
+from models.model import Module, RegistryVersion
+import logging
+import threading
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Buffer write-behind per i campi di presenza dei moduli (online, last_seen, type).
+Gli aggiornamenti ripetuti sullo stesso MAC vengono uniti in memoria e scritti periodicamente
+con un unico UPDATE multiplo in una sola transazione, invece di un commit per ogni messaggio.
+"""
+
+# Campi che possono essere aggiornati tramite il buffer
+PRESENCE_FIELDS = ('online', 'last_seen', 'type')
+
+
+class PresenceBuffer:
+    """
+    Accumula gli aggiornamenti di presenza per MAC e li scrive ogni flush_interval secondi
+    oppure appena vengono raggiunti max_rows MAC in attesa.
+    """
+
+    def __init__(self, app, flush_interval=0.5, max_rows=200):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='presence-buffer', daemon=True)
+        self._thread.start()
+
+    def update(self, mac, **fields):
+        """
+        Registra un aggiornamento di presenza; i valori più recenti sostituiscono quelli in attesa.
+        """
+        with self._condition:
+            self._pending.setdefault(mac, {}).update(fields)
+            self.updates += 1
+            if len(self._pending) >= self.max_rows:
+                self._condition.notify()
+
+    def discard(self, mac):
+        """
+        Scarta gli aggiornamenti in attesa di un modulo (es. perché eliminato).
+        """
+        with self._condition:
+            self._pending.pop(mac, None)
+
+    def get_pending(self, mac):
+        with self._condition:
+            fields = self._pending.get(mac)
+            return dict(fields) if fields else None
+
+    def flush(self):
+        """
+        Scrive tutti gli aggiornamenti in attesa in un'unica transazione.
+        Le righe con lo stesso insieme di campi vengono scritte con un solo UPDATE multiplo;
+        a tutte viene assegnata la stessa nuova revisione della flotta.
+        """
+        with self._condition:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        groups = {}
+        for mac, fields in pending.items():
+            groups.setdefault(tuple(sorted(fields)), []).append(
+                dict({f"b_{field}": value for field, value in fields.items()}, b_mac=mac))
+
+        table = Module.__table__
+        try:
+            with self.app.app_context():
+                revision = RegistryVersion.bump(RegistryVersion.FLEET)
+                for field_names, rows in groups.items():
+                    stmt = (table.update()
+                            .where(table.c.mac == bindparam('b_mac'))
+                            .values(dict({field: bindparam(f"b_{field}") for field in field_names}, revision=revision)))
+                    db.session.execute(stmt, rows)
+                db.session.commit()
+        except Exception as e:
+            # Rimette in coda i valori non scritti, senza sovrascrivere quelli arrivati nel frattempo
+            with self._condition:
+                for mac, fields in pending.items():
+                    self._pending[mac] = dict(fields, **self._pending.get(mac, {}))
+            microcontrollers_logger.error("TITLE: Presence Flush Error | DESC: Failed to write %s buffered presence updates. Error: %s", len(pending), e)
+            return 0
+
+        self.flushes += 1
+        self.rows_written += len(pending)
+        microcontrollers_logger.debug("TITLE: Presence Flush | DESC: Wrote %s buffered presence updates in %s statements.", len(pending), len(groups))
+        return len(pending)
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'updates': self.updates,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self.max_rows:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
@@ -0,0 +1,69 @@
+from flask import Response
+import os
+import threading
+
+"""
+Limite condiviso delle connessioni di streaming (Server-Sent Events) aperte in un processo.
+Con il worker gthread di gunicorn ogni stream occupa un thread per tutta la durata della connessione:
+il limite, comune allo stream dei log e a quello della dashboard dei moduli, lascia sempre dei thread
+liberi per le normali richieste. Oltre il limite le route rispondono 503 e il browser riprova più tardi.
+"""
+
+# Thread per worker configurati in gunicorn (vedi entrypoint.sh)
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 16))
+
+# Numero massimo di stream aperti per worker: di default metà dei thread, e comunque almeno un thread libero
+SSE_MAX_STREAMS = min(int(os.getenv('SSE_MAX_STREAMS', GUNICORN_THREADS // 2)), GUNICORN_THREADS - 1)
+
+# Attesa (in secondi) suggerita al client prima di riprovare quando il limite è raggiunto
+SSE_RETRY_AFTER = int(os.getenv('SSE_RETRY_AFTER', 30))
+
+
+class StreamLimiter:
+    """
+    Contatore delle connessioni di streaming aperte, con rifiuto immediato oltre il limite.
+    """
+
+    def __init__(self, max_streams=SSE_MAX_STREAMS):
+        self.max_streams = max_streams
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Riserva uno stream. Restituisce False se il limite è già stato raggiunto.
+        """
+        with self._lock:
+            if self.active >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active = max(self.active - 1, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'max_streams': self.max_streams,
+                'rejected': self.rejected,
+            }
+
+
+def stream_unavailable_response():
+    """
+    Risposta 503 per gli stream rifiutati: indica al client dopo quanto riprovare,
+    sia nell'header Retry-After sia nel campo `retry:` (in millisecondi) del protocollo SSE.
+    """
+    return Response(f"retry: {SSE_RETRY_AFTER * 1000}\n\n", status=503, mimetype='text/event-stream', headers={
+        'Retry-After': str(SSE_RETRY_AFTER),
+        'Cache-Control': 'no-cache',
+    })
+
+
+# Istanza condivisa dal processo
+stream_limiter = StreamLimiter()
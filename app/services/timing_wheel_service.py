@@ -0,0 +1,108 @@
+import logging
+import math
+import threading
+import time
+
+microcontrollers_logger = logging.getLogger('microcontrollers')
+
+"""
+Hashed timing wheel per la scadenza dei timer di liveness dei moduli.
+Ogni chiave (il MAC) ha una scadenza espressa in tick e si trova nello slot corrispondente;
+rinnovare un timer costa O(1) e ad ogni tick viene esaminato un solo slot, che contiene solo
+le chiavi in scadenza in quel tick: il costo della scansione non dipende dal numero di moduli.
+"""
+
+# Durata (in secondi) di un tick della ruota
+DEFAULT_TICK = 1.0
+
+
+class TimingWheel:
+    """
+    Ruota con timeout/tick + 1 slot, così che ogni scadenza cada entro un solo giro
+    e uno slot contenga soltanto chiavi già scadute quando viene esaminato.
+    Le chiavi scadute vengono passate in un unico lotto a on_expire(keys).
+    """
+
+    def __init__(self, timeout, on_expire, tick=DEFAULT_TICK):
+        self.tick = tick
+        self.on_expire = on_expire
+        self.timeout_ticks = max(1, math.ceil(timeout / tick))
+        self._slots = [set() for _ in range(self.timeout_ticks + 1)]
+        self._deadlines = {}
+        self._cursor = self._now_tick()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.expired = 0
+
+    def _now_tick(self):
+        return int(time.monotonic() / self.tick)
+
+    def start(self, keys=()):
+        """
+        Avvia il thread della ruota; le chiavi iniziali (es. i moduli risultati online all'avvio)
+        scadono se non vengono rinnovate entro il timeout.
+        """
+        for key in keys:
+            self.touch(key)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='heartbeat-wheel', daemon=True)
+            self._thread.start()
+
+    def touch(self, key):
+        """
+        Rinnova il timer di una chiave (O(1)).
+        """
+        with self._lock:
+            deadline = self._now_tick() + self.timeout_ticks
+            previous = self._deadlines.get(key)
+            if previous == deadline:
+                return
+            if previous is not None:
+                self._slots[previous % len(self._slots)].discard(key)
+            self._deadlines[key] = deadline
+            self._slots[deadline % len(self._slots)].add(key)
+
+    def remove(self, key):
+        with self._lock:
+            deadline = self._deadlines.pop(key, None)
+            if deadline is not None:
+                self._slots[deadline % len(self._slots)].discard(key)
+
+    def advance(self):
+        """
+        Esamina gli slot dei tick trascorsi dall'ultima chiamata e restituisce le chiavi scadute.
+        """
+        expired = []
+        with self._lock:
+            target = self._now_tick()
+            # Dopo una lunga pausa basta un giro completo per esaminare tutti gli slot
+            self._cursor = max(self._cursor, target - len(self._slots))
+            while self._cursor < target:
+                self._cursor += 1
+                slot = self._slots[self._cursor % len(self._slots)]
+                due = [key for key in slot if self._deadlines[key] <= self._cursor]
+                for key in due:
+                    slot.discard(key)
+                    del self._deadlines[key]
+                expired.extend(due)
+            self.expired += len(expired)
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked': len(self._deadlines),
+                'expired': self.expired,
+                'slots': len(self._slots),
+                'tick_seconds': self.tick,
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            expired = self.advance()
+            if expired:
+                try:
+                    self.on_expire(expired)
+                except Exception as e:
+                    microcontrollers_logger.error("TITLE: Heartbeat Expiry Error | DESC: Failed to process %s expired heartbeats. Error: %s", len(expired), e)
@@ -0,0 +1,126 @@
+import json
+import re
+import struct
+
+"""
+Codifica delle configurazioni inviate sul topic on_module_update.
+Oltre al JSON (sempre supportato) è disponibile un formato binario a layout fisso di 7 byte,
+pensato per i microcontrollori su reti Wi-Fi deboli. Il modulo annuncia i formati che supporta
+nel payload di new_connection (es. {"mac": ..., "type": ..., "formats": ["bin1", "json"]})
+e il server sceglie il primo formato supportato da entrambi, in ordine di preferenza.
+
+Layout del formato 'bin1' (big-endian):
+    byte 0     versione del formato (1)
+    byte 1     flag: bit 0 acceso, bit 1 colore casuale, bit 2 colore assente
+    byte 2-4   colore RGB
+    byte 5     animazione (indice in ANIMATIONS)
+    byte 6     numero (0-254, 255 se assente)
+"""
+
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'bin1'
+
+# Formati supportati dal server, in ordine di preferenza
+SUPPORTED_FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+
+# Le posizioni sono parte del protocollo: le nuove animazioni vanno aggiunte solo in coda
+ANIMATIONS = ('none', 'random', 'flow', 'pixels', 'pulse')
+
+BINARY_VERSION = 1
+FLAG_ON = 0x01
+FLAG_RANDOM_COLOR = 0x02
+FLAG_NO_COLOR = 0x04
+NO_NUMBER = 0xFF
+
+_BINARY_STRUCT = struct.Struct('>BB3sBB')
+_ANIMATION_CODES = {animation: code for code, animation in enumerate(ANIMATIONS)}
+_COLOR_REGEX = re.compile(r'^#([0-9a-fA-F]{6})$')
+
+
+def negotiate_format(announced):
+    """
+    Sceglie il formato da usare per un modulo in base ai formati annunciati nel payload
+    di new_connection (lista o stringa). Se il modulo non annuncia nulla si usa il JSON.
+    """
+    if isinstance(announced, str):
+        announced = [announced]
+    if not isinstance(announced, (list, tuple)):
+        return FORMAT_JSON
+    for wire_format in SUPPORTED_FORMATS:
+        if wire_format in announced:
+            return wire_format
+    return FORMAT_JSON
+
+
+def encode_binary(config):
+    """
+    Codifica una configurazione ({on, color, animation, number}) nel formato 'bin1'.
+
+    Raises:
+        ValueError: Se la configurazione non è rappresentabile (animazione sconosciuta,
+                    colore non valido o numero fuori intervallo).
+    """
+    flags = FLAG_ON if config.get('on') else 0
+
+    color = config.get('color')
+    rgb = b'\x00\x00\x00'
+    if color == 'random':
+        flags |= FLAG_RANDOM_COLOR
+    elif color is None:
+        flags |= FLAG_NO_COLOR
+    else:
+        match = _COLOR_REGEX.match(color)
+        if not match:
+            raise ValueError(f"Invalid color '{color}'")
+        rgb = bytes.fromhex(match.group(1))
+
+    animation = config.get('animation') or 'none'
+    if animation not in _ANIMATION_CODES:
+        raise ValueError(f"Unknown animation '{animation}'")
+
+    number = config.get('number')
+    if number is None:
+        number = NO_NUMBER
+    elif not 0 <= number < NO_NUMBER:
+        raise ValueError(f"Number {number} out of range")
+
+    return _BINARY_STRUCT.pack(BINARY_VERSION, flags, rgb, _ANIMATION_CODES[animation], number)
+
+
+def decode_binary(data):
+    """
+    Decodifica un payload 'bin1' nella configurazione equivalente (come farebbe il firmware).
+    """
+    version, flags, rgb, animation_code, number = _BINARY_STRUCT.unpack(data)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary format version {version}")
+
+    if flags & FLAG_RANDOM_COLOR:
+        color = 'random'
+    elif flags & FLAG_NO_COLOR:
+        color = None
+    else:
+        color = f"#{rgb.hex()}"
+
+    return {
+        'on': bool(flags & FLAG_ON),
+        'color': color,
+        'animation': ANIMATIONS[animation_code],
+        'number': None if number == NO_NUMBER else number,
+    }
+
+
+def encode_config(config, wire_format):
+    """
+    Codifica la configurazione nel formato indicato.
+
+    Returns:
+        tuple: (payload, formato effettivamente usato). Se la configurazione non è rappresentabile
+               in binario si ricade sul JSON, che il modulo supporta sempre.
+    """
+    if wire_format == FORMAT_BINARY:
+        try:
+            return encode_binary(config), FORMAT_BINARY
+        except ValueError:
+            pass
+    return json.dumps(config), FORMAT_JSON
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I test importano i moduli dell'applicazione come fa app.py, dalla cartella app/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+import itertools
+import json
+
+import pytest
+
+from services import wire_format_service as wire
+
+"""
+Test del formato delle configurazioni inviate ai moduli: round-trip del formato binario 'bin1',
+ricorso al JSON per le configurazioni non rappresentabili e negoziazione del formato.
+"""
+
+COLORS = ['#ffffff', '#000000', '#1a2b3c', 'random', None]
+NUMBERS = [None, 0, 7, 99, 254]
+
+
+@pytest.mark.parametrize('on, color, animation, number', list(itertools.product([True, False], COLORS, wire.ANIMATIONS, NUMBERS)))
+def test_binary_round_trip(on, color, animation, number):
+    config = {'on': on, 'color': color, 'animation': animation, 'number': number}
+    encoded = wire.encode_binary(config)
+    assert len(encoded) == 7
+    assert wire.decode_binary(encoded) == config
+
+
+def test_binary_color_is_lowercased():
+    config = {'on': True, 'color': '#ABCDEF', 'animation': 'flow', 'number': 1}
+    assert wire.decode_binary(wire.encode_binary(config))['color'] == '#abcdef'
+
+
+def test_binary_rejects_unknown_version():
+    encoded = bytearray(wire.encode_binary({'on': True, 'color': None, 'animation': 'none', 'number': None}))
+    encoded[0] = wire.BINARY_VERSION + 1
+    with pytest.raises(ValueError):
+        wire.decode_binary(bytes(encoded))
+
+
+@pytest.mark.parametrize('config', [
+    {'on': True, 'color': '#fff', 'animation': 'none', 'number': 0},
+    {'on': True, 'color': '#ffffff', 'animation': 'sparkle', 'number': 0},
+    {'on': True, 'color': '#ffffff', 'animation': 'none', 'number': 255},
+    {'on': True, 'color': '#ffffff', 'animation': 'none', 'number': -1},
+])
+def test_unencodable_config_falls_back_to_json(config):
+    with pytest.raises(ValueError):
+        wire.encode_binary(config)
+    payload, used_format = wire.encode_config(config, wire.FORMAT_BINARY)
+    assert used_format == wire.FORMAT_JSON
+    assert json.loads(payload) == config
+
+
+def test_encode_config_uses_requested_format():
+    config = {'on': False, 'color': 'random', 'animation': 'pulse', 'number': None}
+    payload, used_format = wire.encode_config(config, wire.FORMAT_BINARY)
+    assert used_format == wire.FORMAT_BINARY and wire.decode_binary(payload) == config
+    payload, used_format = wire.encode_config(config, wire.FORMAT_JSON)
+    assert used_format == wire.FORMAT_JSON and json.loads(payload) == config
+
+
+@pytest.mark.parametrize('announced, expected', [
+    (['json', 'bin1'], wire.FORMAT_BINARY),
+    (['bin1'], wire.FORMAT_BINARY),
+    ('bin1', wire.FORMAT_BINARY),
+    (['json'], wire.FORMAT_JSON),
+    (['cbor'], wire.FORMAT_JSON),
+    ([], wire.FORMAT_JSON),
+    (None, wire.FORMAT_JSON),
+    (42, wire.FORMAT_JSON),
+])
+def test_negotiate_format(announced, expected):
+    assert wire.negotiate_format(announced) == expected